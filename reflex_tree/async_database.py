@@ -0,0 +1,90 @@
+"""Async facade over `database.py` for use inside async event handlers.
+
+SQLite calls block, so they run on a small dedicated thread pool (each worker
+thread gets its own pooled connection from `db_pool`) and the event loop stays
+free to serve other users while a write is in flight.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config, database
+
+_executor = ThreadPoolExecutor(
+    max_workers=config.DB_EXECUTOR_WORKERS,
+    thread_name_prefix="sqlite",
+)
+
+
+async def run(fn, *args, **kwargs):
+    """Runs a blocking database callable on the SQLite thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def init_db():
+    return await run(database.init_db)
+
+
+async def create_user(email, password):
+    return await run(database.create_user, email, password)
+
+
+async def authenticate_user(email, password):
+    return await run(database.authenticate_user, email, password)
+
+
+async def update_node(conversation_id, node_id, content, tokens, cost):
+    return await run(database.update_node, conversation_id, node_id, content, tokens, cost)
+
+
+async def load_conversation(cid, preview_chars=None):
+    return await run(database.load_conversation, cid, preview_chars)
+
+
+async def load_node_contents(conversation_id, node_ids):
+    return await run(database.load_node_contents, conversation_id, node_ids)
+
+
+async def get_user_conversations(email):
+    return await run(database.get_user_conversations, email)
+
+
+async def delete_conversation(email, chat_id):
+    return await run(database.delete_conversation, email, chat_id)
+
+
+async def search_messages(email, query, limit):
+    return await run(database.search_messages, email, query, limit)
+
+
+async def record_usage(email, cost_increment, token_increment, session_id, created_at_iso):
+    return await run(database.record_usage, email, cost_increment, token_increment, session_id, created_at_iso)
+
+
+async def get_usage_rollups(email):
+    return await run(database.get_usage_rollups, email)
+
+
+async def get_summaries(conversation_id, node_ids):
+    return await run(database.get_summaries, conversation_id, node_ids)
+
+
+async def delete_summaries(conversation_id, node_ids):
+    return await run(database.delete_summaries, conversation_id, node_ids)
+
+
+async def save_summary(conversation_id, node_id, path_hash, summary):
+    return await run(database.save_summary, conversation_id, node_id, path_hash, summary)
+
+
+async def get_cached_response(key, min_created_at):
+    return await run(database.get_cached_response, key, min_created_at)
+
+
+async def put_cached_response(key, content, created_at):
+    return await run(database.put_cached_response, key, content, created_at)
+
+
+async def prune_response_cache(min_created_at, max_rows):
+    return await run(database.prune_response_cache, min_created_at, max_rows)
@@ -0,0 +1,187 @@
+"""Write-behind autosave for conversation trees.
+
+Edits only mark a conversation dirty. All marks for the same conversation
+that arrive within `config.AUTOSAVE_WINDOW_S` of the first one are coalesced
+into a single write, so one chat turn (user node + streamed model node) costs
+one transaction instead of one per node.
+
+Durability guarantees:
+- A marked node is written at most AUTOSAVE_WINDOW_S (plus the write itself)
+  after its first mark, provided the process keeps running.
+- `flush()` writes pending changes synchronously before returning; event
+  handlers use `flush_async()`, which runs it on the SQLite thread pool. The
+  app flushes on logout, chat switch, new chat and at interpreter exit, so a
+  clean shutdown loses nothing.
+- A failed write (e.g. SQLITE_BUSY after the busy timeout) is not dropped:
+  its batch is put back, merged with any marks made since, and retried
+  after AUTOSAVE_WINDOW_S. `flush()` re-raises the error after re-queueing.
+- A hard crash (SIGKILL, power loss) can lose at most the last window of
+  edits. Committed writes follow the WAL/synchronous settings in db_pool.
+- Writes are serialized and applied in the order their batches were taken,
+  so a later batch can never be overwritten by an earlier one.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Set
+
+from . import async_database, config, database, db_pool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Pending:
+    email: str
+    nodes_map: Dict[str, Any]
+    deadline: float
+    node_ids: Set[str] = field(default_factory=set)
+    full: bool = False
+
+
+class AutosaveQueue:
+    def __init__(self, window_s: float):
+        self.window_s = window_s
+        self._pending: Dict[str, _Pending] = {}
+        self._lock = threading.Lock()
+        # Held while taking a batch *and* writing it, which keeps writes ordered.
+        self._write_lock = threading.Lock()
+        # Loop that scheduled the last write; retries from pool threads go back to it.
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Scheduled flush tasks, referenced until done so they are not garbage collected.
+        self._tasks: Set[asyncio.Task] = set()
+        self.marks = 0
+        self.writes = 0
+        self.failures = 0
+
+    def mark_dirty(self, email: str, root_id: str, nodes_map: Dict[str, Any], node_id: Optional[str] = None):
+        """Queues `node_id` (or, when None, the whole tree) for the next write.
+
+        `nodes_map` is kept by reference and read at write time, so the latest
+        version of every node is what lands on disk.
+        """
+        if not email or not root_id:
+            return
+        with self._lock:
+            self.marks += 1
+            pending = self._pending.get(root_id)
+            is_new = pending is None
+            if is_new:
+                pending = _Pending(email, nodes_map, time.monotonic() + self.window_s)
+                self._pending[root_id] = pending
+            pending.nodes_map = nodes_map
+            if node_id is None:
+                pending.full = True
+            else:
+                pending.node_ids.add(node_id)
+        if is_new:
+            self._schedule(root_id)
+
+    def discard(self, root_id: str):
+        """Drops pending writes (e.g. the conversation is being deleted)."""
+        with self._write_lock, self._lock:
+            self._pending.pop(root_id, None)
+
+    def flush(self, root_id: Optional[str] = None):
+        """Synchronously writes pending changes for one conversation, or all.
+
+        Every conversation is attempted; the first error is re-raised after
+        the failed batches have been re-queued.
+        """
+        root_ids = [root_id] if root_id else list(self._pending)
+        error = None
+        for rid in root_ids:
+            try:
+                self._flush_one(rid)
+            except Exception as exc:
+                error = error or exc
+        if error is not None:
+            raise error
+
+    async def flush_async(self, root_id: Optional[str] = None):
+        """`flush()` on the SQLite thread pool, for event handlers.
+
+        Errors are logged, not raised: the edits stay queued and are retried.
+        """
+        try:
+            await async_database.run(self.flush, root_id)
+        except Exception as exc:
+            logger.warning("Autosave flush failed for %s: %s", root_id or "all conversations", exc)
+
+    def _schedule(self, root_id: str):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = self._loop
+            if loop is not None and loop.is_running() and not loop.is_closed():
+                # Retry requested from a pool thread: schedule on the app loop.
+                loop.call_soon_threadsafe(self._schedule, root_id)
+                return
+            # No event loop (scripts, shutdown): fall back to a timer thread.
+            timer = threading.Timer(self.window_s, self._flush_timer, args=(root_id,))
+            timer.daemon = True
+            timer.start()
+            return
+        self._loop = loop
+        loop.call_later(self.window_s, self._start_flush, loop, root_id)
+
+    def _start_flush(self, loop: asyncio.AbstractEventLoop, root_id: str):
+        task = loop.create_task(self._flush_async(root_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_async(self, root_id: str):
+        try:
+            await async_database.run(self._flush_one, root_id)
+        except Exception as exc:
+            logger.warning("Autosave failed for %s (will retry): %s", root_id, exc)
+
+    def _flush_timer(self, root_id: str):
+        try:
+            self._flush_one(root_id)
+        except Exception as exc:
+            logger.warning("Autosave failed for %s (will retry): %s", root_id, exc)
+        finally:
+            # Each timer is a new thread; don't leave its connection open
+            db_pool.close_thread()
+
+    def _flush_one(self, root_id: str):
+        with self._write_lock:
+            with self._lock:
+                pending = self._pending.pop(root_id, None)
+            if pending is None:
+                return
+            self.writes += 1
+            try:
+                if pending.full:
+                    database.save_conversation(pending.email, pending.nodes_map, root_id)
+                else:
+                    database.save_nodes(pending.email, pending.nodes_map, root_id, list(pending.node_ids))
+            except Exception:
+                self.failures += 1
+                if self._requeue(root_id, pending):
+                    self._schedule(root_id)
+                raise
+
+    def _requeue(self, root_id: str, failed: _Pending) -> bool:
+        """Puts back a batch whose write failed. True if it needs a new schedule.
+
+        Marks made during the write already started a newer batch (with its
+        own schedule and the newest nodes_map); the failed ids join it.
+        """
+        with self._lock:
+            newer = self._pending.get(root_id)
+            if newer is None:
+                failed.deadline = time.monotonic() + self.window_s
+                self._pending[root_id] = failed
+                return True
+            newer.node_ids |= failed.node_ids
+            newer.full = newer.full or failed.full
+            return False
+
+
+queue = AutosaveQueue(config.AUTOSAVE_WINDOW_S)
+atexit.register(queue.flush)
@@ -0,0 +1,67 @@
+"""Full message bodies for lazily opened conversations.
+
+Opening a chat reads only the tree skeleton (database.load_conversation with
+`preview_chars`): every node is there, but long messages hold a
+ContentPreview. BodyCache swaps in the full text for the nodes actually shown
+and keeps at most `max_entries` of those bodies per session, turning the
+least recently used back into previews. Nodes created in the session always
+keep their full content.
+"""
+from collections import OrderedDict
+from typing import Collection, Dict, Iterable, List
+
+from .classes import ChatNode, ContentPreview
+
+
+class BodyCache:
+    """LRU of nodes hydrated from the database, remembering their previews."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._previews: "OrderedDict[str, ContentPreview]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._previews)
+
+    def missing(self, nodes: Dict[str, ChatNode], node_ids: Iterable[str]) -> List[str]:
+        """Ids among `node_ids` that only hold a preview; the others count as used."""
+        missing = []
+        for node_id in node_ids:
+            node = nodes.get(node_id)
+            if node is None:
+                continue
+            if not node.hydrated:
+                missing.append(node_id)
+            elif node_id in self._previews:
+                self._previews.move_to_end(node_id)
+        return missing
+
+    def fill(self, nodes: Dict[str, ChatNode], contents: Dict[str, str], keep: Collection[str] = ()) -> None:
+        """Installs full `contents`, then evicts down to the cap, sparing `keep`."""
+        for node_id, content in contents.items():
+            node = nodes.get(node_id)
+            if node is None or node.hydrated:
+                continue
+            self._previews[node_id] = node.content
+            node.content = content
+        self._evict(nodes, set(keep))
+
+    def _evict(self, nodes: Dict[str, ChatNode], keep: Collection[str]) -> None:
+        excess = len(self._previews) - self.max_entries
+        for node_id in list(self._previews):
+            if excess <= 0:
+                break
+            if node_id in keep:
+                continue
+            preview = self._previews.pop(node_id)
+            node = nodes.get(node_id)
+            if node is not None:
+                node.content = preview
+            excess -= 1
+
+    def discard(self, node_ids: Iterable[str]) -> None:
+        for node_id in node_ids:
+            self._previews.pop(node_id, None)
+
+    def clear(self) -> None:
+        self._previews.clear()
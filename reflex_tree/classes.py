@@ -3,18 +3,59 @@ import uuid
 from typing import List, Optional
 from pydantic import BaseModel
 
-class ChatNode(BaseModel):
-    id: str
-    role: str = "user"
-    content: str = ""
-    parent_id: Optional[str] = None
-    children_ids: List[str] = []
-    timestamp: str = ""
-    tokens: int = 0
-    cost: float = 0.0
-    model: Optional[str] = None # Added model field
+class ContentPreview(str):
+    """The start of a message body whose full text is still only in the database.
+
+    Lazily opened conversations (see bodies.py) hold these as `content` until
+    the node is shown. The database write paths never store a preview over
+    the real text.
+    """
+
+class ChatNode:
+    """One message of a conversation tree.
+
+    A plain slotted class, not a pydantic model: trees hold many thousands of
+    nodes, and Reflex's state proxies only wrap mutable container and model
+    types, so walking `_nodes` does not pay for change tracking per node.
+    Views sent to the UI are built as dicts (or NodeView) from these.
+    """
+
+    __slots__ = (
+        "id", "role", "content", "parent_id", "children_ids",
+        "timestamp", "tokens", "cost", "model", "is_grafted",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        role: str = "user",
+        content: str = "",
+        parent_id: Optional[str] = None,
+        children_ids: Optional[List[str]] = None,
+        timestamp: str = "",
+        tokens: int = 0,
+        cost: float = 0.0,
+        model: Optional[str] = None,
+        is_grafted: bool = False,
+    ):
+        self.id = id
+        self.role = role
+        self.content = content
+        self.parent_id = parent_id
+        self.children_ids = children_ids if children_ids is not None else []
+        self.timestamp = timestamp
+        self.tokens = tokens
+        self.cost = cost
+        self.model = model
+        self.is_grafted = is_grafted
+
+    def __repr__(self) -> str:
+        return f"ChatNode(id={self.id!r}, role={self.role!r}, parent_id={self.parent_id!r}, children={len(self.children_ids)})"
 
-    is_grafted: bool = False
+    @property
+    def hydrated(self) -> bool:
+        """False while `content` is only a ContentPreview."""
+        return not isinstance(self.content, ContentPreview)
 
     @staticmethod
     def create(role: str, content: str, parent_id: Optional[str] = None, tokens: int = 0, cost: float = 0.0, is_grafted: bool = False, model: Optional[str] = None) -> "ChatNode":
@@ -33,60 +74,71 @@ class ChatNode(BaseModel):
 
 def flatten_tree(node_data: dict, parent_id: Optional[str] = None) -> dict[str, ChatNode]:
     """
-    recursively parses nested dict (from DB) into a flat dict of {id: ChatNode}.
+    Parses a nested tree dict (legacy DB format) into a flat dict of {id: ChatNode}.
+    Iterative, so arbitrarily deep chats cannot hit the recursion limit.
     """
     nodes = {}
-    
-    # Ensure ID exists
     if "id" not in node_data:
         node_data["id"] = str(uuid.uuid4())[:8]
-    
-    current_id = node_data["id"]
-    
-    # Create Children Objects first to get their IDs
-    children_ids = []
-    
-    # Process children
-    for child_data in node_data.get("children", []):
-        child_flat = flatten_tree(child_data, parent_id=current_id)
-        nodes.update(child_flat)
-        children_ids.append(child_data["id"])
-
-    # Create current node
-    node = ChatNode(
-        id=current_id,
-        role=node_data.get("role", "user"),
-        content=node_data.get("content", ""),
-        parent_id=parent_id,
-        children_ids=children_ids,
-        timestamp=node_data.get("timestamp", str(uuid.uuid1())),
-        tokens=node_data.get("tokens", 0),
-        cost=node_data.get("cost", 0.0),
-        is_grafted=node_data.get("is_grafted", False),
-        model=node_data.get("model", None)
-    )
-    nodes[current_id] = node
+
+    stack = [(node_data, parent_id)]
+    while stack:
+        data, parent = stack.pop()
+        children = data.get("children", [])
+        for child_data in children:
+            if "id" not in child_data:
+                child_data["id"] = str(uuid.uuid4())[:8]
+
+        current_id = data["id"]
+        nodes[current_id] = ChatNode(
+            id=current_id,
+            role=data.get("role", "user"),
+            content=data.get("content", ""),
+            parent_id=parent,
+            children_ids=[child_data["id"] for child_data in children],
+            # Only nodes without one get a fresh timestamp
+            timestamp=data["timestamp"] if "timestamp" in data else str(uuid.uuid1()),
+            tokens=data.get("tokens", 0),
+            cost=data.get("cost", 0.0),
+            is_grafted=data.get("is_grafted", False),
+            model=data.get("model", None)
+        )
+        stack.extend((child_data, current_id) for child_data in reversed(children))
     return nodes
 
+def _node_dict(node: ChatNode) -> dict:
+    return {
+        "id": node.id,
+        "role": node.role,
+        "content": node.content,
+        "timestamp": node.timestamp,
+        "tokens": node.tokens,
+        "cost": node.cost,
+        "is_grafted": node.is_grafted,
+        "model": node.model,
+        "children": [],
+    }
+
 def build_tree_dict(nodes: dict[str, ChatNode], root_id: str) -> dict:
     """
-    Reconstructs nested dict from flat dict for DB saving.
+    Reconstructs nested dict from flat dict for DB saving (iteratively).
     """
     if root_id not in nodes:
         return {}
-        
-    root = nodes[root_id]
-    return {
-        "id": root.id,
-        "role": root.role,
-        "content": root.content,
-        "timestamp": root.timestamp,
-        "tokens": root.tokens,
-        "cost": root.cost,
-        "is_grafted": root.is_grafted,
-        "model": root.model,
-        "children": [build_tree_dict(nodes, child_id) for child_id in root.children_ids]
-    }
+
+    tree = _node_dict(nodes[root_id])
+    stack = [(nodes[root_id], tree)]
+    while stack:
+        node, out = stack.pop()
+        for child_id in node.children_ids:
+            child = nodes.get(child_id)
+            if child is None:
+                out["children"].append({})
+                continue
+            child_out = _node_dict(child)
+            out["children"].append(child_out)
+            stack.append((child, child_out))
+    return tree
 
 class NodeView(BaseModel):
     id: str
@@ -0,0 +1,165 @@
+"""Process-wide registry of provider SDK clients.
+
+Each SDK client owns an HTTP connection pool, so handing out the same client
+for a given (provider, api key) keeps keep-alive connections warm across turns
+and users instead of paying a new pool and TLS handshake per message.
+Clients dropped from the registry (idle, over the cap, cleared) are closed
+on the running event loop so their pools and sockets are released promptly.
+Requests hold a `lease` on their client: one evicted mid-stream is closed only
+after its last lease is released, so eviction never aborts a response.
+"""
+import asyncio
+import contextlib
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+import anthropic
+import openai
+from google.genai import Client
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# (provider, sha256(api_key)) -> (client, last_used monotonic time)
+_clients: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()
+_lock = threading.Lock()
+# Pending close tasks, referenced until done so they are not garbage collected.
+_closing: Set[asyncio.Task] = set()
+# id(client) -> open leases; evicted clients still leased wait in _retired.
+_leases: Dict[int, int] = {}
+_retired: Dict[int, Any] = {}
+
+
+def _key_hash(api_key: str) -> str:
+    # Never keep raw keys around as dict keys.
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def _create_client(provider: str, api_key: str) -> Any:
+    if provider == "openai":
+        return openai.AsyncOpenAI(api_key=api_key)
+    if provider == "anthropic":
+        return anthropic.AsyncAnthropic(api_key=api_key)
+    if provider == "google":
+        return Client(api_key=api_key)
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+async def _close_client(client: Any) -> None:
+    try:
+        if isinstance(client, Client):
+            await client.aio.aclose()
+            client.close()
+        else:
+            await client.close()
+    except Exception as e:
+        logger.warning("Closing evicted %s client failed: %s", type(client).__name__, e)
+
+
+def _close_later(evicted: List[Any]) -> None:
+    """Closes `evicted` clients on the running loop (outside `_lock`)."""
+    if not evicted:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return  # no loop (scripts); the clients are released on collection
+    for client in evicted:
+        task = loop.create_task(_close_client(client))
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+
+
+def _closable(evicted: List[Any]) -> List[Any]:
+    """The `evicted` clients nobody is using; leased ones are parked (call under `_lock`)."""
+    ready = []
+    for client in evicted:
+        if _leases.get(id(client)):
+            _retired[id(client)] = client
+        else:
+            ready.append(client)
+    return ready
+
+
+def _evict_idle(now: float, evicted: List[Any]) -> None:
+    # Entries are kept in LRU order, so idle ones are at the front.
+    while _clients:
+        key, (client, last_used) = next(iter(_clients.items()))
+        if now - last_used < config.CLIENT_IDLE_TIMEOUT_S:
+            break
+        _clients.pop(key)
+        evicted.append(client)
+
+
+def get_client(provider: str, api_key: str, leased: bool = False) -> Any:
+    """Returns a shared client for this provider/key, creating it on first use.
+
+    With `leased`, the caller must `release` the client when done (see `lease`).
+    """
+    key = (provider, _key_hash(api_key))
+    now = time.monotonic()
+    evicted: List[Any] = []
+    with _lock:
+        _evict_idle(now, evicted)
+        entry = _clients.pop(key, None)
+        if entry is not None:
+            client = entry[0]
+            _clients[key] = (client, now)
+            if leased:
+                _leases[id(client)] = _leases.get(id(client), 0) + 1
+            evicted = _closable(evicted)
+    if entry is not None:
+        _close_later(evicted)
+        return client
+
+    client = _create_client(provider, api_key)
+    with _lock:
+        # Another caller may have raced us; keep the first client.
+        entry = _clients.pop(key, None)
+        if entry is not None:
+            evicted.append(client)
+            client = entry[0]
+        _clients[key] = (client, now)
+        if leased:
+            _leases[id(client)] = _leases.get(id(client), 0) + 1
+        while len(_clients) > config.CLIENT_POOL_SIZE:
+            evicted.append(_clients.popitem(last=False)[1][0])
+        evicted = _closable(evicted)
+    _close_later(evicted)
+    return client
+
+
+def release(client: Any) -> None:
+    """Drops one lease; closes the client if it was evicted and this was the last."""
+    with _lock:
+        count = _leases.get(id(client), 0) - 1
+        if count > 0:
+            _leases[id(client)] = count
+            return
+        _leases.pop(id(client), None)
+        retired = _retired.pop(id(client), None)
+    if retired is not None:
+        _close_later([retired])
+
+
+@contextlib.contextmanager
+def lease(provider: str, api_key: str) -> Iterator[Any]:
+    """The shared client, kept open until the block exits (wrap each request or stream)."""
+    client = get_client(provider, api_key, leased=True)
+    try:
+        yield client
+    finally:
+        release(client)
+
+
+def clear_clients() -> None:
+    """Drops and closes every cached client (e.g. after rotating keys)."""
+    with _lock:
+        evicted = _closable([client for client, _ in _clients.values()])
+        _clients.clear()
+    _close_later(evicted)
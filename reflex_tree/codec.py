@@ -0,0 +1,128 @@
+"""Storage format for message bodies (`nodes.content`, `response_cache.content`).
+
+Bodies shorter than CONTENT_COMPRESS_MIN_BYTES (UTF-8) are stored as plain
+TEXT, exactly as before, so existing rows need no migration and SQL string
+functions keep working on them. Longer bodies are stored as a BLOB: one
+format version byte followed by the compressed UTF-8 text.
+
+    0x01  zlib  (always available)
+    0x02  zstd  (needs the optional `zstandard` package)
+
+CONTENT_CODEC picks the codec for new writes; reads dispatch on the version
+byte, so rows written under any known codec stay readable. The legacy nested
+tree JSON is parsed with orjson when it is installed.
+"""
+import json
+import logging
+import zlib
+from typing import Callable, Dict, NamedTuple, Optional, Union
+
+from . import config
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZLIB = 0x01
+ZSTD = 0x02
+
+
+class Codec(NamedTuple):
+    name: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+    # Decodes at most `max_bytes` of output from a possibly truncated payload.
+    decompress_prefix: Callable[[bytes, int], bytes]
+
+
+def _zlib_prefix(payload: bytes, max_bytes: int) -> bytes:
+    return zlib.decompressobj().decompress(payload, max_bytes)
+
+
+CODECS: Dict[int, Codec] = {
+    ZLIB: Codec("zlib", lambda data: zlib.compress(data, 6), zlib.decompress, _zlib_prefix),
+}
+
+if zstandard is not None:
+    def _zstd_prefix(payload: bytes, max_bytes: int) -> bytes:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(payload)[:max_bytes]
+
+    CODECS[ZSTD] = Codec(
+        "zstd",
+        zstandard.ZstdCompressor(level=3).compress,
+        # Frames written by ZstdCompressor.compress carry their content size.
+        zstandard.ZstdDecompressor().decompress,
+        _zstd_prefix,
+    )
+
+
+def _writer(name: str) -> Optional[int]:
+    if name == "none":
+        return None
+    for version, codec in CODECS.items():
+        if codec.name == name:
+            return version
+    logger.warning("Content codec %r is not available; using zlib.", name)
+    return ZLIB
+
+
+_write_version = _writer(config.CONTENT_CODEC)
+
+
+def encode(text: Optional[str]) -> Union[str, bytes, None]:
+    """Stored form of a message body: the text itself, or a versioned compressed BLOB."""
+    # Cheap exits first: a str of n chars is at most 4n bytes of UTF-8.
+    if not text or _write_version is None or len(text) * 4 < config.CONTENT_COMPRESS_MIN_BYTES:
+        return text
+    data = text.encode("utf-8")
+    if len(data) < config.CONTENT_COMPRESS_MIN_BYTES:
+        return text
+    packed = CODECS[_write_version].compress(data)
+    if len(packed) + 1 >= len(data):
+        return text  # incompressible; plain text is smaller
+    return bytes((_write_version,)) + packed
+
+
+def _codec(value: bytes) -> Codec:
+    codec = CODECS.get(value[0]) if value else None
+    if codec is None:
+        raise ValueError(f"Unknown content format version: {value[:1]!r}")
+    return codec
+
+
+def decode(value: Union[str, bytes, None]) -> str:
+    """Text of a stored body, whichever form it was written in."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return _codec(value).decompress(memoryview(value)[1:]).decode("utf-8")
+
+
+def decode_prefix(value: Union[str, bytes, None], max_chars: int) -> str:
+    """At most the first `max_chars` characters of a stored body.
+
+    `value` may be cut short (e.g. SQL `substr` of a BLOB); only as much as
+    needed is decompressed.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value[:max_chars]
+    data = _codec(value).decompress_prefix(memoryview(value)[1:], max_chars * 4)
+    return data.decode("utf-8", "ignore")[:max_chars]
+
+
+def load_json(data: Union[str, bytes]):
+    """Parses legacy tree JSON (orjson when available; same errors as json.loads)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
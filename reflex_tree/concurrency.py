@@ -0,0 +1,172 @@
+"""Admission control for model requests.
+
+Two layers, both process-wide:
+- per provider, a semaphore caps in-flight streams so bursts (compare mode,
+  many users) cannot trip provider rate limits for everyone;
+- per user, at most USER_MAX_INFLIGHT generations run at once and further
+  requests wait in a FIFO queue that reports each request's position.
+
+Running generations are also registered per browser session so they can be
+stopped mid-stream (see `track` and `cancel_session`).
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional, Set
+
+from . import config
+
+_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+def provider_slot(provider: str) -> asyncio.Semaphore:
+    """Semaphore bounding in-flight requests to `provider` (use `async with`)."""
+    slot = _slots.get(provider)
+    if slot is None:
+        limit = config.PROVIDER_CONCURRENCY.get(provider, config.DEFAULT_PROVIDER_CONCURRENCY)
+        slot = _slots[provider] = asyncio.Semaphore(limit)
+    return slot
+
+
+class Ticket:
+    """A place in one user's generation queue (see `admit`)."""
+
+    def __init__(self, lane: "_Lane"):
+        self._lane = lane
+        self._admitted = asyncio.Event()
+        self._released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self._admitted.is_set()
+
+    @property
+    def position(self) -> int:
+        """1-based place among the user's waiting requests; 0 once admitted."""
+        if self.admitted or self._released:
+            return 0
+        return self._lane.waiting.index(self) + 1
+
+    async def wait(self, timeout: float) -> bool:
+        """Waits up to `timeout` seconds for admission; True once admitted."""
+        try:
+            await asyncio.wait_for(self._admitted.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.admitted
+
+    def release(self) -> None:
+        """Frees the slot (or leaves the queue); safe to call more than once."""
+        if self._released:
+            return
+        self._released = True
+        self._lane.release(self)
+
+
+class _Lane:
+    def __init__(self, key: str, limit: int):
+        self.key = key
+        self.limit = limit
+        self.active = 0
+        self.waiting: Deque[Ticket] = deque()
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.admitted:
+            self.active -= 1
+        elif ticket in self.waiting:
+            self.waiting.remove(ticket)
+        # FIFO: hand the freed slot to the oldest waiting request.
+        while self.waiting and self.active < self.limit:
+            self.active += 1
+            self.waiting.popleft()._admitted.set()
+        if not self.active and not self.waiting:
+            _lanes.pop(self.key, None)
+
+
+_lanes: Dict[str, _Lane] = {}
+
+
+def admit(user_key: str) -> Ticket:
+    """Queues one generation for `user_key`, admitting it at once if under the cap.
+
+    At most USER_MAX_INFLIGHT generations per user run at a time; the rest
+    wait in FIFO order. Callers must `release()` the ticket when done.
+    """
+    lane = _lanes.get(user_key)
+    if lane is None:
+        lane = _lanes[user_key] = _Lane(user_key, config.USER_MAX_INFLIGHT)
+    ticket = Ticket(lane)
+    if lane.active < lane.limit and not lane.waiting:
+        lane.active += 1
+        ticket._admitted.set()
+    else:
+        lane.waiting.append(ticket)
+    return ticket
+
+
+class Generation:
+    """Cancel handle for one running generation (see `track`).
+
+    `cancel()` cancels the watched tasks (provider streams, search) and wakes
+    the generation's result queue with a stop item so it can keep what has
+    streamed so far.
+    """
+
+    STOP = (None, "", None, None, True)  # queue item: (node_id, delta, usage, error, done)
+
+    def __init__(self, session_key: str):
+        self.session_key = session_key
+        self.cancelled = False
+        self._tasks: Set[asyncio.Task] = set()
+        self._queue: Optional[asyncio.Queue] = None
+
+    def watch(self, task: asyncio.Task) -> asyncio.Task:
+        """Cancels `task` along with the generation."""
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if self.cancelled:
+            task.cancel()
+        return task
+
+    def attach(self, queue: asyncio.Queue) -> None:
+        """Routes the stop item to the queue the generation is reading."""
+        self._queue = queue
+        if self.cancelled:
+            queue.put_nowait(self.STOP)
+
+    def cancel(self) -> None:
+        if self.cancelled:
+            return
+        self.cancelled = True
+        for task in list(self._tasks):
+            task.cancel()
+        if self._queue is not None:
+            self._queue.put_nowait(self.STOP)
+
+    def close(self) -> None:
+        """Unregisters the generation once it has finished; idempotent."""
+        running = _generations.get(self.session_key)
+        if running is not None:
+            running.discard(self)
+            if not running:
+                _generations.pop(self.session_key, None)
+
+
+_generations: Dict[str, Set[Generation]] = {}
+
+
+def track(session_key: str) -> Generation:
+    """Registers a generation so `cancel_session(session_key)` can stop it.
+
+    Callers must `close()` the handle when the generation ends.
+    """
+    gen = Generation(session_key)
+    _generations.setdefault(session_key, set()).add(gen)
+    return gen
+
+
+def cancel_session(session_key: str) -> int:
+    """Cancels every running generation of one browser session; returns how many."""
+    running = list(_generations.get(session_key, ()))
+    for gen in running:
+        gen.cancel()
+    return len(running)
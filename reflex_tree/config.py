@@ -47,59 +47,146 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 SEARCH_API_KEY = os.getenv("TAVILY_API_KEY") or os.getenv("SEARCH_API_KEY")
 
-# Pricing in USD per 1 Million tokens
+# Pricing in USD per 1 Million tokens. CACHED_INPUT_PER_1M is the rate for
+# prompt tokens served from the provider's prompt cache, CACHE_WRITE_PER_1M the
+# rate for prompt tokens written to it (Anthropic only); both default to
+# INPUT_PER_1M. `context_budget` caps the estimated history tokens sent per
+# request (see context.py).
 MODELS = {
 
     "ChatGPT (GPT-5.2 Pro)": {
         "id": "gpt-5.2-pro",
         "provider": "openai",
-        "pricing": {"INPUT_PER_1M": 2.50, "OUTPUT_PER_1M": 10.00}
+        "context_budget": 32000,
+        "pricing": {"INPUT_PER_1M": 2.50, "OUTPUT_PER_1M": 10.00, "CACHED_INPUT_PER_1M": 0.25}
     },
     "ChatGPT (GPT-5.2)": {
         "id": "gpt-5.2", 
         "provider": "openai",
-        "pricing": {"INPUT_PER_1M": 2.50, "OUTPUT_PER_1M": 10.00}
+        "context_budget": 64000,
+        "pricing": {"INPUT_PER_1M": 2.50, "OUTPUT_PER_1M": 10.00, "CACHED_INPUT_PER_1M": 0.25}
     },
     "ChatGPT (GPT-5 Mini)": {
         "id": "gpt-5-mini", 
         "provider": "openai",
-        "pricing": {"INPUT_PER_1M": 0.50, "OUTPUT_PER_1M": 2.00}
+        "context_budget": 64000,
+        "pricing": {"INPUT_PER_1M": 0.50, "OUTPUT_PER_1M": 2.00, "CACHED_INPUT_PER_1M": 0.05}
     },
     "ChatGPT (GPT-5 Nano)": {
         "id": "gpt-5-nano", 
         "provider": "openai",
-        "pricing": {"INPUT_PER_1M": 0.10, "OUTPUT_PER_1M": 0.40}
+        "context_budget": 64000,
+        "pricing": {"INPUT_PER_1M": 0.10, "OUTPUT_PER_1M": 0.40, "CACHED_INPUT_PER_1M": 0.01}
     },
     "Claude 4.5 Opus": {
         "id": "claude-opus-4-5",
         "provider": "anthropic",
-        "pricing": {"INPUT_PER_1M": 15.00, "OUTPUT_PER_1M": 75.00}
+        "context_budget": 32000,
+        "pricing": {"INPUT_PER_1M": 15.00, "OUTPUT_PER_1M": 75.00, "CACHED_INPUT_PER_1M": 1.50, "CACHE_WRITE_PER_1M": 18.75}
     },
     "Claude 4.5 Sonnet": {
         "id": "claude-sonnet-4-5",
         "provider": "anthropic",
-        "pricing": {"INPUT_PER_1M": 3.00, "OUTPUT_PER_1M": 15.00}
+        "context_budget": 64000,
+        "pricing": {"INPUT_PER_1M": 3.00, "OUTPUT_PER_1M": 15.00, "CACHED_INPUT_PER_1M": 0.30, "CACHE_WRITE_PER_1M": 3.75}
     },
     "Claude 4.5 Haiku": {
         "id": "claude-haiku-4-5",
         "provider": "anthropic",
-        "pricing": {"INPUT_PER_1M": 0.25, "OUTPUT_PER_1M": 1.25}
+        "context_budget": 64000,
+        "pricing": {"INPUT_PER_1M": 0.25, "OUTPUT_PER_1M": 1.25, "CACHED_INPUT_PER_1M": 0.025, "CACHE_WRITE_PER_1M": 0.3125}
     },
     "Gemini 2.0 Flash": {
         "id": "gemini-2.0-flash-exp",
         "provider": "google",
-        "pricing": {"INPUT_PER_1M": 0.10, "OUTPUT_PER_1M": 0.40}
+        "context_budget": 64000,
+        "pricing": {"INPUT_PER_1M": 0.10, "OUTPUT_PER_1M": 0.40, "CACHED_INPUT_PER_1M": 0.025}
     },
     "Gemini 3.0 Flash": {
         "id": "gemini-3.0-flash",
         "provider": "google",
-        "pricing": {"INPUT_PER_1M": 0.10, "OUTPUT_PER_1M": 0.40}
+        "context_budget": 64000,
+        "pricing": {"INPUT_PER_1M": 0.10, "OUTPUT_PER_1M": 0.40, "CACHED_INPUT_PER_1M": 0.025}
     },
     "Gemini 3.0 Pro (Preview)": {
         "id": "gemini-3-pro-preview",
         "provider": "google",
-        "pricing": {"INPUT_PER_1M": 2.00, "OUTPUT_PER_1M": 12.00}
+        "context_budget": 32000,
+        "pricing": {"INPUT_PER_1M": 2.00, "OUTPUT_PER_1M": 12.00, "CACHED_INPUT_PER_1M": 0.20}
     }
 }
 
 DEFAULT_MODEL_KEY = "ChatGPT (GPT-5.2)"
+DEFAULT_CONTEXT_BUDGET = 64000  # for MODELS entries without a context_budget
+
+# Streaming: model output is pushed to the UI as it arrives, throttled so the
+# websocket is not flooded with one update per token.
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() != "false"
+STREAM_FLUSH_INTERVAL_MS = 100  # push at least this often while streaming...
+STREAM_FLUSH_TOKENS = 32        # ...or after this many deltas, whichever comes first
+
+# Provider SDK clients are reused across turns (see clients.py).
+CLIENT_POOL_SIZE = 64            # LRU cap on distinct (provider, api key) clients
+CLIENT_IDLE_TIMEOUT_S = 15 * 60  # drop clients unused for this long
+
+# Blocking SQLite work from async handlers runs on this many threads.
+DB_EXECUTOR_WORKERS = 4
+
+# Tavily search endpoint (override to point at a local stub server).
+SEARCH_API_URL = os.getenv("SEARCH_API_URL", "https://api.tavily.com/search")
+SEARCH_TIMEOUT_S = 10
+SEARCH_KEEPALIVE_S = 60          # idle keep-alive connections are closed after this
+SEARCH_CACHE_TTL_S = 10 * 60     # formatted results per normalized query
+SEARCH_CACHE_SIZE = 256
+
+# Lazy chat loading (see bodies.py): messages longer than LAZY_PREVIEW_CHARS
+# are opened as previews and fetched in full when shown; at most
+# BODY_CACHE_SIZE such bodies stay in memory per session.
+LAZY_PREVIEW_CHARS = 200
+BODY_CACHE_SIZE = 500
+
+# "Show Previous Messages" renders the newest HISTORY_PAGE_SIZE messages of
+# the branch; each "Load older" adds another page.
+HISTORY_PAGE_SIZE = 50
+
+# Message bodies of at least CONTENT_COMPRESS_MIN_BYTES are stored compressed
+# (see codec.py). CONTENT_CODEC: "zlib", "zstd" (needs `zstandard`) or "none".
+# Keep the threshold above 4 * LAZY_PREVIEW_CHARS so every compressed body is
+# longer than its preview.
+CONTENT_CODEC = os.getenv("CONTENT_CODEC", "zlib").lower()
+CONTENT_COMPRESS_MIN_BYTES = 1024
+
+# Sidebar search across all of a user's messages (full-text index). The
+# search box sends its query once typing pauses for SEARCH_INPUT_DEBOUNCE_MS.
+MESSAGE_SEARCH_LIMIT = 20
+SEARCH_INPUT_DEBOUNCE_MS = 300
+
+# Sidebar tree rows sent to the client at a time (a scrollable window).
+TREE_WINDOW_ROWS = 50
+
+# Max memoized root-to-node paths per session (see tree_index.PathIndex).
+PATH_CACHE_SIZE = 512
+
+# Write-behind autosave: edits to a conversation within this many seconds are
+# coalesced into one database write (see autosave.py for guarantees).
+AUTOSAVE_WINDOW_S = float(os.getenv("AUTOSAVE_WINDOW_S", "2.0"))
+
+# Summaries substituted for turns that fall outside the context budget
+# (see summaries.py).
+SUMMARY_MAX_TOKENS = 1024
+SUMMARY_SNIPPET_CHARS = 280  # per summarized message
+SUMMARY_CACHE_SIZE = 256     # in-memory entries per session
+
+# Admission control (see concurrency.py): max concurrent model requests per
+# provider across all sessions, and per user. Extra requests wait their turn.
+PROVIDER_CONCURRENCY = {"openai": 16, "anthropic": 8, "google": 16}
+DEFAULT_PROVIDER_CONCURRENCY = 8
+USER_MAX_INFLIGHT = 2            # generations per user; more wait in a FIFO queue
+QUEUE_POLL_INTERVAL_S = 0.5      # how often queued requests refresh their position
+
+# Response cache for identical requests (see response_cache.py).
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "true").lower() != "false"
+RESPONSE_CACHE_TTL_S = 7 * 24 * 3600
+RESPONSE_CACHE_SIZE = 512        # in-memory entries per process
+RESPONSE_CACHE_DB_ROWS = 20000   # rows kept in SQLite
+RESPONSE_CACHE_PRUNE_EVERY = 100 # prune SQLite after this many writes
@@ -0,0 +1,67 @@
+"""Token-budgeted context assembly for model requests.
+
+A branch's full root-to-node history grows without bound, so requests only
+carry the newest turns that fit in the model's `context_budget` (see
+`config.MODELS`). Token counts are estimated locally (roughly 4 characters
+per token for English text) so trimming costs nothing on the request path.
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from . import config
+from .classes import ChatNode
+
+CHARS_PER_TOKEN = 4
+# Role markers and separators the providers add around every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Cheap upper-leaning estimate of the token count of `text`."""
+    if not text:
+        return 0
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def message_tokens(node: ChatNode) -> int:
+    return estimate_tokens(node.content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget(model_key: str) -> int:
+    model_info = config.MODELS.get(model_key, {})
+    return int(model_info.get("context_budget", config.DEFAULT_CONTEXT_BUDGET))
+
+
+@dataclass
+class ContextWindow:
+    # Turns sent verbatim, oldest first (system nodes excluded).
+    messages: List[ChatNode]
+    # Older turns that did not fit, oldest first.
+    dropped: List[ChatNode] = field(default_factory=list)
+    tokens: int = 0
+
+
+def build_window(history: List[ChatNode], budget: int, reserved_tokens: int = 0) -> ContextWindow:
+    """Keeps the newest turns of `history` whose estimated size fits `budget`.
+
+    `reserved_tokens` is taken off the budget first (system prompt, search
+    results). The last message is always kept, even if it alone is over
+    budget, and the window never starts with a model turn (Anthropic requires
+    the first message to come from the user).
+    """
+    turns = [node for node in history if node.role != "system"]
+    remaining = budget - reserved_tokens
+    start = len(turns)
+    used = 0
+    while start > 0:
+        cost = message_tokens(turns[start - 1])
+        if used + cost > remaining and start < len(turns):
+            break
+        used += cost
+        start -= 1
+
+    while start < len(turns) - 1 and turns[start].role != "user":
+        used -= message_tokens(turns[start])
+        start += 1
+
+    return ContextWindow(messages=turns[start:], dropped=turns[:start], tokens=used)
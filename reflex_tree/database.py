@@ -1,11 +1,98 @@
 import sqlite3
 import hashlib
+from . import codec, db_pool
 
 DB_NAME = "chat_users.db"
 
+# One row per chat node; children are ordered by `ordinal` under `parent_id`.
+NODES_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS nodes (
+        conversation_id TEXT NOT NULL,
+        node_id TEXT NOT NULL,
+        parent_id TEXT,
+        ordinal INTEGER DEFAULT 0,
+        role TEXT,
+        content TEXT,
+        timestamp TEXT,
+        tokens INTEGER DEFAULT 0,
+        cost REAL DEFAULT 0.0,
+        is_grafted INTEGER DEFAULT 0,
+        model TEXT,
+        PRIMARY KEY (conversation_id, node_id)
+    )
+'''
+
+# Per-user, per-local-day totals of usage_log, maintained by log_usage so the
+# daily/weekly rollups read at most 7 rows instead of scanning the log.
+USAGE_DAILY_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS usage_daily (
+        email TEXT NOT NULL,
+        day TEXT NOT NULL,
+        cost REAL DEFAULT 0.0,
+        tokens INTEGER DEFAULT 0,
+        PRIMARY KEY (email, day)
+    ) WITHOUT ROWID
+'''
+
+USAGE_LOG_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_usage_log_email_created "
+    "ON usage_log (email, created_at)"
+)
+
+# Cached path summaries (see summaries.py), keyed by the last node covered.
+SUMMARIES_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS summaries (
+        conversation_id TEXT NOT NULL,
+        node_id TEXT NOT NULL,
+        path_hash TEXT NOT NULL,
+        summary TEXT,
+        PRIMARY KEY (conversation_id, node_id)
+    )
+'''
+
+# Model responses keyed by a request hash (see response_cache.py).
+RESPONSE_CACHE_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        content TEXT,
+        created_at REAL NOT NULL
+    )
+'''
+
+# Full-text index over message bodies (see search_messages). Each row shares
+# the rowid of its `nodes` row and is kept in sync by the node write paths.
+# Prefix indexes keep search-as-you-type queries ("py*") cheap. The table is
+# contentless: it holds only the index, not a second, uncompressed copy of
+# every body, so snippets are cut from the decoded `nodes` text instead.
+# SQLite 3.43+ can delete contentless rows by rowid; older versions need the
+# text that was indexed (see _unindex).
+FTS_CONTENTLESS_DELETE = sqlite3.sqlite_version_info >= (3, 43, 0)
+NODES_FTS_TABLE_SQL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS nodes_fts USING fts5(
+        content,
+        content = '',
+        {"contentless_delete = 1," if FTS_CONTENTLESS_DELETE else ""}
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+'''
+
+# Marks around matched terms in search_messages snippets.
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+SNIPPET_TOKENS = 16
+
+CONVERSATIONS_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_conversations_email_updated "
+    "ON conversations (email, updated_at)"
+)
+
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    with db_pool.connection(DB_NAME) as conn:
+        _create_tables(conn.cursor())
+    check_and_migrate()
+
+def _create_tables(c):
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
             email TEXT PRIMARY KEY,
@@ -34,15 +121,26 @@ def init_db():
             email TEXT,
             title TEXT,
             tree_data TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            has_user_input INTEGER DEFAULT 0,
+            node_count INTEGER DEFAULT 0,
+            last_message_at TIMESTAMP
         )
     ''')
-    conn.commit()
-    conn.close()
-    check_and_migrate()
+    # usage_daily is created (and backfilled) by _migrate.
+    c.execute(USAGE_LOG_INDEX_SQL)
+    c.execute(NODES_TABLE_SQL)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes (conversation_id, parent_id, ordinal)")
+    c.execute(SUMMARIES_TABLE_SQL)
+    c.execute(RESPONSE_CACHE_TABLE_SQL)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)")
+    c.execute(CONVERSATIONS_INDEX_SQL)
 
 def check_and_migrate():
-    conn = sqlite3.connect(DB_NAME)
+    with db_pool.connection(DB_NAME) as conn:
+        _migrate(conn)
+
+def _migrate(conn):
     c = conn.cursor()
     # Check if total_tokens column exists
     c.execute("PRAGMA table_info(users)")
@@ -71,34 +169,71 @@ def check_and_migrate():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-        
-    conn.commit()
-    conn.close()
+    c.execute(USAGE_LOG_INDEX_SQL)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_daily'")
+    if c.fetchone() is None:
+        print("Migrating database: Building daily usage rollup table...")
+        c.execute(USAGE_DAILY_TABLE_SQL)
+        c.execute('''
+            INSERT INTO usage_daily (email, day, cost, tokens)
+            SELECT email, date(created_at, 'localtime'), SUM(cost), SUM(tokens)
+            FROM usage_log
+            WHERE email IS NOT NULL
+            GROUP BY email, date(created_at, 'localtime')
+        ''')
+
+    # Conversation trees used to be stored as one nested JSON blob per row.
+    c.execute(NODES_TABLE_SQL)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes (conversation_id, parent_id, ordinal)")
+    c.execute(SUMMARIES_TABLE_SQL)
+    c.execute(RESPONSE_CACHE_TABLE_SQL)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)")
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'nodes_fts'")
+    fts = c.fetchone()
+    if fts is not None and "content = ''" not in fts[0]:
+        # Older index kept its own copy of every body
+        print("Migrating database: Rebuilding full-text index without stored content...")
+        c.execute("DROP TABLE nodes_fts")
+        fts = None
+    if fts is None:
+        print("Migrating database: Building full-text message index...")
+        c.execute(NODES_FTS_TABLE_SQL)
+        # Decoded in Python: compressed bodies are BLOBs (see codec.py)
+        rows = conn.execute("SELECT rowid, content FROM nodes WHERE role != 'system' AND content != ''")
+        c.executemany(
+            "INSERT INTO nodes_fts (rowid, content) VALUES (?, ?)",
+            ((rowid, codec.decode(content)) for rowid, content in rows),
+        )
+    migrate_tree_blobs(conn)
+
+    # Sidebar listing reads denormalized columns instead of walking each tree.
+    c.execute("PRAGMA table_info(conversations)")
+    conversation_columns = [row[1] for row in c.fetchall()]
+    if "has_user_input" not in conversation_columns:
+        print("Migrating database: Adding listing columns to conversations table...")
+        c.execute("ALTER TABLE conversations ADD COLUMN has_user_input INTEGER DEFAULT 0")
+        c.execute("ALTER TABLE conversations ADD COLUMN node_count INTEGER DEFAULT 0")
+        c.execute("ALTER TABLE conversations ADD COLUMN last_message_at TIMESTAMP")
+        _refresh_conversation_stats(c)
+    c.execute(CONVERSATIONS_INDEX_SQL)
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 def create_user(email, password):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO users (email, password_hash, total_cost, total_tokens) VALUES (?, ?, 0.0, 0)", 
-                  (email, hash_password(password)))
-        conn.commit()
+        with db_pool.connection(DB_NAME) as conn:
+            conn.execute("INSERT INTO users (email, password_hash, total_cost, total_tokens) VALUES (?, ?, 0.0, 0)", 
+                         (email, hash_password(password)))
         success = True
     except sqlite3.IntegrityError:
         success = False
-    finally:
-        conn.close()
     return success
 
 def authenticate_user(email, password):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT email, total_cost, total_tokens FROM users WHERE email = ? AND password_hash = ?", 
-              (email, hash_password(password)))
-    row = c.fetchone()
-    conn.close()
+    with db_pool.connection(DB_NAME) as conn:
+        row = conn.execute("SELECT email, total_cost, total_tokens FROM users WHERE email = ? AND password_hash = ?", 
+                           (email, hash_password(password))).fetchone()
     if row:
         return {
             "email": row[0], 
@@ -112,34 +247,57 @@ def update_user_api_keys(email, openai_key, anthropic_key, google_key, tavily_ke
     return
 
 def update_user_stats(email, cost_increment, token_increment):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("UPDATE users SET total_cost = total_cost + ?, total_tokens = total_tokens + ? WHERE email = ?", 
-              (cost_increment, token_increment, email))
-    conn.commit()
-    conn.close()
+    with db_pool.connection(DB_NAME) as conn:
+        _update_user_stats(conn, email, cost_increment, token_increment)
+
+def _update_user_stats(conn, email, cost_increment, token_increment):
+    conn.execute("UPDATE users SET total_cost = total_cost + ?, total_tokens = total_tokens + ? WHERE email = ?", 
+                 (cost_increment, token_increment, email))
 
 def log_usage(email, cost_increment, token_increment, session_id, created_at_iso):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute(
+    with db_pool.connection(DB_NAME) as conn:
+        _log_usage(conn, email, cost_increment, token_increment, session_id, created_at_iso)
+
+def _log_usage(conn, email, cost_increment, token_increment, session_id, created_at_iso):
+    conn.execute(
         "INSERT INTO usage_log (email, session_id, cost, tokens, created_at) VALUES (?, ?, ?, ?, ?)",
         (email, session_id, cost_increment, token_increment, created_at_iso),
     )
-    conn.commit()
-    conn.close()
+    # Same day bucketing the rollup queries have always used.
+    conn.execute(
+        """
+        INSERT INTO usage_daily (email, day, cost, tokens)
+        VALUES (?, date(?, 'localtime'), ?, ?)
+        ON CONFLICT (email, day) DO UPDATE SET
+            cost = cost + excluded.cost,
+            tokens = tokens + excluded.tokens
+        """,
+        (email, created_at_iso, cost_increment, token_increment),
+    )
+
+def record_usage(email, cost_increment, token_increment, session_id, created_at_iso):
+    """Bills one response: user totals, usage log and rollups in one transaction.
+
+    Returns the refreshed rollups (see `get_usage_rollups`).
+    """
+    with db_pool.connection(DB_NAME) as conn:
+        _update_user_stats(conn, email, cost_increment, token_increment)
+        _log_usage(conn, email, cost_increment, token_increment, session_id, created_at_iso)
+        return _usage_rollups(conn.cursor(), email)
 
 def get_usage_rollups(email):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    with db_pool.connection(DB_NAME) as conn:
+        return _usage_rollups(conn.cursor(), email)
+
+def _usage_rollups(c, email):
     c.execute(
         """
         SELECT
             COALESCE(SUM(cost), 0.0),
             COALESCE(SUM(tokens), 0)
-        FROM usage_log
+        FROM usage_daily
         WHERE email = ?
-          AND date(created_at, 'localtime') = date('now', 'localtime')
+          AND day = date('now', 'localtime')
         """,
         (email,),
     )
@@ -149,14 +307,13 @@ def get_usage_rollups(email):
         SELECT
             COALESCE(SUM(cost), 0.0),
             COALESCE(SUM(tokens), 0)
-        FROM usage_log
+        FROM usage_daily
         WHERE email = ?
-          AND date(created_at, 'localtime') >= date('now', '-6 days', 'localtime')
+          AND day >= date('now', '-6 days', 'localtime')
         """,
         (email,),
     )
     weekly_cost, weekly_tokens = c.fetchone()
-    conn.close()
     return {
         "daily_cost": daily_cost,
         "daily_tokens": daily_tokens,
@@ -165,129 +322,644 @@ def get_usage_rollups(email):
     }
 
 def get_user_cost(email):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT total_cost FROM users WHERE email = ?", (email,))
-    row = c.fetchone()
-    conn.close()
+    with db_pool.connection(DB_NAME) as conn:
+        row = conn.execute("SELECT total_cost FROM users WHERE email = ?", (email,)).fetchone()
     return row[0] if row else 0.0
 
 import json
+import re
+import unicodedata
 import uuid
 import datetime
-from .classes import ChatNode, build_tree_dict, flatten_tree
+from .classes import ChatNode, ContentPreview, flatten_tree
 
-def save_conversation(email, nodes_map, root_id, touch_updated_at: bool = True):
-    """
-    Saves a conversation tree to the database for a user.
-    If the root_id already exists for this user, update it.
-    Otherwise create a new entry.
-    """
-    # Convert flat map back to nested dict for storage
-    tree_data = build_tree_dict(nodes_map, root_id)
-    
-    # We use the root node's ID as the conversation ID for simplicity
-    # or we can check if it exists.
-    # The 'conversations' table has: id, user_id, title, root_data, created_at, updated_at
-    # Actually wait, `ChatNode` object has `id`.
-    
-    # Title is the first user message content (truncated)
-    title = "New Chat"
+NODE_COLUMNS = (
+    "conversation_id, node_id, parent_id, ordinal, role, content, "
+    "timestamp, tokens, cost, is_grafted, model"
+)
+
+
+def _node_row(conversation_id, node, ordinal):
+    return (
+        conversation_id,
+        node.id,
+        node.parent_id,
+        ordinal,
+        node.role,
+        node.content,
+        node.timestamp,
+        node.tokens,
+        node.cost,
+        1 if node.is_grafted else 0,
+        node.model,
+    )
+
+
+def _stored(row):
+    """A `nodes` row with its content in stored form (see codec.py)."""
+    return row[:5] + (codec.encode(row[5]),) + row[6:]
+
+
+def _tree_rows(conversation_id, nodes_map, root_id):
+    """Yields one `nodes` row per reachable node, parents before children."""
+    if root_id not in nodes_map:
+        return
+    stack = [(root_id, 0)]
+    while stack:
+        node_id, ordinal = stack.pop()
+        node = nodes_map[node_id]
+        yield _node_row(conversation_id, node, ordinal)
+        child_ids = [cid for cid in node.children_ids if cid in nodes_map]
+        for child_ordinal in range(len(child_ids) - 1, -1, -1):
+            stack.append((child_ids[child_ordinal], child_ordinal))
+
+
+def _tree_dict_rows(conversation_id, tree_data):
+    """Yields `nodes` rows from a legacy nested tree dict (migration only)."""
+    if not tree_data:
+        return
+    if "id" not in tree_data:
+        tree_data["id"] = conversation_id
+    stack = [(tree_data, None, 0)]
+    while stack:
+        data, parent_id, ordinal = stack.pop()
+        node_id = data.get("id") or str(uuid.uuid4())[:8]
+        yield (
+            conversation_id,
+            node_id,
+            parent_id,
+            ordinal,
+            data.get("role", "user"),
+            data.get("content", ""),
+            data.get("timestamp", ""),
+            data.get("tokens", 0),
+            data.get("cost", 0.0),
+            1 if data.get("is_grafted", False) else 0,
+            data.get("model", None),
+        )
+        children = data.get("children", [])
+        for child_ordinal in range(len(children) - 1, -1, -1):
+            stack.append((children[child_ordinal], node_id, child_ordinal))
+
+
+def _conversation_title(nodes_map, root_id):
+    """Title is the first user message content (truncated)."""
+    title = "Conversation"
     root_node = nodes_map.get(root_id)
     if root_node:
-        # Find first user child
-        # This logic requires traversal.
-        # Simple for now: just use root content if it's user (it's usually system)
-        pass
+        for child_id in root_node.children_ids:
+            child = nodes_map.get(child_id)
+            if child and child.role == "user":
+                title = child.content[:30]
+                break
+    return title
+
+
+def _refresh_conversation_stats(cursor, cid=None):
+    """Recomputes the denormalized listing columns from `nodes` rows."""
+    sql = '''
+        UPDATE conversations SET
+            node_count = (
+                SELECT COUNT(*) FROM nodes n WHERE n.conversation_id = conversations.id
+            ),
+            has_user_input = EXISTS (
+                SELECT 1 FROM nodes n
+                WHERE n.conversation_id = conversations.id
+                  AND n.role = 'user'
+                  AND (typeof(n.content) = 'blob' OR trim(n.content) != '')
+            ),
+            last_message_at = COALESCE(last_message_at, updated_at)
+    '''
+    if cid is None:
+        cursor.execute(sql)
+    else:
+        cursor.execute(sql + " WHERE id = ?", (cid,))
+
+
+def _has_user_input(node):
+    return node.role == "user" and bool((node.content or "").strip())
+
+
+def _with_stored_content(cursor, conversation_id, rows):
+    """Replaces ContentPreview bodies in `nodes` rows with the stored text."""
+    stale = [row[1] for row in rows if isinstance(row[5], ContentPreview)]
+    if not stale:
+        return rows
+    stored = load_node_contents(conversation_id, stale, cursor=cursor)
+    return [
+        row[:5] + (stored.get(row[1], row[5]),) + row[6:] if isinstance(row[5], ContentPreview) else row
+        for row in rows
+    ]
+
+
+def _searchable(role, content):
+    return role != "system" and bool(content)
+
+
+def _index_content(cursor, conversation_id, node_id, role, content):
+    """Indexes one stored node's new content (after `_unindex` of its old one)."""
+    if not _searchable(role, content):
+        return
+    cursor.execute(
+        """
+        INSERT INTO nodes_fts (rowid, content)
+        SELECT rowid, ? FROM nodes WHERE conversation_id = ? AND node_id = ?
+        """,
+        (content, conversation_id, node_id),
+    )
+
+
+def _index_rows(cursor, rows):
+    """Indexes freshly inserted `nodes` rows (tuples in NODE_COLUMNS order)."""
+    cursor.executemany(
+        """
+        INSERT INTO nodes_fts (rowid, content)
+        SELECT rowid, ? FROM nodes WHERE conversation_id = ? AND node_id = ?
+        """,
+        [(row[5], row[0], row[1]) for row in rows if _searchable(row[4], row[5])],
+    )
+
+
+def _unindex(cursor, where, params):
+    """Drops the full-text entries of the `nodes` rows matching `where`.
+
+    Call before those rows' content changes or they are deleted: without
+    contentless_delete, FTS5 forgets a row only when given the indexed text.
+    """
+    if FTS_CONTENTLESS_DELETE:
+        cursor.execute(f"DELETE FROM nodes_fts WHERE rowid IN (SELECT rowid FROM nodes WHERE {where})", params)
+        return
+    cursor.execute(f"SELECT rowid, role, content FROM nodes WHERE {where}", params)
+    indexed = [(rowid, role, codec.decode(content)) for rowid, role, content in cursor.fetchall()]
+    cursor.executemany(
+        "INSERT INTO nodes_fts (nodes_fts, rowid, content) VALUES ('delete', ?, ?)",
+        [(rowid, content) for rowid, role, content in indexed if _searchable(role, content)],
+    )
+
+
+def _unindex_node(cursor, conversation_id, node_id):
+    _unindex(cursor, "conversation_id = ? AND node_id = ?", (conversation_id, node_id))
+
+
+def _unindex_conversation(cursor, conversation_id):
+    """Drops a conversation's full-text entries (call before deleting its nodes)."""
+    _unindex(cursor, "conversation_id = ?", (conversation_id,))
 
-    # Basic Save Implementation
-    with sqlite3.connect("chat_users.db") as conn:
+
+def migrate_tree_blobs(conn):
+    """Moves legacy `conversations.tree_data` JSON blobs into `nodes` rows."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, tree_data FROM conversations WHERE tree_data IS NOT NULL")
+    rows = cursor.fetchall()
+    if not rows:
+        return
+    print(f"Migrating database: Moving {len(rows)} conversation trees into nodes table...")
+    for cid, tree_data in rows:
+        try:
+            data = codec.load_json(tree_data) if tree_data else {}
+        except json.JSONDecodeError:
+            print(f"Skipping conversation {cid}: tree_data is not valid JSON.")
+            continue
+        _unindex_conversation(cursor, cid)
+        cursor.execute("DELETE FROM nodes WHERE conversation_id = ?", (cid,))
+        node_rows = list(_tree_dict_rows(cid, data))
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO nodes ({NODE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [_stored(row) for row in node_rows],
+        )
+        _index_rows(cursor, node_rows)
+        cursor.execute("UPDATE conversations SET tree_data = NULL WHERE id = ?", (cid,))
+    conversation_columns = [row[1] for row in cursor.execute("PRAGMA table_info(conversations)")]
+    if "has_user_input" in conversation_columns:
+        for cid, _ in rows:
+            _refresh_conversation_stats(cursor, cid)
+
+
+def save_conversation(email, nodes_map, root_id, touch_updated_at: bool = True):
+    """
+    Saves a whole conversation tree to the database for a user.
+    Every node is rewritten, so prefer `save_node` when only one node changed.
+    """
+    # We use the root node's ID as the conversation ID
+    with db_pool.connection(DB_NAME) as conn:
         cursor = conn.cursor()
-        
-        # Check if exists
+
         cursor.execute("SELECT id FROM conversations WHERE id = ? AND email = ?", (root_id, email))
         exists = cursor.fetchone()
-        
-        json_data = json.dumps(tree_data)
         now = datetime.datetime.now().isoformat()
-        
+
+        rows = _with_stored_content(cursor, root_id, list(_tree_rows(root_id, nodes_map, root_id)))
+        has_user_input = any(_has_user_input(nodes_map[row[1]]) for row in rows)
+        title = _conversation_title(nodes_map, root_id)
+
         if exists:
-            if touch_updated_at:
-                cursor.execute(
-                    "UPDATE conversations SET tree_data = ?, updated_at = ? WHERE id = ?",
-                    (json_data, now, root_id),
-                )
-            else:
+            cursor.execute(
+                f"""
+                UPDATE conversations SET
+                    {"updated_at = :now, last_message_at = :now," if touch_updated_at else ""}
+                    title = CASE WHEN title = 'Conversation' THEN :title ELSE title END,
+                    has_user_input = :has_user_input,
+                    node_count = :node_count
+                WHERE id = :id
+                """,
+                {
+                    "now": now,
+                    "title": title,
+                    "has_user_input": int(has_user_input),
+                    "node_count": len(rows),
+                    "id": root_id,
+                },
+            )
+        else:
+            cursor.execute(
+                """
+                INSERT INTO conversations
+                    (id, email, title, tree_data, updated_at, has_user_input, node_count, last_message_at)
+                VALUES (?, ?, ?, NULL, ?, ?, ?, ?)
+                """,
+                (root_id, email, title, now, int(has_user_input), len(rows), now),
+            )
+
+        _unindex_conversation(cursor, root_id)
+        cursor.execute("DELETE FROM nodes WHERE conversation_id = ?", (root_id,))
+        cursor.executemany(
+            f"INSERT INTO nodes ({NODE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [_stored(row) for row in rows],
+        )
+        _index_rows(cursor, rows)
+
+
+def save_node(email, nodes_map, root_id, node_id):
+    """
+    Append-only write path: persists a single (new or changed) node.
+    Falls back to a full `save_conversation` the first time a tree is stored.
+    """
+    save_nodes(email, nodes_map, root_id, [node_id])
+
+
+def save_nodes(email, nodes_map, root_id, node_ids):
+    """Persists several new or changed nodes of one tree in a single transaction."""
+    nodes = [nodes_map[nid] for nid in node_ids if nid in nodes_map]
+    if not nodes:
+        return
+
+    with db_pool.connection(DB_NAME) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM conversations WHERE id = ? AND email = ?", (root_id, email))
+        exists = cursor.fetchone()
+        if exists:
+            added = 0
+            has_user_input = False
+            title = None
+            for node in nodes:
+                ordinal = 0
+                parent = nodes_map.get(node.parent_id) if node.parent_id else None
+                if parent and node.id in parent.children_ids:
+                    ordinal = parent.children_ids.index(node.id)
+                row = _node_row(root_id, node, ordinal)
+                stored = _stored(row)
                 cursor.execute(
-                    "UPDATE conversations SET tree_data = ? WHERE id = ?",
-                    (json_data, root_id),
+                    f"INSERT OR IGNORE INTO nodes ({NODE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    stored,
                 )
-        else:
-            # Generate a title
-            # Search for first user message
-            title = "Conversation"
-            # Traverse a bit? 
-            # root_node -> children.
-            if root_node:
-                for child_id in root_node.children_ids:
-                    child = nodes_map.get(child_id)
-                    if child and child.role == "user":
-                        title = child.content[:30]
-                        break
-            
-            cursor.execute("INSERT INTO conversations (id, email, title, tree_data, updated_at) VALUES (?, ?, ?, ?, ?)",
-                           (root_id, email, title, json_data, now))
-        conn.commit()
+                if cursor.rowcount == 1:
+                    added += 1
+                elif isinstance(row[5], ContentPreview):
+                    # Only the preview is in memory; keep the stored text
+                    cursor.execute(
+                        """
+                        UPDATE nodes SET
+                            parent_id = ?, ordinal = ?, role = ?, timestamp = ?,
+                            tokens = ?, cost = ?, is_grafted = ?, model = ?
+                        WHERE conversation_id = ? AND node_id = ?
+                        """,
+                        row[2:5] + row[6:] + row[:2],
+                    )
+                    continue
+                else:
+                    _unindex_node(cursor, root_id, node.id)
+                    cursor.execute(
+                        """
+                        UPDATE nodes SET
+                            parent_id = ?, ordinal = ?, role = ?, content = ?, timestamp = ?,
+                            tokens = ?, cost = ?, is_grafted = ?, model = ?
+                        WHERE conversation_id = ? AND node_id = ?
+                        """,
+                        stored[2:] + stored[:2],
+                    )
+                _index_content(cursor, root_id, node.id, node.role, row[5])
+                has_user_input = has_user_input or _has_user_input(node)
+                if title is None and node.role == "user" and node.parent_id == root_id:
+                    title = (node.content or "")[:30]
+
+            now = datetime.datetime.now().isoformat()
+            cursor.execute(
+                """
+                UPDATE conversations SET
+                    updated_at = :now,
+                    last_message_at = :now,
+                    node_count = node_count + :added,
+                    has_user_input = MAX(has_user_input, :has_user_input),
+                    title = CASE WHEN title = 'Conversation' AND :title IS NOT NULL THEN :title ELSE title END
+                WHERE id = :id
+                """,
+                {
+                    "now": now,
+                    "added": added,
+                    "has_user_input": int(has_user_input),
+                    "title": title,
+                    "id": root_id,
+                },
+            )
+    if not exists:
+        save_conversation(email, nodes_map, root_id)
+
+
+def update_node(conversation_id, node_id, content, tokens, cost):
+    """Sets a stored node's final content and stats. Never inserts, so a
+    conversation deleted in the meantime stays deleted."""
+    with db_pool.connection(DB_NAME) as conn:
+        cursor = conn.cursor()
+        _unindex_node(cursor, conversation_id, node_id)
+        cursor.execute(
+            "UPDATE nodes SET content = ?, tokens = ?, cost = ? WHERE conversation_id = ? AND node_id = ?",
+            (codec.encode(content), tokens, cost, conversation_id, node_id),
+        )
+        if cursor.rowcount:
+            _index_content(cursor, conversation_id, node_id, "model", content)
+
 
 def get_user_conversations(email):
-    with sqlite3.connect("chat_users.db") as conn:
+    with db_pool.connection(DB_NAME) as conn:
         cursor = conn.cursor()
+        # Only list conversations that contain a non-empty user message.
+        # Served by idx_conversations_email_updated; no tree is read.
         cursor.execute(
-            "SELECT id, title, updated_at, tree_data FROM conversations WHERE email = ? ORDER BY updated_at DESC",
+            """
+            SELECT id, title, updated_at
+            FROM conversations
+            WHERE email = ? AND has_user_input = 1
+            ORDER BY updated_at DESC
+            """,
             (email,),
         )
-        rows = cursor.fetchall()
-        filtered = []
-        for cid, title, updated_at, tree_data in rows:
-            try:
-                data = json.loads(tree_data) if tree_data else {}
-            except json.JSONDecodeError:
-                data = {}
-            if _conversation_has_user_input(data):
-                filtered.append((cid, title, updated_at))
-        return filtered
-
-
-def _conversation_has_user_input(tree_data: dict) -> bool:
-    """Return True when a conversation contains a non-empty user message."""
-    if not tree_data:
-        return False
-    stack = [tree_data]
-    while stack:
-        node = stack.pop()
-        if node.get("role") == "user" and node.get("content", "").strip():
-            return True
-        stack.extend(node.get("children", []))
-    return False
+        return cursor.fetchall()
+
+
+def _nodes_from_rows(rows) -> dict[str, ChatNode]:
+    nodes = {}
+    for (node_id, parent_id, role, content, timestamp, tokens, cost, is_grafted, model, *truncated) in rows:
+        content = codec.decode(content)
+        if truncated and truncated[0]:
+            content = ContentPreview(content)
+        nodes[node_id] = ChatNode(
+            id=node_id,
+            role=role or "user",
+            content=content,
+            parent_id=parent_id,
+            children_ids=[],
+            timestamp=timestamp or "",
+            tokens=tokens or 0,
+            cost=cost or 0.0,
+            is_grafted=bool(is_grafted),
+            model=model,
+        )
+    # Rows are ordered by (parent_id, ordinal), so children keep their order.
+    for node in nodes.values():
+        if node.parent_id and node.parent_id in nodes:
+            nodes[node.parent_id].children_ids.append(node.id)
+    return nodes
 
 
-def load_conversation(cid):
-    with sqlite3.connect("chat_users.db") as conn:
+def load_conversation(cid, preview_chars=None):
+    """Loads a conversation as {node_id: ChatNode}, or None if it does not exist.
+
+    With `preview_chars`, only the tree skeleton is read in full: longer
+    message bodies are cut to a ContentPreview of that many characters, to be
+    fetched with `load_node_contents` when shown.
+    """
+    with db_pool.connection(DB_NAME) as conn:
         cursor = conn.cursor()
+        if preview_chars:
+            cursor.execute(
+                """
+                SELECT node_id, parent_id, role,
+                       substr(content, 1, CASE WHEN typeof(content) = 'blob' THEN :blob_bytes ELSE :chars END),
+                       timestamp, tokens, cost, is_grafted, model
+                FROM nodes
+                WHERE conversation_id = :cid
+                ORDER BY parent_id, ordinal
+                """,
+                # One extra character tells truncated bodies apart without
+                # length(), which would read every body in full. Compressed
+                # bodies are always longer than a preview; only the start of
+                # the BLOB is read and decompressed.
+                {"chars": preview_chars + 1, "blob_bytes": (preview_chars + 1) * 4, "cid": cid},
+            )
+            rows = []
+            for row in cursor.fetchall():
+                head = row[3]
+                if isinstance(head, bytes):
+                    rows.append(row[:3] + (codec.decode_prefix(head, preview_chars),) + row[4:] + (True,))
+                elif len(head or "") <= preview_chars:
+                    rows.append(row + (False,))
+                else:
+                    rows.append(row[:3] + (head[:preview_chars],) + row[4:] + (True,))
+        else:
+            cursor.execute(
+                """
+                SELECT node_id, parent_id, role, content, timestamp, tokens, cost, is_grafted, model
+                FROM nodes
+                WHERE conversation_id = ?
+                ORDER BY parent_id, ordinal
+                """,
+                (cid,),
+            )
+            rows = cursor.fetchall()
+        if rows:
+            return _nodes_from_rows(rows)
+
+        # Legacy row that has not been migrated yet.
         cursor.execute("SELECT tree_data FROM conversations WHERE id = ?", (cid,))
         row = cursor.fetchone()
-        if row:
-            data = json.loads(row[0])
-            # Return flattened dict
-            return flatten_tree(data)
+        if row and row[0]:
+            return flatten_tree(codec.load_json(row[0]))
     return None
 
 
+def _select_nodes_in(cursor, sql, conversation_id, node_ids):
+    """Yields the rows of `sql` for one conversation's `node_ids`.
+
+    `sql` binds the conversation id first and has an `{ids}` slot for the
+    IN list, which is filled in chunks to stay well below SQLite's
+    bound-parameter limit.
+    """
+    node_ids = list(node_ids)
+    for start in range(0, len(node_ids), 500):
+        chunk = node_ids[start:start + 500]
+        cursor.execute(sql.format(ids=", ".join("?" * len(chunk))), (conversation_id, *chunk))
+        yield from cursor.fetchall()
+
+
+def load_node_contents(conversation_id, node_ids, cursor=None):
+    """Full stored content of some nodes of one conversation, as {node_id: content}."""
+    if cursor is None:
+        with db_pool.connection(DB_NAME) as conn:
+            return load_node_contents(conversation_id, node_ids, conn.cursor())
+    rows = _select_nodes_in(
+        cursor,
+        "SELECT node_id, content FROM nodes WHERE conversation_id = ? AND node_id IN ({ids})",
+        conversation_id,
+        node_ids,
+    )
+    return {node_id: codec.decode(content) for node_id, content in rows}
+
+
+def _match_expression(query):
+    """FTS5 query for free text: every word must match, the last as a prefix."""
+    words = re.findall(r"\w+", query or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def _fold(word):
+    """Case- and accent-insensitive form, like the unicode61 tokenizer's."""
+    decomposed = unicodedata.normalize("NFKD", word.casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _snippet(text, query):
+    """About SNIPPET_TOKENS words of `text` around the first match of `query`.
+
+    Stands in for FTS5's snippet(), which contentless tables cannot serve:
+    matched words are wrapped in SNIPPET_START / SNIPPET_END, cut ends in '…'.
+    """
+    words = [_fold(word) for word in re.findall(r"\w+", query or "")]
+    if not words:
+        return ""
+    exact, prefix = set(words[:-1]), words[-1]
+
+    def matches(token):
+        folded = _fold(token)
+        return folded in exact or folded.startswith(prefix)
+
+    tokens = list(re.finditer(r"\w+", text))
+    if not tokens:
+        return ""
+    first = next((i for i, m in enumerate(tokens) if matches(m.group())), 0)
+    start = max(0, min(first - SNIPPET_TOKENS // 4, len(tokens) - SNIPPET_TOKENS))
+    end = min(len(tokens), start + SNIPPET_TOKENS)
+    parts = ["…" if start > 0 else ""]
+    pos = tokens[start].start()
+    for m in tokens[start:end]:
+        if matches(m.group()):
+            parts.append(text[pos:m.start()] + SNIPPET_START + m.group() + SNIPPET_END)
+            pos = m.end()
+    parts.append(text[pos:tokens[end - 1].end()])
+    if end < len(tokens):
+        parts.append("…")
+    return "".join(parts)
+
+
+def search_messages(email, query, limit):
+    """Best `limit` messages of `email`'s conversations matching `query`.
+
+    Ranked by bm25; each result is (conversation_id, node_id, role, title,
+    snippet), with matched terms wrapped in SNIPPET_START / SNIPPET_END.
+    """
+    match = _match_expression(query)
+    if match is None:
+        return []
+    with db_pool.connection(DB_NAME) as conn:
+        rows = conn.execute(
+            """
+            SELECT n.conversation_id, n.node_id, n.role, c.title, n.content
+            FROM nodes_fts
+            JOIN nodes n ON n.rowid = nodes_fts.rowid
+            JOIN conversations c ON c.id = n.conversation_id
+            WHERE nodes_fts MATCH ? AND c.email = ?
+            ORDER BY nodes_fts.rank
+            LIMIT ?
+            """,
+            (match, email, limit),
+        ).fetchall()
+    return [
+        (cid, node_id, role, title, _snippet(codec.decode(content), query))
+        for cid, node_id, role, title, content in rows
+    ]
+
+
 def delete_conversation(email, chat_id):
-    with sqlite3.connect("chat_users.db") as conn:
+    with db_pool.connection(DB_NAME) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "DELETE FROM conversations WHERE id = ? AND email = ?",
             (chat_id, email),
         )
-        conn.commit()
+        if cursor.rowcount:
+            _unindex_conversation(cursor, chat_id)
+            cursor.execute("DELETE FROM nodes WHERE conversation_id = ?", (chat_id,))
+            cursor.execute("DELETE FROM summaries WHERE conversation_id = ?", (chat_id,))
+
+
+def get_summaries(conversation_id, node_ids):
+    """Stored summaries for `node_ids`, as {node_id: (path_hash, summary)}."""
+    if not node_ids:
+        return {}
+    with db_pool.connection(DB_NAME) as conn:
+        rows = _select_nodes_in(
+            conn.cursor(),
+            "SELECT node_id, path_hash, summary FROM summaries WHERE conversation_id = ? AND node_id IN ({ids})",
+            conversation_id,
+            node_ids,
+        )
+        return {node_id: (path_hash, summary) for node_id, path_hash, summary in rows}
+
+
+def save_summary(conversation_id, node_id, path_hash, summary):
+    with db_pool.connection(DB_NAME) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO summaries (conversation_id, node_id, path_hash, summary) VALUES (?, ?, ?, ?)",
+            (conversation_id, node_id, path_hash, summary),
+        )
+
+
+def delete_summaries(conversation_id, node_ids):
+    with db_pool.connection(DB_NAME) as conn:
+        conn.executemany(
+            "DELETE FROM summaries WHERE conversation_id = ? AND node_id = ?",
+            [(conversation_id, node_id) for node_id in node_ids],
+        )
+
+
+def get_cached_response(key, min_created_at):
+    """(content, created_at) for `key` if stored after `min_created_at`."""
+    with db_pool.connection(DB_NAME) as conn:
+        row = conn.execute(
+            "SELECT content, created_at FROM response_cache WHERE key = ? AND created_at >= ?",
+            (key, min_created_at),
+        ).fetchone()
+    return (codec.decode(row[0]), row[1]) if row else None
+
+
+def put_cached_response(key, content, created_at):
+    with db_pool.connection(DB_NAME) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, content, created_at) VALUES (?, ?, ?)",
+            (key, codec.encode(content), created_at),
+        )
+
+
+def prune_response_cache(min_created_at, max_rows):
+    """Drops expired entries, then the oldest ones beyond `max_rows`."""
+    with db_pool.connection(DB_NAME) as conn:
+        conn.execute("DELETE FROM response_cache WHERE created_at < ?", (min_created_at,))
+        conn.execute(
+            """
+            DELETE FROM response_cache WHERE key IN (
+                SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (max_rows,),
+        )
@@ -0,0 +1,92 @@
+"""Pooled SQLite connections for `database.py`.
+
+Each thread keeps one open connection per database file instead of calling
+`sqlite3.connect` for every query. Connections run in WAL mode so readers do
+not block the writer, and keep a statement cache so repeated queries skip
+re-preparing their SQL.
+"""
+import contextlib
+import sqlite3
+import threading
+from typing import Iterator, Set
+
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+# Every pooled connection, so close_all() can reach other threads' connections.
+_all_connections: Set[sqlite3.Connection] = set()
+_all_lock = threading.Lock()
+# Bumped by close_all() so threads drop connections that were closed under them.
+_generation = 0
+
+
+def _open(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable across application crashes in WAL mode; only an OS
+    # crash or power loss can roll back the most recent commits.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    with _all_lock:
+        _all_connections.add(conn)
+    return conn
+
+
+def get_connection(path: str) -> sqlite3.Connection:
+    """Returns this thread's connection to `path`, opening it on first use."""
+    conns = getattr(_local, "connections", None)
+    if conns is None or getattr(_local, "generation", None) != _generation:
+        conns = _local.connections = {}
+        _local.generation = _generation
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = _open(path)
+    return conn
+
+
+@contextlib.contextmanager
+def connection(path: str) -> Iterator[sqlite3.Connection]:
+    """Yields the pooled connection; commits on success, rolls back on error."""
+    conn = get_connection(path)
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def close_thread() -> None:
+    """Closes the calling thread's connections (for short-lived threads)."""
+    conns = getattr(_local, "connections", None)
+    if not conns:
+        return
+    _local.connections = {}
+    with _all_lock:
+        _all_connections.difference_update(conns.values())
+    for conn in conns.values():
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            pass
+
+
+def close_all() -> None:
+    """Closes every pooled connection (shutdown, or before swapping DB files)."""
+    global _generation
+    with _all_lock:
+        conns = list(_all_connections)
+        _all_connections.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            pass
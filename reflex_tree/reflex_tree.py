@@ -24,8 +24,8 @@ def tree_row(node: dict):
     # node is a Var (Any) from the list check type
     node = node.to(dict)
     
-    # is_active = (state.State.current_node_id == node["id"].to(str)) # Deprecated
-    is_selected = node["is_selected"].to(bool)
+    # Selection lives outside the rows so moving it doesn't touch flat_tree.
+    is_selected = node["id"].to(str) == state.State.selected_tree_node_id
     indent = node["indent"].to(int)
     
     return rx.context_menu.root(
@@ -50,13 +50,13 @@ def tree_row(node: dict):
                             # Label
                             rx.cond(
                                 node["role"].to(str) == "model",
-                                rx.text(f"A: {node['content'].to_string()[:30]}...", color="purple"),
+                                rx.text(f"A: {node['preview'].to(str)}...", color="purple"),
                                 rx.hstack(
                                     rx.cond(
                                         node["index_label"].to(str) != "",
                                         rx.text(node["index_label"].to(str), font_weight="bold", color="gray", margin_right="4px"),
                                     ),
-                                    rx.text(f"{node['content'].to(str)[:30]}...", color="green")
+                                    rx.text(f"{node['preview'].to(str)}...", color="green")
                                 )
                             ),
                             rx.cond(
@@ -101,6 +101,37 @@ def tree_row(node: dict):
         )
     )
 
+def tree_rows():
+    """The sidebar tree window, with buttons paging it when rows are off-window."""
+    return rx.vstack(
+        rx.cond(
+            state.State.tree_rows_above > 0,
+            rx.button(
+                "▲ " + state.State.tree_rows_above.to(str) + " earlier",
+                on_click=lambda: state.State.shift_tree_window(-1),
+                variant="ghost",
+                size="1",
+                width="100%"
+            ),
+        ),
+        rx.foreach(
+            state.State.flat_tree.to(list),
+            tree_row
+        ),
+        rx.cond(
+            state.State.tree_rows_below > 0,
+            rx.button(
+                "▼ " + state.State.tree_rows_below.to(str) + " later",
+                on_click=lambda: state.State.shift_tree_window(1),
+                variant="ghost",
+                size="1",
+                width="100%"
+            ),
+        ),
+        spacing="0", # Tight spacing
+        width="100%"
+    )
+
 def login_modal():
     return rx.dialog.root(
         rx.dialog.content(
@@ -209,6 +240,58 @@ def settings_modal():
         on_open_change=state.State.toggle_settings_modal,
     )
 
+def compare_checkbox(model_key: str):
+    return rx.checkbox(
+        model_key,
+        checked=state.State.compare_model_keys.contains(model_key),
+        on_change=lambda _checked: state.State.toggle_compare_model(model_key),
+        size="1",
+    )
+
+def compare_picker():
+    """Extra models that answer each prompt in parallel, as sibling answers."""
+    return rx.popover.root(
+        rx.popover.trigger(
+            rx.button(
+                rx.icon("columns-2", size=14),
+                rx.cond(
+                    state.State.compare_model_keys.length() > 0,
+                    "Compare (" + state.State.compare_model_keys.length().to(str) + ")",
+                    "Compare",
+                ),
+                size="1",
+                variant="outline",
+                width="100%",
+            ),
+        ),
+        rx.popover.content(
+            rx.vstack(
+                rx.text("Also answer with", size="1", weight="bold"),
+                *[compare_checkbox(model_key) for model_key in config.MODELS],
+                spacing="1",
+            ),
+        ),
+    )
+
+def message_hit_row(hit: state.MessageHit):
+    """A full-text search result: conversation title and the matching snippet."""
+    return rx.box(
+        rx.text(hit.title, size="1", weight="bold", color="gray", trim="both"),
+        rx.text(
+            rx.foreach(
+                hit.parts,
+                lambda part, i: rx.text.span(part, weight=rx.cond(i % 2 == 1, "bold", "regular")),
+            ),
+            size="1",
+        ),
+        on_click=lambda: state.State.open_message_hit(hit.conversation_id, hit.node_id),
+        cursor="pointer",
+        padding="2",
+        border_radius="4px",
+        width="100%",
+        _hover={"bg": rx.color("gray", 3)},
+    )
+
 def sidebar():
     return rx.vstack(
         rx.hstack(
@@ -225,6 +308,7 @@ def sidebar():
            on_change=state.State.set_selected_model_key,
            width="100%"
         ),
+        compare_picker(),
         rx.button("API Settings", on_click=state.State.toggle_settings_modal, size="1", variant="outline", width="100%"),
         settings_modal(),
         # Usage Stats Moved to Bottom
@@ -236,6 +320,7 @@ def sidebar():
                 placeholder="Search",
                 on_change=state.State.set_history_search_query,
                 value=state.State.history_search_query,
+                debounce_timeout=config.SEARCH_INPUT_DEBOUNCE_MS,
                 width="100%"
             ),
             align="center",
@@ -248,6 +333,23 @@ def sidebar():
         rx.cond(
             state.State.user,
             rx.vstack(
+                rx.cond(
+                    state.State.message_hits.length() > 0,
+                    rx.vstack(
+                        rx.text("Messages", size="2", weight="bold", margin_top="4"),
+                        rx.scroll_area(
+                            rx.vstack(
+                                rx.foreach(state.State.message_hits, message_hit_row),
+                                spacing="1",
+                                width="100%",
+                            ),
+                            type="hover",
+                            scrollbars="vertical",
+                            max_height="40vh",
+                        ),
+                        width="100%",
+                    ),
+                ),
                 rx.hstack(
                     rx.text("History", size="2", weight="bold"),
                     rx.spacer(),
@@ -318,14 +420,7 @@ def sidebar():
                                             rx.cond(
                                                 chat["id"] == state.State.active_chat_id,
                                                 rx.box(
-                                                    rx.vstack(
-                                                        rx.foreach(
-                                                            state.State.flat_tree.to(list),
-                                                            tree_row
-                                                        ),
-                                                        spacing="0",
-                                                        width="100%"
-                                                    ),
+                                                    tree_rows(),
                                                     width="100%",
                                                     padding_left="12px",
                                                     padding_y="1",
@@ -354,14 +449,7 @@ def sidebar():
             ~state.State.user,
             rx.vstack(
                 rx.divider(),
-                rx.vstack(
-                    rx.foreach(
-                        state.State.flat_tree.to(list),
-                        tree_row
-                    ),
-                    spacing="0", # Tight spacing
-                    width="100%"
-                ),
+                tree_rows(),
             ),
         ),
         # Removed Spacer to eliminate gap
@@ -395,6 +483,12 @@ def sidebar():
                         justify="between",
                         width="100%"
                     ),
+                    rx.hstack(
+                        rx.text("Cache hits / misses:", size="1", color="gray"),
+                        rx.text(f"{state.State.response_cache_hits} / {state.State.response_cache_misses}", size="1", weight="bold"),
+                        justify="between",
+                        width="100%"
+                    ),
                     rx.cond(
                         state.State.user,
                         rx.vstack(
@@ -511,10 +605,36 @@ def chat_message(message: dict):
                 # Model Message Bubble
                 rx.box( 
                     rx.vstack(
-                        # Model Badge
-                        rx.cond(
-                            message["model"].to(str) != "", 
-                            rx.badge(message["model"], color_scheme="purple", variant="soft", margin_bottom="2px"),
+                        # Model Badge + switcher between sibling answers
+                        rx.hstack(
+                            rx.cond(
+                                message["model"].to(str) != "", 
+                                rx.badge(message["model"], color_scheme="purple", variant="soft", margin_bottom="2px"),
+                            ),
+                            rx.cond(
+                                message["answer_label"].to(str) != "",
+                                rx.hstack(
+                                    rx.button(
+                                        rx.icon("chevron-left", size=14),
+                                        on_click=lambda: state.State.switch_answer(message["id"].to(str), -1),
+                                        variant="ghost",
+                                        size="1",
+                                        padding="1"
+                                    ),
+                                    rx.text(message["answer_label"], size="1", color="gray"),
+                                    rx.button(
+                                        rx.icon("chevron-right", size=14),
+                                        on_click=lambda: state.State.switch_answer(message["id"].to(str), 1),
+                                        variant="ghost",
+                                        size="1",
+                                        padding="1"
+                                    ),
+                                    spacing="1",
+                                    align_items="center"
+                                ),
+                            ),
+                            spacing="2",
+                            align_items="center"
                         ),
                         # Content
                         rx.markdown(message["content"], math_jax=True),
@@ -541,7 +661,10 @@ def chat_message(message: dict):
             width="100%"
         ),
         padding_y="2", # Vertical spacing between messages in the list
-        width="100%"
+        width="100%",
+        # The browser skips layout and paint of bubbles scrolled out of view
+        content_visibility="auto",
+        contain_intrinsic_size="auto 200px",
     )
 
 def chat_area():
@@ -579,7 +702,7 @@ def chat_area():
         rx.scroll_area(
             rx.vstack(
                 rx.cond(
-                    state.State.chat_history.length() > 3,
+                    state.State.history_length > 3,
                     rx.button(
                         rx.cond(state.State.show_full_history, "Hide Previous Messages", "Show Previous Messages"),
                         on_click=state.State.toggle_history, 
@@ -587,6 +710,16 @@ def chat_area():
                         width="100%"
                     )
                 ),
+                rx.cond(
+                    state.State.older_message_count > 0,
+                    rx.button(
+                        "Load older messages (" + state.State.older_message_count.to(str) + " more)",
+                        on_click=state.State.load_older_messages,
+                        variant="ghost",
+                        size="1",
+                        width="100%"
+                    )
+                ),
                 rx.foreach(
                     state.State.displayed_messages,
                     chat_message
@@ -604,6 +737,14 @@ def chat_area():
                 rx.hstack(
                     rx.input(placeholder="Type a message...", id="chat_input", flex="1"),
                     rx.checkbox("Deep Search (Tavily)", checked=state.State.use_google_search, on_change=state.State.set_use_google_search),
+                    rx.cond(
+                        state.State.queue_position > 0,
+                        rx.text("Queued #" + state.State.queue_position.to(str), size="1", color="gray"),
+                    ),
+                    rx.cond(
+                        state.State.processing,
+                        rx.button("Stop", type="button", color_scheme="red", variant="soft", on_click=state.State.stop_generation),
+                    ),
                     rx.button("Send", type="submit", loading=state.State.processing),
                     align_items="center",
                     spacing="4"
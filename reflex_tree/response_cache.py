@@ -0,0 +1,102 @@
+"""Content-addressed cache of model responses.
+
+A response is keyed by a hash of everything that determines the request:
+model id, the exact message list sent, temperature, search results and the
+context summary. An identical request (re-asking the same prompt on the same
+ancestry, or on a grafted copy of it) is answered from the cache instantly
+and at no cost. `regenerate_response` bypasses the lookup.
+
+Two tiers: a per-process LRU in memory and the `response_cache` table in
+SQLite, which survives restarts. Both evict by age (RESPONSE_CACHE_TTL_S) and
+size (RESPONSE_CACHE_SIZE entries in memory, RESPONSE_CACHE_DB_ROWS on disk).
+Keys include the user, so one user's answers are never served to another.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from . import async_database, config
+from .classes import ChatNode
+
+_lock = threading.Lock()
+_memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_writes_since_prune = 0
+
+
+def cache_key(
+    scope: str,
+    model_id: str,
+    history: List[ChatNode],
+    temperature: float,
+    search_context: Optional[str],
+    context_summary: Optional[str],
+) -> str:
+    payload = json.dumps(
+        [
+            scope,
+            model_id,
+            [[node.role, node.content] for node in history if node.role != "system"],
+            round(float(temperature), 4),
+            search_context or "",
+            context_summary or "",
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _memory_get(key: str, now: float) -> Optional[str]:
+    with _lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        content, created_at = entry
+        if now - created_at > config.RESPONSE_CACHE_TTL_S:
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return content
+
+
+def _memory_put(key: str, content: str, created_at: float) -> None:
+    with _lock:
+        _memory[key] = (content, created_at)
+        _memory.move_to_end(key)
+        while len(_memory) > config.RESPONSE_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+async def get(key: str) -> Optional[str]:
+    """Cached response for `key`, checking memory first, then SQLite."""
+    now = time.time()
+    content = _memory_get(key, now)
+    if content is not None:
+        return content
+    row = await async_database.get_cached_response(key, now - config.RESPONSE_CACHE_TTL_S)
+    if row is None:
+        return None
+    content, created_at = row
+    _memory_put(key, content, created_at)
+    return content
+
+
+async def put(key: str, content: str) -> None:
+    global _writes_since_prune
+    now = time.time()
+    _memory_put(key, content, now)
+    await async_database.put_cached_response(key, content, now)
+    _writes_since_prune += 1
+    if _writes_since_prune >= config.RESPONSE_CACHE_PRUNE_EVERY:
+        _writes_since_prune = 0
+        await async_database.prune_response_cache(
+            now - config.RESPONSE_CACHE_TTL_S, config.RESPONSE_CACHE_DB_ROWS
+        )
+
+
+def clear_memory() -> None:
+    with _lock:
+        _memory.clear()
@@ -0,0 +1,146 @@
+"""Async Tavily web-search client used for "Deep Search" grounding.
+
+Requests share one keep-alive `httpx.AsyncClient` per event loop, and
+formatted results are cached per (api key, normalized query) for
+SEARCH_CACHE_TTL_S. Point SEARCH_API_URL at scripts/search_stub.py to run
+without network access.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# (sha256(api_key), normalized query) -> (formatted results, fetched_at)
+_cache: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Process-wide instrumentation, separate from model latency.
+stats = {"requests": 0, "cache_hits": 0, "errors": 0, "total_ms": 0.0, "last_ms": 0.0}
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Shared client for the running loop (clients cannot cross event loops)."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=config.SEARCH_TIMEOUT_S,
+            limits=httpx.Limits(keepalive_expiry=config.SEARCH_KEEPALIVE_S),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def _post_search(api_key: str, query: str, max_results: int) -> Dict[str, Any]:
+    payload = {
+        "api_key": api_key,
+        "query": query,
+        "search_depth": "basic",
+        "max_results": max_results,
+    }
+    resp = await _get_client().post(config.SEARCH_API_URL, json=payload)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _cache_key(api_key: str, query: str) -> Tuple[str, str]:
+    return hashlib.sha256(api_key.encode()).hexdigest(), normalize_query(query)
+
+
+def _cache_get(key: Tuple[str, str]) -> Optional[str]:
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > config.SEARCH_CACHE_TTL_S:
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return entry[0]
+
+
+def _cache_put(key: Tuple[str, str], context: str) -> None:
+    with _cache_lock:
+        _cache[key] = (context, time.monotonic())
+        _cache.move_to_end(key)
+        while len(_cache) > config.SEARCH_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def format_results(body: Dict[str, Any]) -> Optional[str]:
+    results = body.get("results", [])
+    if not results:
+        return None
+    lines = []
+    for idx, result in enumerate(results, start=1):
+        title = (result.get("title") or "").strip()
+        url = (result.get("url") or "").strip()
+        content = (result.get("content") or "").strip()
+        if not title and not url and not content:
+            continue
+        lines.append(f"{idx}. {title}\n{url}\n{content}".strip())
+    return "\n\n".join(lines) if lines else None
+
+
+async def fetch_search_context(api_key: str, query: str) -> Optional[str]:
+    """Returns numbered search results as prompt context, or None on failure."""
+    if not query or not api_key:
+        return None
+    key = _cache_key(api_key, query)
+    started = time.perf_counter()
+    stats["requests"] += 1
+    cached = _cache_get(key)
+    if cached is not None:
+        stats["cache_hits"] += 1
+        _record_latency(started, "cache hit")
+        return cached
+    try:
+        body = await _post_search(api_key, query, max_results=5)
+    except (httpx.HTTPError, ValueError) as exc:
+        stats["errors"] += 1
+        _record_latency(started, "failed")
+        print(f"Tavily search failed: {exc}")
+        return None
+    context = format_results(body)
+    if context:
+        _cache_put(key, context)
+    _record_latency(started, "fetched")
+    return context
+
+
+def _record_latency(started: float, outcome: str) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats["last_ms"] = elapsed_ms
+    stats["total_ms"] += elapsed_ms
+    logger.info("Search %s in %.1f ms", outcome, elapsed_ms)
+
+
+async def validate_key(api_key: str) -> bool:
+    if not api_key:
+        return False
+    try:
+        body = await _post_search(api_key, "healthcheck", max_results=1)
+    except (httpx.HTTPError, ValueError):
+        return False
+    return isinstance(body, dict)
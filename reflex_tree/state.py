@@ -1,22 +1,135 @@
 import reflex as rx
+import asyncio
+import contextlib
 import os
+import re
 import uuid
-import json
 import datetime
-from urllib import request, error
-from typing import List, Dict, Optional, Any
+import logging
+import time
+from typing import List, Dict, Optional, Any, NamedTuple, Set, Collection
 from pydantic import BaseModel
 from .classes import ChatNode, flatten_tree, NodeView
-from . import config, database
-from google.genai import types, Client
-import openai
-import anthropic
+from . import async_database, autosave, bodies, clients, concurrency, config, context, database, response_cache, search, summaries, tree_index
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+
+class Usage(NamedTuple):
+    """Token usage of one response; prompt_tokens includes the cached ones."""
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    cached_tokens: int = 0       # prompt tokens read from the prompt cache
+    cache_write_tokens: int = 0  # prompt tokens written to it (Anthropic)
+
+def _response_cost(pricing: Dict[str, float], usage: Usage) -> float:
+    input_rate = pricing["INPUT_PER_1M"]
+    uncached = usage.prompt_tokens - usage.cached_tokens - usage.cache_write_tokens
+    return (
+        uncached / 1e6 * input_rate
+        + usage.cached_tokens / 1e6 * pricing.get("CACHED_INPUT_PER_1M", input_rate)
+        + usage.cache_write_tokens / 1e6 * pricing.get("CACHE_WRITE_PER_1M", input_rate)
+        + usage.completion_tokens / 1e6 * pricing["OUTPUT_PER_1M"]
+    )
+
+def _cache_marked(msgs: List[Dict[str, Any]], count: int = 2) -> List[Dict[str, Any]]:
+    """Anthropic messages with cache breakpoints on the last `count` turns.
+
+    The prefix ending at the parent turn is shared by sibling branches, the
+    one ending at the newest turn by regenerations of the same answer.
+    """
+    marked = list(msgs)
+    for i in range(max(0, len(marked) - count), len(marked)):
+        marked[i] = {
+            "role": marked[i]["role"],
+            "content": [{
+                "type": "text",
+                "text": marked[i]["content"],
+                "cache_control": {"type": "ephemeral"},
+            }],
+        }
+    return marked
+
+def _openai_usage(usage) -> Optional[Usage]:
+    if not usage:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return Usage(
+        usage.prompt_tokens,
+        usage.completion_tokens,
+        usage.total_tokens,
+        cached_tokens=(getattr(details, "cached_tokens", None) or 0) if details else 0,
+    )
+
+def _anthropic_usage(usage) -> Optional[Usage]:
+    if not usage:
+        return None
+    # input_tokens excludes the tokens read from or written to the cache.
+    cached = getattr(usage, "cache_read_input_tokens", None) or 0
+    written = getattr(usage, "cache_creation_input_tokens", None) or 0
+    prompt = usage.input_tokens + cached + written
+    return Usage(prompt, usage.output_tokens, prompt + usage.output_tokens, cached, written)
+
+async def _pump_stream(node_id: str, provider: str, stream, queue: asyncio.Queue):
+    """Feeds one model stream into `queue` as (node_id, delta, usage, error, done).
+
+    Holds a provider slot for the lifetime of the stream; always ends with a
+    done item, after an error item if the stream raised.
+    """
+    # Cache hits (no provider) do not take a provider slot.
+    slot = concurrency.provider_slot(provider) if provider else contextlib.nullcontext()
+    try:
+        async with slot:
+            async for delta, usage in stream:
+                await queue.put((node_id, delta, usage, None, False))
+    except Exception as e:
+        await queue.put((node_id, "", None, e, False))
+    await queue.put((node_id, "", None, None, True))
+
+async def _cached_stream(content: str):
+    """Replays a cached response as a single delta with no usage (zero cost)."""
+    yield content, None
+
+async def _search_context(api_key: str, root_id: str, user_node_id: str, query: Optional[str]) -> Optional[str]:
+    """Search results for a user message; reads its text first when only a preview is loaded."""
+    if query is None:
+        query = (await async_database.load_node_contents(root_id, [user_node_id])).get(user_node_id)
+    return await search.fetch_search_context(api_key, query)
+
+def _system_prompt(search_context: Optional[str], context_summary: Optional[str]) -> str:
+    system_prompt = "You are a helpful assistant."
+    if context_summary:
+        system_prompt = f"{system_prompt}\n\nSummary of earlier conversation:\n{context_summary}"
+    if search_context:
+        system_prompt = f"{system_prompt}\n\nWeb search results:\n{search_context}"
+    return system_prompt
+
+def _normalize_latex(content: str) -> str:
+    """Normalize LaTeX delimiters for Reflex/Remark compatibility.
+
+    \\[ ... \\] -> $$ ... $$
+    \\( ... \\) -> $ ... $
+    """
+    if content:
+        content = content.replace("\\[", "$$").replace("\\]", "$$")
+        content = content.replace("\\(", "$").replace("\\)", "$")
+    return content
 
 
 class ChatGroup(BaseModel):
     date: str
     chats: List[Dict[str, Any]]
 
+class MessageHit(BaseModel):
+    """One sidebar search result; `parts` alternates plain and matched text."""
+    conversation_id: str
+    node_id: str
+    role: str
+    title: str
+    parts: List[str]
+
 class State(rx.State):
     """The app state."""
     
@@ -34,34 +147,36 @@ class State(rx.State):
     def toggle_login_modal(self):
         self.show_login = not self.show_login
 
-    def signup(self):
+    async def signup(self):
         if not self.auth_email or not self.auth_password:
              return rx.window_alert("Please enter email and password.")
         
-        success = database.create_user(self.auth_email, self.auth_password)
+        success = await async_database.create_user(self.auth_email, self.auth_password)
         if success:
             # Auto login
-            self.login()
+            await self.login()
         else:
             return rx.window_alert("User already exists or error creating account.")
 
-    def login(self):
-        user_data = database.authenticate_user(self.auth_email, self.auth_password)
+    async def login(self):
+        user_data = await async_database.authenticate_user(self.auth_email, self.auth_password)
         if user_data:
             self.user = user_data
             self.show_login = False
             self.show_history_panel = False
             self.show_usage_panel = False
             self._start_session()
-            self.refresh_usage_rollups()
-            self.load_chat_list()
+            await self.refresh_usage_rollups()
+            await self.load_chat_list()
         else:
             return rx.window_alert("Invalid email or password.")
 
-    def logout(self):
+    async def logout(self):
         self.user = None
         self.auth_email = ""
         self.auth_password = ""
+        self.history_search_query = ""
+        self.message_hits = []
         
         # Reset Session Stats
         self._reset_session_stats()
@@ -74,7 +189,7 @@ class State(rx.State):
         
         # Reset UI
         self.show_login = True
-        self.start_new_chat()
+        await self.start_new_chat()
 
     @rx.var
     def is_logged_in(self) -> bool:
@@ -205,9 +320,9 @@ class State(rx.State):
             else:
                 self.search_api_key = key
 
-    def save_api_keys(self):
+    async def save_api_keys(self):
         search_key = self._get_provider_key("search")
-        if search_key and not self._validate_tavily_key(search_key):
+        if search_key and not await search.validate_key(search_key):
             return rx.window_alert("Tavily API key is invalid or could not be verified.")
         if str(self.remember_keys).lower() == "true":
             return rx.window_alert("Keys are stored in this browser only.")
@@ -216,11 +331,44 @@ class State(rx.State):
     def toggle_settings_modal(self):
         self.show_settings = not self.show_settings
 
-    def set_history_search_query(self, query: str):
+    async def set_history_search_query(self, query: str):
         self.history_search_query = query or ""
+        # The chat view filters the whole branch, so its full text is needed
+        if not self.user or not self.history_search_query.strip():
+            self.message_hits = []
+            return State.hydrate_shown
+        # Edits still in the autosave window are not indexed yet; flushing
+        # here would turn every keystroke into a write
+        rows = await async_database.search_messages(
+            self.user["email"], self.history_search_query, config.MESSAGE_SEARCH_LIMIT
+        )
+        self.message_hits = [
+            MessageHit(
+                conversation_id=cid,
+                node_id=node_id,
+                role=role or "",
+                title=title or "",
+                parts=re.split(f"[{database.SNIPPET_START}{database.SNIPPET_END}]", snippet or ""),
+            )
+            for cid, node_id, role, title, snippet in rows
+        ]
+        return State.hydrate_shown
+
+    async def open_message_hit(self, conversation_id: str, node_id: str):
+        """Jumps to a search result, loading its conversation if needed."""
+        self.history_search_query = ""
+        self.message_hits = []
+        if conversation_id != self.root_id:
+            await self.load_chat(conversation_id)
+        if self.root_id == conversation_id:
+            self.select_node(node_id)
+        return State.hydrate_shown
 
     # --- Conversation State ---
-    nodes: Dict[str, ChatNode] = {}
+    # The tree is backend-only: the client never receives it, only the view
+    # vars derived from it (flat_tree, displayed_messages, ...). That keeps
+    # each websocket delta proportional to what changed, not to tree size.
+    _nodes: Dict[str, ChatNode] = {}
     root_id: str = ""
     current_node_id: str = ""
     
@@ -228,18 +376,31 @@ class State(rx.State):
     temperature: float = 0.7
     generation_seed: int = 42
     selected_model_key: str = config.DEFAULT_MODEL_KEY
+    # Compare mode: extra models answering every prompt alongside the selected one
+    compare_model_keys: List[str] = []
     use_google_search: bool = False
 
     
     # --- Sidebar State ---
     chat_list: List[Dict] = []
     history_search_query: str = ""
+    # Full-text matches for history_search_query across all conversations
+    message_hits: List[MessageHit] = []
     active_chat_id: str = ""
 
     
     # --- UI State ---
     show_full_history: bool = False
+    # Oldest message shown in full-history mode; "" shows the newest
+    # HISTORY_PAGE_SIZE messages. Moved back a page by load_older_messages.
+    _history_cursor: str = ""
     processing: bool = False
+    # 1-based place of this session's request in the user's generation queue
+    queue_position: int = 0
+    _active_generations: int = 0
+    # Bumped whenever the user navigates; queued generations started under an
+    # older epoch are dropped instead of answering a question no longer shown.
+    _nav_epoch: int = 0
     show_history_panel: bool = True
     show_usage_panel: bool = True
     
@@ -249,12 +410,12 @@ class State(rx.State):
     def set_auth_password(self, password: str):
         self.auth_password = password
         
-    def set_use_google_search(self, enable: bool):
+    async def set_use_google_search(self, enable: bool):
         if enable:
             api_key = self._get_provider_key("search")
             if not api_key:
                 return rx.window_alert("Please set a Tavily API key before enabling search.")
-            if not self._validate_tavily_key(api_key):
+            if not await search.validate_key(api_key):
                 return rx.window_alert("Tavily API key is invalid or could not be verified.")
         self.use_google_search = enable
 
@@ -292,21 +453,21 @@ class State(rx.State):
 
 
     
-    def on_load(self):
+    async def on_load(self):
         """Initialize the app."""
         # Create a default empty conversation if none exists
         if not self.root_id:
-            database.init_db() # Ensure DB is initialized/migrated
+            await async_database.init_db() # Ensure DB is initialized/migrated
             # Try to load latest if logged in?
             # For now just start new or keep current
-            self.start_new_chat()
+            self._reset_chat()
         self._start_session()
             
         if self.user:
             self.show_history_panel = False
             self.show_usage_panel = False
-            self.load_chat_list()
-            self.refresh_usage_rollups()
+            await self.load_chat_list()
+            await self.refresh_usage_rollups()
         else:
             # Reset stats for guest on refresh
             self._reset_session_stats()
@@ -315,30 +476,41 @@ class State(rx.State):
             self.weekly_cost = 0.0
             self.weekly_tokens = 0
 
-    def start_new_chat(self):
+    async def start_new_chat(self):
         """Save current and start new."""
-        if self.user and self.root_id:
-             database.save_conversation(self.user["email"], self.nodes, self.root_id)
-             self.load_chat_list()
-             
+        concurrency.cancel_session(self.router.session.client_token)
+        if self.root_id:
+             await autosave.queue.flush_async(self.root_id)
+             if self.user:
+                 await self.load_chat_list()
+        self._reset_chat()
+
+    def _reset_chat(self):
+        """Replaces the open conversation with a new, empty one (nothing is saved)."""
         root = ChatNode.create(role="system", content="System Prompt: You are a helpful assistant.")
-        self.nodes = {root.id: root}
+        self._nav_epoch += 1
+        self._nodes = {root.id: root}
         self.root_id = root.id
         self.current_node_id = root.id
         self.active_chat_id = ""
         self.processing = False
+        self._collapsed_nodes = set()
+        self._path_index.clear()
+        self._summary_cache.clear()
+        self._bodies.clear()
+        self._rebuild_flat_tree()
         
     def add_new_topic(self):
         """Start a new topic (branch) in the current conversation."""
-        if self.root_id and self.root_id in self.nodes:
+        if self.root_id and self.root_id in self._nodes:
             self.current_node_id = self.root_id
             self.show_full_history = False # Reset view logic if needed
         
-    def load_chat_list(self):
+    async def load_chat_list(self):
         if self.user:
             chats = [
                 {"id": r[0], "title": r[1], "updated_at": r[2]} 
-                for r in database.get_user_conversations(self.user["email"])
+                for r in await async_database.get_user_conversations(self.user["email"])
             ]
             self.chat_list = sorted(
                 chats,
@@ -346,33 +518,37 @@ class State(rx.State):
                 reverse=True,
             )
             
-    def load_chat(self, chat_id: str):
+    async def load_chat(self, chat_id: str):
         if self.user:
-            # Save current first
+            # Stop answers still streaming into the current chat and write out
+            # its pending edits first
+             concurrency.cancel_session(self.router.session.client_token)
              if self.root_id:
-                database.save_conversation(
-                    self.user["email"],
-                    self.nodes,
-                    self.root_id,
-                    touch_updated_at=False,
-                )
+                await autosave.queue.flush_async(self.root_id)
             
-             nodes = database.load_conversation(chat_id)
+             # Skeleton only; bodies are fetched as nodes are shown
+             nodes = await async_database.load_conversation(chat_id, preview_chars=config.LAZY_PREVIEW_CHARS)
              if nodes:
-                 self.nodes = nodes
+                 self._nav_epoch += 1
+                 self._nodes = nodes
                  self.root_id = chat_id
                  self.active_chat_id = chat_id
                  # Set current to last user message or root?
                  # Let's simple check root
                  self.current_node_id = self._latest_user_node_id() or chat_id
-                 self.collapsed_nodes = []
+                 self._collapsed_nodes = set()
+                 self._path_index.clear()
+                 self._summary_cache.clear()
+                 self._bodies.clear()
+                 self._rebuild_flat_tree()
                  self.show_full_history = False
-                 self.load_chat_list() # Refresh list order
+                 await self.load_chat_list() # Refresh list order
+                 return State.hydrate_shown
 
     def _latest_user_node_id(self) -> Optional[str]:
         latest_id = None
         latest_time = -1
-        for node_id, node in self.nodes.items():
+        for node_id, node in self._nodes.items():
             if node.role != "user":
                 continue
             try:
@@ -384,19 +560,21 @@ class State(rx.State):
                 latest_id = node_id
         return latest_id
 
-    def delete_chat(self, chat_id: str):
+    async def delete_chat(self, chat_id: str):
         if not self.user:
             return
-        database.delete_conversation(self.user["email"], chat_id)
+        autosave.queue.discard(chat_id)
+        await async_database.delete_conversation(self.user["email"], chat_id)
         if chat_id == self.active_chat_id:
             self.active_chat_id = ""
         if chat_id == self.root_id:
-            self.nodes = {}
+            self._nodes = {}
             self.root_id = ""
             self.current_node_id = ""
-            self.start_new_chat()
+            concurrency.cancel_session(self.router.session.client_token)
+            self._reset_chat()
             return
-        self.load_chat_list()
+        await self.load_chat_list()
 
     
     # --- Drag & Drop ---
@@ -410,7 +588,7 @@ class State(rx.State):
     def set_dragged_node_id(self, node_id: str):
         self.dragged_node_id = node_id
 
-    def graft_conversation(self, target_node_id: str):
+    async def graft_conversation(self, target_node_id: str):
         """Grafts a conversation (from history or current tree) onto the target_node_id."""
         source_nodes = {}
         source_root_ids = []
@@ -426,17 +604,26 @@ class State(rx.State):
             while curr:
                 if curr == self.dragged_node_id:
                     return # Cycle detected
-                curr = self.nodes[curr].parent_id if curr in self.nodes else None
+                curr = self._nodes[curr].parent_id if curr in self._nodes else None
 
-            source_nodes = self.nodes
+            source_nodes = self._nodes
             source_root_ids = [self.dragged_node_id]
+            # Clones need the full text, not previews
+            subtree = []
+            stack = [self.dragged_node_id]
+            while stack:
+                nid = stack.pop()
+                if nid in self._nodes:
+                    subtree.append(nid)
+                    stack.extend(self._nodes[nid].children_ids)
+            await self._load_bodies(subtree)
 
         elif self.dragged_chat_id:
             # History Drag: Source is a saved chat
             if self.dragged_chat_id == self.root_id:
                 return 
 
-            loaded_nodes = database.load_conversation(self.dragged_chat_id)
+            loaded_nodes = await async_database.load_conversation(self.dragged_chat_id)
             if not loaded_nodes or self.dragged_chat_id not in loaded_nodes:
                 return
             
@@ -454,101 +641,98 @@ class State(rx.State):
         # Perform Grafting
         # Check if target is a User node with a Model child. 
         # If so, graft onto the Model child to preserve Q->A->Q flow.
-        target_node = self.nodes.get(target_node_id)
+        target_node = self._nodes.get(target_node_id)
         if target_node and target_node.role == "user":
              for cid in target_node.children_ids:
-                 child = self.nodes.get(cid)
+                 child = self._nodes.get(cid)
                  if child and child.role == "model":
                      target_node_id = cid
                      break
 
         for root_id in source_root_ids:
-            self._clone_subtree_recursive(root_id, target_node_id, source_nodes)
+            self._clone_subtree(root_id, target_node_id, source_nodes)
+        self._splice_flat_tree(target_node_id)
         
         # Save and Cleanup
-        # Assuming save_chat is a method, if not, use database.save_conversation directly
-        if self.user:
-            database.save_conversation(self.user["email"], self.nodes, self.root_id)
+        self._queue_autosave()
         self.dragged_chat_id = ""
         self.dragged_node_id = ""
 
-    def _clone_subtree_recursive(self, old_node_id: str, new_parent_id: str, source_nodes_dict: Dict[str, ChatNode]):
-        """Recursively clones a node and its children from source_nodes_dict to self.nodes."""
-        if old_node_id not in source_nodes_dict:
-            return
+    def _clone_subtree(self, old_node_id: str, new_parent_id: str, source_nodes_dict: Dict[str, ChatNode]):
+        """Clones a node and its descendants from source_nodes_dict into self._nodes.
+
+        Walks an explicit stack (like flatten_subtree) so deep chats do not hit
+        the recursion limit; siblings keep their order.
+        """
+        stack = [(old_node_id, new_parent_id)]
+        while stack:
+            old_id, parent_id = stack.pop()
+            node_to_copy = source_nodes_dict.get(old_id)
+            if node_to_copy is None:
+                continue
+            new_id = str(uuid.uuid4())[:8]
+
+            # Create new node
+            new_node = ChatNode(
+                id=new_id,
+                role=node_to_copy.role,
+                content=node_to_copy.content,
+                parent_id=parent_id,
+                children_ids=[],
+                timestamp=node_to_copy.timestamp,
+                tokens=node_to_copy.tokens,
+                cost=node_to_copy.cost,
+                is_grafted=True
+            )
+            self._nodes[new_id] = new_node
+
+            # Update parent's children list
+            if parent_id in self._nodes:
+                parent = self._nodes[parent_id]
+                if new_id not in parent.children_ids:
+                    parent.children_ids = parent.children_ids + [new_id]
+                    self._nodes[parent_id] = parent
+
+            stack.extend((child_id, new_id) for child_id in reversed(node_to_copy.children_ids))
 
-        node_to_copy = source_nodes_dict[old_node_id]
-        new_id = str(uuid.uuid4())[:8]
-        
-        # Create new node
-        new_node = ChatNode(
-            id=new_id,
-            role=node_to_copy.role,
-            content=node_to_copy.content,
-            parent_id=new_parent_id,
-            children_ids=[],
-            timestamp=node_to_copy.timestamp,
-            tokens=node_to_copy.tokens,
-            cost=node_to_copy.cost,
-            is_grafted=True
-        )
-        self.nodes[new_id] = new_node
-
-        # Update parent's children list
-        if new_parent_id in self.nodes:
-            parent = self.nodes[new_parent_id]
-            if new_id not in parent.children_ids:
-                 parent.children_ids = parent.children_ids + [new_id]
-                 self.nodes[new_parent_id] = parent
-
-        # Recurse for children
-        for child_id in node_to_copy.children_ids:
-            self._clone_subtree_recursive(child_id, new_id, source_nodes_dict)
-    
     # --- Tree Operations ---
     
     def set_selected_model_key(self, key: str):
         self.selected_model_key = key
+
+    def toggle_compare_model(self, key: str):
+        if key in self.compare_model_keys:
+            self.compare_model_keys = [k for k in self.compare_model_keys if k != key]
+        elif key in config.MODELS:
+            self.compare_model_keys = self.compare_model_keys + [key]
+
+    def _answer_model_keys(self) -> List[str]:
+        """Models that answer the next prompt: the selected one first."""
+        keys = [self.selected_model_key]
+        for key in self.compare_model_keys:
+            if key in config.MODELS and key not in keys:
+                keys.append(key)
+        return keys
         
     def add_node(self, role: str, content: str, parent_id: str, tokens: int = 0, cost: float = 0.0, model: str = None) -> str:
-        # Normalize LaTeX delimiters for Reflex/Remark compatibility
-        # \[ ... \] -> $$ ... $$
-        # \( ... \) -> $ ... $
-        if content:
-            content = content.replace("\\[", "$$").replace("\\]", "$$")
-            content = content.replace("\\(", "$").replace("\\)", "$")
+        content = _normalize_latex(content)
 
         new_node = ChatNode.create(role=role, content=content, parent_id=parent_id, tokens=tokens, cost=cost, model=model)
         
-        # We must treat self.nodes as immutable-like to trigger updates reliably in some contexts
-        # or at least make sure the dict reference updates if Reflex checks that.
-        # Ideally, just updating the key should work, but for nested structures, deep reactivity can be tricky.
-        
-        # Link to parent
-        if parent_id in self.nodes:
-            parent = self.nodes[parent_id]
-            # Create a new instance
-            parent_dict = parent.dict()
-            parent_dict["children_ids"] = parent_dict["children_ids"] + [new_node.id]
-            updated_parent = ChatNode(**parent_dict)
-            
-            # Update dictionary
-            self.nodes[parent_id] = updated_parent
+        # Link to parent (in place: _nodes is backend-only, nothing is re-sent)
+        if parent_id in self._nodes:
+            self._nodes[parent_id].children_ids.append(new_node.id)
             
-        self.nodes[new_node.id] = new_node
-        
-        # FORCE Reactivity: Reassign the dict to itself to trigger @rx.var dependencies
-        self.nodes = {**self.nodes} 
+        self._nodes[new_node.id] = new_node
+        self._splice_flat_tree(parent_id)
 
-        # Autosave if logged in
-            
-        # Autosave if logged in
-        if self.user:
-            database.save_conversation(self.user["email"], self.nodes, self.root_id)
+        # Autosave if logged in (queues just the new node row; the write is
+        # deferred, so later edits to the node land in the same batch).
+        self._queue_autosave(new_node.id)
             
         return new_node.id
     
-    def delete_node_action(self, node_id: str):
+    async def delete_node_action(self, node_id: str):
         """Deletes a node and its descendants."""
         # Cannot delete root
         if node_id == self.root_id:
@@ -559,16 +743,16 @@ class State(rx.State):
         i = 0
         while i < len(to_delete):
             curr_id = to_delete[i]
-            if curr_id in self.nodes:
-                to_delete.extend(self.nodes[curr_id].children_ids)
+            if curr_id in self._nodes:
+                to_delete.extend(self._nodes[curr_id].children_ids)
             i += 1
             
         # Remove from parent
-        node = self.nodes.get(node_id)
-        if node and node.parent_id and node.parent_id in self.nodes:
-            parent = self.nodes[node.parent_id]
+        node = self._nodes.get(node_id)
+        if node and node.parent_id and node.parent_id in self._nodes:
+            parent = self._nodes[node.parent_id]
             parent.children_ids = [cid for cid in parent.children_ids if cid != node_id]
-            self.nodes[node.parent_id] = parent
+            self._nodes[node.parent_id] = parent
             
             # If we deleted the current path, move up
             if self.current_node_id in to_delete:
@@ -576,26 +760,40 @@ class State(rx.State):
  
         # Delete from dict
         for nid in to_delete:
-            if nid in self.nodes:
-                del self.nodes[nid]
+            if nid in self._nodes:
+                del self._nodes[nid]
+            self._collapsed_nodes.discard(nid)
+        self._path_index.clear()
+        self._summary_cache.discard(to_delete)
+        self._bodies.discard(to_delete)
+        if self.user:
+            await async_database.delete_summaries(self.root_id, to_delete)
+        if node:
+            self._splice_flat_tree(node.parent_id)
+            self._queue_autosave()
+        return State.hydrate_shown
 
     def select_node(self, node_id: str):
-        if node_id in self.nodes:
+        if node_id in self._nodes:
+            self._nav_epoch += 1
             self.current_node_id = node_id
             self.show_full_history = False # Default fold on switch
             
             # If we selected a User node, try to auto-select its Model response
             # so the answer is visible in the chat
-            node = self.nodes[node_id]
+            node = self._nodes[node_id]
             if node.role == "user" and node.children_ids:
                 # Find first model child
                 for cid in node.children_ids:
-                     if cid in self.nodes and self.nodes[cid].role == "model":
+                     if cid in self._nodes and self._nodes[cid].role == "model":
                          self.current_node_id = cid
                          break
+            self._sync_tree_window()
+            return State.hydrate_shown
 
     # --- Chat Logic ---
     
+    @rx.event(background=True)
     async def process_chat(self, form_data: dict):
         """Handle new user message."""
         if not form_data:
@@ -604,44 +802,46 @@ class State(rx.State):
         if not user_text:
             return
             
-        self.processing = True
-        yield
-        
         # 1. Add User Node
-        user_node_id = self.add_node("user", user_text, self.current_node_id)
-        self.current_node_id = user_node_id
-        yield
+        async with self:
+            user_node_id = self.add_node("user", user_text, self.current_node_id)
+            self.current_node_id = user_node_id
+            self._sync_tree_window()
+            model_keys = self._answer_model_keys()
         
-        # 2. Generate Response
-        await self._generate_model_response()
-        yield
+        # 2. Generate Response (streamed)
+        await self._generate_model_response(user_node_id, model_keys)
 
+    def stop_generation(self):
+        """Stops this session's running generations, keeping the partial answers."""
+        concurrency.cancel_session(self.router.session.client_token)
+
+    @rx.event(background=True)
     async def regenerate_response(self, node_id: str):
         """Regenerate answer for a given User node."""
-        if node_id not in self.nodes: return
-        
-        # Set context to this user node
-        self.current_node_id = node_id
-        self.processing = True
-        yield
+        async with self:
+            if node_id not in self._nodes: return
+            # Set context to this user node
+            self.current_node_id = node_id
+            model_keys = self._answer_model_keys()
         
-        # Generate new sibling response
-        await self._generate_model_response()
-        yield
+        # Generate new sibling response(s); always a fresh answer
+        await self._generate_model_response(node_id, model_keys, use_cache=False)
              
     async def share_response(self, node_id: str):
         """Share the answer associated with this user node (User + Answer)."""
-        if node_id not in self.nodes: return
-        node = self.nodes[node_id]
+        if node_id not in self._nodes: return
+        node = self._nodes[node_id]
         if node.role != "user": return
+        await self._load_bodies([node_id, *node.children_ids])
         
         # Find the Model response (child) that is currently active or first available
         # Ideally, we find the one that is currently displayed.
         # But simply getting the first model child is a reasonable default for MVP.
         answer_text = ""
         for cid in node.children_ids:
-             if cid in self.nodes and self.nodes[cid].role == "model":
-                 answer_text = self.nodes[cid].content
+             if cid in self._nodes and self._nodes[cid].role == "model":
+                 answer_text = self._nodes[cid].content
                  break
         
         if not answer_text:
@@ -650,310 +850,761 @@ class State(rx.State):
         text_to_copy = f"Q: {node.content}\n\nA: {answer_text}"
         return rx.set_clipboard(text_to_copy)
 
-    async def _generate_model_response(self):
-        """Internal method to generate model response based on current_node_id."""
-        user_node_id = self.current_node_id
+    async def _generate_model_response(self, user_node_id: str, model_keys: List[str], use_cache: bool = True):
+        """Streams model responses to `user_node_id` from a background event.
+
+        The request first waits for a per-user admission slot (see
+        concurrency.admit); while queued it reports its position and gives up
+        if the user navigates elsewhere. Then one sibling model node per entry
+        of `model_keys` is created; all of them stream concurrently, within
+        the per-provider limits, and each is finalized as soon as its own
+        stream ends. Identical earlier requests are answered from
+        response_cache unless `use_cache` is False.
+
+        State is only touched inside `async with self` blocks; network and
+        provider I/O happen outside them so other events keep flowing.
+        The generation is registered under the browser session (see
+        concurrency.track): `stop_generation`, or switching to another chat,
+        aborts the provider streams at once, frees their slots, and keeps the
+        partial answers with an estimate of the tokens they used.
+        """
+        node_models: Dict[str, str] = {}
+        cache_keys: Dict[str, Optional[str]] = {}
+        prompt_tokens: Dict[str, Optional[int]] = {}
+        chunks: Dict[str, List[str]] = {}
+        finished: Set[str] = set()
+        tasks: List[asyncio.Task] = []
+        search_task: Optional[asyncio.Task] = None
+
+        async with self:
+            self._active_generations += 1
+            self.processing = True
+            user_key = self._admission_key()
+            nav_epoch = self._nav_epoch
+            root_id = self.root_id
+            session_key = self.router.session.client_token
+            search_key = self._get_provider_key("search") if self.use_google_search else ""
+            user_node = self._nodes.get(user_node_id)
+            user_query = user_node.content if user_node is not None and user_node.hydrated else None
+        ticket = concurrency.admit(user_key)
+        gen = concurrency.track(session_key)
+        # Search runs once for all models, while the request waits for a slot
+        # and loads the branch
+        if search_key:
+            search_task = gen.watch(
+                asyncio.create_task(_search_context(search_key, root_id, user_node_id, user_query))
+            )
         
         try:
-            model_info = config.MODELS[self.selected_model_key]
-            provider = model_info.get("provider", "google")
-            model_id = model_info["id"]
-            
-            # Build History (Standard format)
-            full_history = self.get_history_list(user_node_id)
+            # Wait for a slot; superseded requests leave the queue
+            while not await ticket.wait(config.QUEUE_POLL_INTERVAL_S):
+                async with self:
+                    if self._nav_epoch != nav_epoch or gen.cancelled:
+                        return
+                    self.queue_position = ticket.position
+            # The request needs the branch's full text; bodies still missing
+            # are read outside the lock, then installed on the next pass
+            contents: Dict[str, str] = {}
+            while True:
+                async with self:
+                    if self.queue_position:
+                        self.queue_position = 0
+                    if self._nav_epoch != nav_epoch or gen.cancelled or user_node_id not in self._nodes:
+                        return
+                    path = self._path_index.path(self._node_map(), user_node_id)
+                    self._install_bodies(contents, path)
+                    missing = self._bodies.missing(self._node_map(), path)
+                    if not missing:
+                        # Copies, taken under the lock: the body cache can turn
+                        # the shared nodes back into previews before the
+                        # streams build their requests
+                        full_history = [
+                            ChatNode(id=node.id, role=node.role, content=str(node.content))
+                            for node in self.get_path_nodes(user_node_id)
+                        ]
+                        break
+                contents = await async_database.load_node_contents(root_id, missing)
+
+            for model_key in model_keys:
+                provider = config.MODELS.get(model_key, {}).get("provider", "google")
+                api_key = self._get_provider_key(provider)
+                if api_key:
+                    clients.get_client(provider, api_key)
+
             search_context = None
-            if self.use_google_search and self.search_api_key:
-                user_query = self.nodes.get(user_node_id).content if user_node_id in self.nodes else ""
-                search_context = self._fetch_search_context(user_query)
-            
-            model_text = ""
-            total_toks = 0
-            total_step_cost = 0.0
-            
-            if provider == "openai":
-                api_key = self._get_provider_key("openai")
-                if not api_key:
-                    raise Exception("OpenAI API Key not set.")
-                
-                client = openai.AsyncOpenAI(api_key=api_key)
-                system_prompt = "You are a helpful assistant."
-                if search_context:
-                    system_prompt = f"{system_prompt}\n\nWeb search results:\n{search_context}"
-                msgs = [{"role": "system", "content": system_prompt}]
-                for item in full_history:
-                    if item["role"] != "system":
-                         role = "user" if item["role"] == "user" else "assistant"
-                         msgs.append({"role": role, "content": item["content"]})
-                
-                # Internal mapping removed at user request.
-                # Direct call to the ID specified in config.
-                api_model_id = model_id
-                
-                if "o1" in api_model_id or "gpt-5" in api_model_id:
-                     response = await client.chat.completions.create(
-                        model=api_model_id,
-                        messages=msgs
-                        # No temperature
+            if search_task:
+                try:
+                    search_context = await search_task
+                except asyncio.CancelledError:
+                    if not gen.cancelled:
+                        raise
+            if gen.cancelled:
+                return
+
+            streams = [
+                await self._open_stream(model_key, full_history, search_context, use_cache)
+                for model_key in model_keys
+            ]
+
+            # 3. Add Model Nodes up front and fill them as the streams arrive
+            queue: asyncio.Queue = asyncio.Queue()
+            gen.attach(queue)
+            async with self:
+                if self.root_id != root_id or gen.cancelled:
+                    return
+                for model_key, (provider, stream, cache_key, prompt_estimate) in zip(model_keys, streams):
+                    model_node_id = self.add_node("model", "", user_node_id, model=model_key)
+                    node_models[model_node_id] = model_key
+                    # Cache hits are counted but not stored again
+                    if provider is None:
+                        self.response_cache_hits += 1
+                        cache_keys[model_node_id] = None
+                        prompt_tokens[model_node_id] = None
+                    else:
+                        prompt_tokens[model_node_id] = prompt_estimate
+                        if use_cache and cache_key:
+                            self.response_cache_misses += 1
+                        cache_keys[model_node_id] = cache_key
+                    chunks[model_node_id] = []
+                    tasks.append(gen.watch(asyncio.create_task(_pump_stream(model_node_id, provider, stream, queue))))
+                # Follow the new answer unless the user has moved on
+                if self.current_node_id == user_node_id:
+                    self.current_node_id = next(iter(node_models))
+
+            usages: Dict[str, Any] = {}
+            errors: Dict[str, Exception] = {}
+            dirty: Set[str] = set()
+            remaining = len(tasks)
+            pending = 0
+            last_flush = time.monotonic()
+            while remaining:
+                model_node_id, delta, chunk_usage, error, done = await queue.get()
+                if model_node_id is None:
+                    break  # stopped; see below
+                if chunk_usage is not None:
+                    usages[model_node_id] = chunk_usage
+                if error is not None:
+                    errors[model_node_id] = error
+                if done:
+                    remaining -= 1
+                    finished.add(model_node_id)
+                    dirty.discard(model_node_id)
+                    content = "".join(chunks[model_node_id])
+                    await self._finish_model_node(
+                        root_id,
+                        model_node_id,
+                        node_models[model_node_id],
+                        content,
+                        usages.get(model_node_id),
+                        errors.get(model_node_id),
                     )
+                    cache_key = cache_keys[model_node_id]
+                    if cache_key and content and model_node_id not in errors:
+                        await response_cache.put(cache_key, content)
+                    continue
+                if not delta:
+                    continue
+                chunks[model_node_id].append(delta)
+                dirty.add(model_node_id)
+                pending += 1
+                now = time.monotonic()
+                if (
+                    pending >= config.STREAM_FLUSH_TOKENS
+                    or (now - last_flush) * 1000 >= config.STREAM_FLUSH_INTERVAL_MS
+                ):
+                    async with self:
+                        # A chat switched away from only gets the final write
+                        if self.root_id == root_id:
+                            for dirty_id in dirty:
+                                self._set_node_content(dirty_id, "".join(chunks[dirty_id]))
+                    dirty.clear()
+                    pending = 0
+                    last_flush = now
+
+            if remaining:
+                # Stopped: let the cancelled streams close their connections
+                # and give back their slots before anything else.
+                await asyncio.gather(*tasks, return_exceptions=True)
+                ticket.release()
+                while not queue.empty():
+                    model_node_id, delta, chunk_usage, error, done = queue.get_nowait()
+                    if model_node_id is None:
+                        continue
+                    if delta:
+                        chunks[model_node_id].append(delta)
+                    if chunk_usage is not None:
+                        usages[model_node_id] = chunk_usage
+                    if error is not None:
+                        errors[model_node_id] = error
+                for model_node_id, model_key in node_models.items():
+                    if model_node_id in finished:
+                        continue
+                    finished.add(model_node_id)
+                    content = "".join(chunks[model_node_id])
+                    usage = usages.get(model_node_id)
+                    if usage is None and prompt_tokens[model_node_id] is not None:
+                        # Providers report usage only at the end of a stream;
+                        # bill the prompt and what was generated so far.
+                        completion = context.estimate_tokens(content)
+                        usage = Usage(
+                            prompt_tokens[model_node_id],
+                            completion,
+                            prompt_tokens[model_node_id] + completion,
+                        )
+                    await self._finish_model_node(
+                        root_id,
+                        model_node_id,
+                        model_key,
+                        content or "Stopped.",
+                        usage,
+                        errors.get(model_node_id),
+                    )
+            
+        except Exception as e:
+            logger.exception("GenAI error: %s", e)
+            async with self:
+                if self.root_id == root_id and node_models:
+                    for model_node_id in node_models:
+                        if model_node_id in finished:
+                            continue
+                        partial = "".join(chunks[model_node_id])
+                        error_text = f"{partial}\n\nError: {str(e)}" if partial else f"Error: {str(e)}"
+                        self._set_node_content(model_node_id, error_text)
+                        self._queue_autosave(model_node_id)
+                elif self.root_id == root_id:
+                    # Add error node?
+                    self.add_node("model", f"Error: {str(e)}", user_node_id)
+        finally:
+            # Stop streams nobody will read (client gone or handler failed).
+            for task in tasks:
+                task.cancel()
+            if search_task:
+                search_task.cancel()
+            ticket.release()
+            gen.close()
+            async with self:
+                self._active_generations -= 1
+                self.processing = self._active_generations > 0
+                if not self.processing:
+                    self.queue_position = 0
+
+    def _admission_key(self) -> str:
+        """Who a generation counts against for the per-user in-flight cap."""
+        if self.user:
+            return f"user:{self.user['email']}"
+        return f"guest:{self.session_id or self.router.session.client_token}"
+
+    async def _open_stream(self, model_key: str, full_history: List[ChatNode], search_context: Optional[str], use_cache: bool = True):
+        """Returns (provider, stream, cache_key, prompt_tokens) for one model over its budgeted context.
+
+        On a response cache hit the provider is None and the stream replays
+        the cached answer. `prompt_tokens` estimates the request's input size
+        for billing streams that are stopped before reporting usage.
+        """
+        model_info = config.MODELS[model_key]
+        provider = model_info.get("provider", "google")
+        model_id = model_info["id"]
+
+        # Only the newest turns that fit the model's budget are sent;
+        # older ones are replaced by a (cached) summary of that prefix.
+        budget = context.context_budget(model_key)
+        reserved = context.estimate_tokens(search_context)
+        window = context.build_window(full_history, budget, reserved_tokens=reserved)
+        context_summary = None
+        if window.dropped:
+            window = context.build_window(
+                full_history, budget, reserved_tokens=reserved + config.SUMMARY_MAX_TOKENS
+            )
+            context_summary = await summaries.summarize(
+                self._summary_cache,
+                self.root_id if self.user else None,
+                window.dropped,
+            )
+            logger.debug(
+                "Context window for %s: sending %d of %d turns (~%d tokens) plus summary",
+                model_key, len(window.messages), len(window.messages) + len(window.dropped), window.tokens,
+            )
+        history = window.messages
+
+        cache_key = None
+        if config.RESPONSE_CACHE_ENABLED:
+            scope = self.user["email"] if self.user else f"guest:{self.session_id}"
+            cache_key = response_cache.cache_key(
+                scope, model_id, history, self.temperature, search_context, context_summary
+            )
+            if use_cache:
+                cached = await response_cache.get(cache_key)
+                if cached is not None:
+                    return None, _cached_stream(cached), cache_key, 0
+
+        if provider == "openai":
+            stream = self._stream_openai(model_id, history, search_context, context_summary)
+        elif provider == "anthropic":
+            stream = self._stream_anthropic(model_id, history, search_context, context_summary)
+        elif provider == "google": # Google Gemini
+            stream = self._stream_google(model_id, history, search_context, context_summary)
+        else:
+            raise Exception(f"Unknown provider: {provider}")
+        prompt_tokens = window.tokens + context.estimate_tokens(_system_prompt(search_context, context_summary))
+        return provider, stream, cache_key, prompt_tokens
+
+    async def _finish_model_node(self, root_id: str, model_node_id: str, model_key: str, content: str, usage, error: Optional[Exception]):
+        """Writes a finished stream's final content, usage and cost (call without the state lock).
+
+        The open tree and the in-memory totals are updated in one short locked
+        block; billing, and the stored row update when the user has since left
+        the chat `root_id`, run on the database pool outside it. The fresh
+        usage rollups are applied afterwards.
+        """
+        tokens = 0
+        cost = 0.0
+        billed = False
+        if error is not None:
+            logger.warning("GenAI error (%s): %s", model_key, error)
+            content = f"{content}\n\nError: {str(error)}" if content else f"Error: {str(error)}"
+        elif usage:
+            # Usage comes from the final stream chunk
+            usage = Usage(*usage)
+            tokens = usage.total_tokens
+            cost = _response_cost(config.MODELS[model_key]["pricing"], usage)
+            billed = True
+            if usage.cached_tokens:
+                logger.debug(
+                    "Prompt cache hit for %s: %d of %d prompt tokens",
+                    model_key, usage.cached_tokens, usage.prompt_tokens,
+                )
+
+        async with self:
+            if billed:
+                self._add_usage(cost, tokens)
+            email = self.user["email"] if self.user else None
+            session_id = self.session_id
+            is_open = self.root_id == root_id and model_node_id in self._nodes
+            if is_open:
+                if error is not None:
+                    self._set_node_content(model_node_id, content)
                 else:
-                    response = await client.chat.completions.create(
-                        model=api_model_id,
-                        messages=msgs,
-                        temperature=self.temperature
+                    self._set_node_content(model_node_id, content, tokens=tokens, cost=cost)
+                self._queue_autosave(model_node_id)
+        if email is None:
+            return
+
+        if not is_open:
+            await async_database.update_node(root_id, model_node_id, _normalize_latex(content), tokens, cost)
+        if billed:
+            # One transaction per response
+            rollups = await async_database.record_usage(
+                email,
+                cost,
+                tokens,
+                session_id,
+                datetime.datetime.now().isoformat(),
+            )
+            async with self:
+                if self.user and self.user["email"] == email:
+                    self._apply_usage_rollups(rollups)
+
+    def _queue_autosave(self, node_id: Optional[str] = None):
+        """Queues a write of `node_id`, or of the whole tree when None."""
+        if self.user and self.root_id:
+            autosave.queue.mark_dirty(self.user["email"], self.root_id, dict(self._node_map()), node_id)
+
+    def _set_node_content(self, node_id: str, content: str, **updates):
+        """Replaces a node's content (and optional stats) in place."""
+        node = self._nodes[node_id]
+        node.content = _normalize_latex(content)
+        for field, value in updates.items():
+            setattr(node, field, value)
+        # Nodes are plain objects, so re-assign to flag _nodes as changed
+        self._nodes[node_id] = node
+
+    async def _stream_openai(self, model_id: str, full_history: List[ChatNode], search_context: Optional[str], context_summary: Optional[str] = None):
+        """Yields (text_delta, usage) pairs; usage is a Usage on the last chunk."""
+        api_key = self._get_provider_key("openai")
+        if not api_key:
+            raise Exception("OpenAI API Key not set.")
+        
+        # Leased: an eviction while the request runs must not close the client
+        with clients.lease("openai", api_key) as client:
+            system_prompt = _system_prompt(search_context, context_summary)
+            msgs = [{"role": "system", "content": system_prompt}]
+            for item in full_history:
+                if item.role != "system":
+                     role = "user" if item.role == "user" else "assistant"
+                     msgs.append({"role": role, "content": item.content})
+        
+            # Direct call to the ID specified in config.
+            # Prefix caching is automatic; the key routes a conversation's branches
+            # to the same cache. Sent as extra_body so older SDKs accept it.
+            request_kwargs = {
+                "model": model_id,
+                "messages": msgs,
+                "extra_body": {"prompt_cache_key": self.root_id},
+            }
+            if not ("o1" in model_id or "gpt-5" in model_id):
+                request_kwargs["temperature"] = self.temperature # No temperature for reasoning models
+
+            if not config.STREAM_RESPONSES:
+                response = await client.chat.completions.create(**request_kwargs)
+                yield response.choices[0].message.content or "", _openai_usage(response.usage)
+                return
+
+            stream = await client.chat.completions.create(
+                **request_kwargs,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            try:
+                async for chunk in stream:
+                    delta = ""
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        delta = chunk.choices[0].delta.content
+                    yield delta, _openai_usage(chunk.usage)
+            finally:
+                # Drops the HTTP response when the stream is stopped early
+                await stream.close()
+
+    async def _stream_anthropic(self, model_id: str, full_history: List[ChatNode], search_context: Optional[str], context_summary: Optional[str] = None):
+        """Yields (text_delta, usage) pairs; usage is a Usage once the message is complete."""
+        api_key = self._get_provider_key("anthropic")
+        if not api_key:
+            raise Exception("Anthropic API Key not set.")
+        
+        # Leased: an eviction while the request runs must not close the client
+        with clients.lease("anthropic", api_key) as client:
+            msgs = []
+            for item in full_history:
+                if item.role != "system": # Claude system prompt is separate
+                     role = "user" if item.role == "user" else "assistant"
+                     msgs.append({"role": role, "content": item.content})
+        
+            system_prompt = _system_prompt(search_context, context_summary)
+            request_kwargs = {
+                "model": model_id,
+                "max_tokens": 1024,
+                "temperature": self.temperature,
+                "messages": _cache_marked(msgs),
+                "system": system_prompt,
+            }
+
+            if not config.STREAM_RESPONSES:
+                response = await client.messages.create(**request_kwargs)
+                yield response.content[0].text, _anthropic_usage(response.usage)
+                return
+
+            async with client.messages.stream(**request_kwargs) as stream:
+                async for text in stream.text_stream:
+                    yield text, None
+                response = await stream.get_final_message()
+            if response.usage:
+                yield "", _anthropic_usage(response.usage)
+
+    async def _stream_google(self, model_id: str, full_history: List[ChatNode], search_context: Optional[str], context_summary: Optional[str] = None):
+        """Yields (text_delta, usage) pairs; usage metadata on the last chunk holds the totals."""
+        api_key = self._get_provider_key("google")
+        if not api_key:
+             raise Exception("Google API Key not set.")
+
+        # Leased: an eviction while the request runs must not close the client
+        with clients.lease("google", api_key) as client:
+        
+            contents = []
+            if context_summary:
+                contents.append(
+                    types.Content(
+                        role="user",
+                        parts=[types.Part.from_text(text=f"Summary of earlier conversation:\n{context_summary}")],
                     )
-                model_text = response.choices[0].message.content
-                if response.usage:
-                     prompt_toks = response.usage.prompt_tokens
-                     cand_toks = response.usage.completion_tokens
-                     total_toks = response.usage.total_tokens
-                     pricing = model_info["pricing"]
-                     total_step_cost = (prompt_toks/1e6 * pricing["INPUT_PER_1M"]) + (cand_toks/1e6 * pricing["OUTPUT_PER_1M"])
-                     self.update_stats(total_step_cost, total_toks)
-
-            elif provider == "anthropic":
-                api_key = self._get_provider_key("anthropic")
-                if not api_key:
-                    raise Exception("Anthropic API Key not set.")
-                
-                client = anthropic.AsyncAnthropic(api_key=api_key)
-                msgs = []
-                for item in full_history:
-                    if item["role"] != "system": # Claude system prompt is separate
-                         role = "user" if item["role"] == "user" else "assistant"
-                         msgs.append({"role": role, "content": item["content"]})
-                
-                system_prompt = "You are a helpful assistant."
-                if search_context:
-                    system_prompt = f"{system_prompt}\n\nWeb search results:\n{search_context}"
-                response = await client.messages.create(
-                    model=model_id,
-                    max_tokens=1024,
-                    temperature=self.temperature,
-                    messages=msgs,
-                    system=system_prompt
                 )
-                model_text = response.content[0].text
-                
-                if response.usage:
-                    input_toks = response.usage.input_tokens
-                    output_toks = response.usage.output_tokens
-                    total_toks = input_toks + output_toks
-                    pricing = model_info["pricing"]
-                    total_step_cost = (input_toks/1e6 * pricing["INPUT_PER_1M"]) + (output_toks/1e6 * pricing["OUTPUT_PER_1M"])
-                    self.update_stats(total_step_cost, total_toks)
-
-            elif provider == "google": # Google Gemini
-                api_key = self._get_provider_key("google")
-                if not api_key:
-                     raise Exception("Google API Key not set.")
-
-                # Use async client
-                client = Client(api_key=api_key)
-                
-                contents = []
-                if search_context:
-                    contents.append(
-                        types.Content(
-                            role="user",
-                            parts=[types.Part.from_text(text=f"Web search results:\n{search_context}")],
-                        )
+            if search_context:
+                contents.append(
+                    types.Content(
+                        role="user",
+                        parts=[types.Part.from_text(text=f"Web search results:\n{search_context}")],
                     )
-                for item in full_history:
-                    if item["role"] == "user":
-                        contents.append(types.Content(role="user", parts=[types.Part.from_text(text=item["content"])]))
-                    elif item["role"] == "model":
-                        contents.append(types.Content(role="model", parts=[types.Part.from_text(text=item["content"])]))
-                
-                # Configure safe defaults if temperature not supported
-                config_kwargs = {}
-                if model_id != "gemini-2.0-flash-exp": 
-                     # 2.0 Flash might have strict temp rules, but usually google is fine.
-                     # If issue persists, we can remove it.
-                     if self.temperature != 1.0: # Only send if non-default?
-                          pass # Actually, just send it. If 2.0 complains, we act.
-                
-                # Using aio for async
+                )
+            for item in full_history:
+                if item.role == "user":
+                    contents.append(types.Content(role="user", parts=[types.Part.from_text(text=item.content)]))
+                elif item.role == "model":
+                    contents.append(types.Content(role="model", parts=[types.Part.from_text(text=item.content)]))
+        
+            generate_config = types.GenerateContentConfig(temperature=self.temperature)
+
+            # Implicit prefix caching is automatic; hits show up in the metadata.
+            def _usage(metadata):
+                if not metadata or metadata.total_token_count is None:
+                    return None
+                return Usage(
+                    metadata.prompt_token_count or 0,
+                    metadata.candidates_token_count or 0,
+                    metadata.total_token_count,
+                    cached_tokens=metadata.cached_content_token_count or 0,
+                )
+
+            # Using aio for async
+            if not config.STREAM_RESPONSES:
                 response = await client.aio.models.generate_content(
                     model=model_id,
                     contents=contents,
-                    config=types.GenerateContentConfig(
-                        temperature=self.temperature
-                    )
+                    config=generate_config,
                 )
-                
-                model_text = response.text
-                
-                if response.usage_metadata:
-                    prompt_toks = response.usage_metadata.prompt_token_count
-                    cand_toks = response.usage_metadata.candidates_token_count
-                    total_toks = response.usage_metadata.total_token_count
-                    pricing = model_info["pricing"]
-                    total_step_cost = (prompt_toks/1e6 * pricing["INPUT_PER_1M"]) + (cand_toks/1e6 * pricing["OUTPUT_PER_1M"])
-                    self.update_stats(total_step_cost, total_toks)
-            
-            # 3. Add Model Node (with stats)
-            model_node_id = self.add_node(
-                "model",
-                model_text,
-                self.current_node_id,
-                tokens=total_toks,
-                cost=total_step_cost,
-                model=self.selected_model_key # Save model name
+                yield response.text or "", _usage(response.usage_metadata)
+                return
+
+            stream = await client.aio.models.generate_content_stream(
+                model=model_id,
+                contents=contents,
+                config=generate_config,
             )
-            self.current_node_id = model_node_id
-            
-        except Exception as e:
-            print(f"GenAI Error: {e}")
-            # Add error node?
-            self.add_node("model", f"Error: {str(e)}", self.current_node_id)
-            
-        self.processing = False
+            try:
+                async for chunk in stream:
+                    yield chunk.text or "", _usage(chunk.usage_metadata)
+            finally:
+                # Drops the HTTP response when the stream is stopped early
+                await stream.aclose()
 
     # --- Computed Props ---
     
     # --- Folding State ---
-    collapsed_nodes: List[str] = []
+    _collapsed_nodes: Set[str] = set()
+
+    # Root-to-node paths; cleared on edits that can change ancestry.
+    _path_index: tree_index.PathIndex = tree_index.PathIndex(config.PATH_CACHE_SIZE)
+
+    # Summaries of turns that no longer fit the context budget (see summaries).
+    _summary_cache: summaries.SummaryCache = summaries.SummaryCache(config.SUMMARY_CACHE_SIZE)
+
+    # Full text of lazily loaded messages that have been shown (see bodies).
+    _bodies: bodies.BodyCache = bodies.BodyCache(config.BODY_CACHE_SIZE)
+
+    # Flattened tree rows for the sidebar, spliced incrementally on each edit
+    # (see tree_index). Only a window of at most TREE_WINDOW_ROWS rows is sent
+    # (flat_tree), so a delta never carries the whole tree; it follows new
+    # rows at the bottom and the selection, and is paged with
+    # shift_tree_window. Selection is kept out of the rows: see
+    # selected_tree_node_id.
+    _flat: tree_index.FlatTree = tree_index.FlatTree()
+    _tree_window_start: int = 0
+    _tree_window_pinned: bool = True  # window shows the last row
+    flat_tree: List[Dict[str, Any]] = []
+    tree_rows_above: int = 0
+    tree_rows_below: int = 0
 
     def toggle_node_collapse(self, node_id: str):
-        if node_id in self.collapsed_nodes:
-            self.collapsed_nodes.remove(node_id)
+        if node_id in self._collapsed_nodes:
+            self._collapsed_nodes.discard(node_id)
         else:
-            self.collapsed_nodes.append(node_id)
-
-    @rx.var(cache=True)
-    def flat_tree(self) -> List[Dict[str, Any]]:
-        """Returns a flattened list of nodes for rendering with indentation."""
-        items = []
-        if not self.root_id or self.root_id not in self.nodes:
-            return items
-
-        def traverse(node_id, level=0, label_prefix=""):
-            if node_id not in self.nodes: return
-            node = self.nodes[node_id]
-            
-            # DEBUG
-            # print(f"Traversing {node.id} ({node.role}). Children: {len(node.children_ids)}")
-
-            # Determine folding state
-            # Check for VISIBLE children (exclude model/system)
-            visible_children = []
-            for cid in node.children_ids:
-                if cid in self.nodes:
-                    child_role = self.nodes[cid].role
-                    if child_role != "model" and child_role != "system":
-                        visible_children.append(cid)
-            
-            has_children = len(visible_children) > 0
-            is_collapsed = node_id in self.collapsed_nodes
-            
-            # Determine if we show this node
-            # Hide model nodes and system nodes from the tree view
-            if node.role != "model" and node.role != "system":
-                items.append({
-                    "id": node.id,
-                    "role": node.role,
-                    "content": node.content,
-                    "indent": level,
-                    "index_label": label_prefix,
-                    "is_grafted": node.is_grafted,
-                    "is_selected": (node.id == self.current_node_id) or self._is_active_model_parent(node.id),
-                    "has_children": has_children,
-                    "is_collapsed": is_collapsed
-                })
-            
-            # Skip children if collapsed
-            if is_collapsed:
-                return
+            self._collapsed_nodes.add(node_id)
+        self._splice_flat_tree(node_id)
 
-            # Traverse children
-            child_idx = 1
-            for cid in node.children_ids:
-                if cid not in self.nodes: continue
-                child_node = self.nodes[cid]
-                
-                # Calculate prefix & level
-                next_level = level
-                current_prefix = ""
-                
-                if child_node.role == "user":
-                    next_level = level + 1
-                    if label_prefix:
-                        current_prefix = f"{label_prefix}.{child_idx}"
-                    else:
-                        current_prefix = f"{child_idx}"
-                    child_idx += 1
-                else:
-                    next_level = level
-                    current_prefix = label_prefix 
-                
-                traverse(cid, next_level, current_prefix)
-        
-        # print("--- Starting Flat Tree Rebuild ---")
-        traverse(self.root_id)
-        # print(f"--- Rebuild Complete. Items: {len(items)} ---")
-        return items
-
-    def _is_active_model_parent(self, node_id: str) -> bool:
-        """Helper to check if this node is the User parent of the currently active Model response"""
-        if not self.current_node_id: return False
-        curr = self.nodes.get(self.current_node_id)
-        # If current active node is MODEL, its PARENT (User) should be highlighted
-        if curr and curr.role == "model" and curr.parent_id == node_id:
-            return True
-        return False
+    def _node_map(self) -> Dict[str, ChatNode]:
+        """`_nodes` without Reflex's change-tracking proxy, for read-only tree walks.
+
+        Every lookup through the proxy costs a stack inspection; walks over
+        thousands of nodes use the plain dict instead.
+        """
+        nodes = self._nodes
+        return getattr(nodes, "__wrapped__", nodes)
+
+    def _rebuild_flat_tree(self):
+        if not self.root_id or self.root_id not in self._nodes:
+            self._flat.reset([])
+        else:
+            self._flat.reset(tree_index.flatten_subtree(self._node_map(), self.root_id, self._collapsed_nodes))
+        self._tree_window_pinned = True
+        self._sync_tree_window()
+
+    def _splice_flat_tree(self, changed_id: Optional[str]):
+        """Re-flattens only the part of the tree affected by an edit under changed_id."""
+        if not self.root_id or self.root_id not in self._nodes:
+            self._rebuild_flat_tree()
+            return
+        if self._flat.splice(self._node_map(), self.root_id, changed_id, self._collapsed_nodes):
+            self._sync_tree_window()
+
+    def _sync_tree_window(self, reveal: bool = True):
+        """Re-slices flat_tree (keeping the selected row in view if `reveal`); sends only what changed."""
+        rows = self._flat.rows
+        size = config.TREE_WINDOW_ROWS
+        last_start = max(0, len(rows) - size)
+        start = last_start if self._tree_window_pinned else min(self._tree_window_start, last_start)
+        focus = self._flat.index(self._tree_focus_id()) if reveal else -1
+        if focus >= 0 and not start <= focus < start + size:
+            start = max(0, min(focus - size // 2, last_start))
+        self._tree_window_start = start
+        self._tree_window_pinned = start == last_start
+        window = rows[start:start + size]
+        if window != self.flat_tree:
+            self.flat_tree = window
+        if self.tree_rows_above != start:
+            self.tree_rows_above = start
+        below = max(0, len(rows) - start - size)
+        if self.tree_rows_below != below:
+            self.tree_rows_below = below
+
+    def shift_tree_window(self, direction: int):
+        """Pages the sidebar tree by half a window up (-1) or down (1)."""
+        size = config.TREE_WINDOW_ROWS
+        last_start = max(0, len(self._flat.rows) - size)
+        self._tree_window_start = max(0, min(self._tree_window_start + direction * (size // 2), last_start))
+        self._tree_window_pinned = self._tree_window_start == last_start
+        self._sync_tree_window(reveal=False)
+
+    def _tree_focus_id(self) -> str:
+        curr = self._node_map().get(self.current_node_id)
+        if curr and curr.role == "model" and curr.parent_id:
+            return curr.parent_id
+        return self.current_node_id
+
+    @rx.var
+    def selected_tree_node_id(self) -> str:
+        """The highlighted tree row: the current user node, or the user parent of the active answer."""
+        return self._tree_focus_id()
 
     @rx.var
-    def chat_history(self) -> List[Dict[str, str]]:
-        """Returns the list of messages for the current view."""
-        return self.get_history_list(self.current_node_id)
-
-    def get_history_list(self, target_id: str) -> List[Dict[str, str]]:
-        history = []
-        curr = target_id
-        print(f"DEBUG: Building history for {target_id}")
-        while curr and curr in self.nodes:
-            node = self.nodes[curr]
-            print(f"DEBUG: Visiting {node.id} ({node.role}) -> Parent: {node.parent_id}")
-            history.insert(0, {
-                "id": node.id,
-                "role": node.role,
-                "content": node.content,
-                "timestamp": node.timestamp,
-                "tokens": node.tokens,
-                "cost": node.cost,
-                "model": node.model or "" # Handle None
-            })
-            curr = node.parent_id
-        print(f"DEBUG: Final history length: {len(history)}")
-        return history
+    def history_length(self) -> int:
+        """Number of messages on the current branch (root included)."""
+        return len(self._path_index.path(self._node_map(), self.current_node_id))
+
+    def get_path_nodes(self, target_id: str) -> List[ChatNode]:
+        """Nodes from the root down to target_id (served from the path cache).
+
+        No I/O: nodes of a lazily opened chat may still hold previews; load
+        their bodies first where the full text matters.
+        """
+        nodes = self._node_map()
+        path = self._path_index.path(nodes, target_id)
+        logger.debug("History for %s: %d nodes", target_id, len(path))
+        return [nodes[nid] for nid in path]
+
+    def _install_bodies(self, contents: Dict[str, str], keep: Collection[str]):
+        """Swaps fetched full text into the tree (see bodies.BodyCache.fill)."""
+        nodes = self._node_map()
+        self._bodies.fill(nodes, contents, keep=keep)
+        # fill() edits nodes in place; re-assign them so views re-read the text
+        for node_id in contents:
+            if node_id in nodes:
+                self._nodes[node_id] = nodes[node_id]
+
+    async def _load_bodies(self, node_ids: List[str]):
+        """Swaps in the full text of any of `node_ids` holding only a preview.
+
+        The read runs on the SQLite thread pool. From background events use
+        hydrate_shown's pattern instead, so the read happens outside the lock.
+        """
+        missing = self._bodies.missing(self._node_map(), node_ids)
+        if missing:
+            contents = await async_database.load_node_contents(self.root_id, missing)
+            self._install_bodies(contents, node_ids)
+
+    @rx.event(background=True)
+    async def hydrate_shown(self):
+        """Loads the full text of shown messages that are still previews.
+
+        Chained from the handlers that change what is shown; displayed_messages
+        itself never touches the database. The read runs outside the state lock.
+        """
+        async with self:
+            root_id = self.root_id
+            missing = self._bodies.missing(self._node_map(), self._shown_ids())
+        if not missing:
+            return
+        contents = await async_database.load_node_contents(root_id, missing)
+        async with self:
+            if self.root_id == root_id:
+                self._install_bodies(contents, self._shown_ids())
+
+    def _message_dict(self, node: ChatNode) -> Dict[str, str]:
+        return {
+            "id": node.id,
+            "role": node.role,
+            "content": node.content,
+            "timestamp": node.timestamp,
+            "tokens": node.tokens,
+            "cost": node.cost,
+            "model": node.model or "", # Handle None
+            "answer_label": self._answer_label(node),
+        }
+
+    def _visible_path(self) -> List[str]:
+        """Ids on the current branch, root to current, without system messages."""
+        nodes = self._node_map()
+        return [
+            nid for nid in self._path_index.path(nodes, self.current_node_id)
+            if nodes[nid].role != "system"
+        ]
+
+    def _history_start(self, visible: List[str]) -> int:
+        """Index in `visible` of the oldest message on the current full-history page."""
+        if self._history_cursor in visible:
+            return visible.index(self._history_cursor)
+        return max(0, len(visible) - config.HISTORY_PAGE_SIZE)
+
+    def _model_siblings(self, node: ChatNode) -> List[str]:
+        parent = self._nodes.get(node.parent_id) if node.parent_id else None
+        if node.role != "model" or parent is None:
+            return []
+        return [cid for cid in parent.children_ids if cid in self._nodes and self._nodes[cid].role == "model"]
+
+    def _answer_label(self, node: ChatNode) -> str:
+        """"2/3" for the second of three answers to the same prompt, else ""."""
+        siblings = self._model_siblings(node)
+        if len(siblings) < 2:
+            return ""
+        return f"{siblings.index(node.id) + 1}/{len(siblings)}"
+
+    def switch_answer(self, node_id: str, step: int):
+        """Shows the previous/next sibling answer to the same prompt."""
+        node = self._nodes.get(node_id)
+        if node is None:
+            return
+        siblings = self._model_siblings(node)
+        if len(siblings) < 2:
+            return
+        self.current_node_id = siblings[(siblings.index(node_id) + step) % len(siblings)]
+        return State.hydrate_shown
         
+    def _shown_ids(self) -> List[str]:
+        """Messages displayed_messages draws from: the folded pair, the current
+        full-history page, or (while filtering) the whole branch."""
+        visible = self._visible_path()
+        if self.history_search_query.strip() or len(visible) <= 1:
+            return visible
+        if not self.show_full_history:
+            # Show last Q&A pair (or last message if User)
+            return visible[-2:] if self._node_map()[visible[-1]].role == "model" else visible[-1:]
+        return visible[self._history_start(visible):]
+
     @rx.var
     def displayed_messages(self) -> List[Dict[str, str]]:
-        """Handles folding logic for display."""
-        hist = self.chat_history
-        if not hist: return []
-        
-        # Filter out system
-        visible = [h for h in hist if h["role"] != "system"]
+        """Handles folding and paging for display, from memory only (see hydrate_shown)."""
+        nodes = self._node_map()
+        shown = [self._message_dict(nodes[nid]) for nid in self._shown_ids()]
         query = self.history_search_query.strip().lower()
         if query:
-            return [
-                h
-                for h in visible
-                if query in (h.get("content") or "").lower()
-            ]
-        
-        if not self.show_full_history and len(visible) > 1:
-            # Show last Q&A pair (or last message if User)
-            last = visible[-1]
-            if last["role"] == "model":
-                return visible[-2:]
-            else:
-                return [last]
-        return visible
+            return [h for h in shown if query in (h.get("content") or "").lower()]
+        return shown
+
+    @rx.var
+    def older_message_count(self) -> int:
+        """Messages on the branch above the current full-history page."""
+        if not self.show_full_history or self.history_search_query.strip():
+            return 0
+        return self._history_start(self._visible_path())
 
     def toggle_history(self):
         self.show_full_history = not self.show_full_history
+        self._history_cursor = ""
+        return State.hydrate_shown
+
+    def load_older_messages(self):
+        """Extends the full-history view by one page of earlier messages."""
+        visible = self._visible_path()
+        if visible:
+            start = self._history_start(visible)
+            self._history_cursor = visible[max(0, start - config.HISTORY_PAGE_SIZE)]
+        return State.hydrate_shown
 
 
 
@@ -964,10 +1615,14 @@ class State(rx.State):
     daily_tokens: int = 0
     weekly_cost: float = 0.0
     weekly_tokens: int = 0
+    response_cache_hits: int = 0
+    response_cache_misses: int = 0
 
     def _reset_session_stats(self):
         self.session_cost = 0.0
         self.session_tokens = 0
+        self.response_cache_hits = 0
+        self.response_cache_misses = 0
 
     def _start_session(self):
         self.session_id = str(uuid.uuid4())[:8]
@@ -978,20 +1633,27 @@ class State(rx.State):
             self.weekly_cost = 0.0
             self.weekly_tokens = 0
 
-    def refresh_usage_rollups(self):
+    async def refresh_usage_rollups(self):
         if not self.user:
             self.daily_cost = self.session_cost
             self.daily_tokens = self.session_tokens
             self.weekly_cost = self.session_cost
             self.weekly_tokens = self.session_tokens
             return
-        rollups = database.get_usage_rollups(self.user["email"])
+        self._apply_usage_rollups(await async_database.get_usage_rollups(self.user["email"]))
+
+    def _apply_usage_rollups(self, rollups: Dict[str, Any]):
         self.daily_cost = rollups["daily_cost"]
         self.daily_tokens = rollups["daily_tokens"]
         self.weekly_cost = rollups["weekly_cost"]
         self.weekly_tokens = rollups["weekly_tokens"]
     
-    def update_stats(self, cost: float, tokens: int):
+    def _add_usage(self, cost: float, tokens: int):
+        """Adds a response's usage to the in-memory totals (under the state lock).
+
+        Signed-in users' rollups are refreshed once the usage is recorded
+        (see _finish_model_node).
+        """
         # Update Session Stats (Always)
         self.session_cost += cost
         self.session_tokens += tokens
@@ -1003,84 +1665,8 @@ class State(rx.State):
             
             self.user["total_cost"] = current_cost + cost
             self.user["total_tokens"] = current_tokens + tokens
-            
-            # Update DB
-            database.update_user_stats(self.user["email"], cost, tokens)
-            database.log_usage(
-                self.user["email"],
-                cost,
-                tokens,
-                self.session_id,
-                datetime.datetime.now().isoformat(),
-            )
-            self.refresh_usage_rollups()
         else:
             self.daily_cost = self.session_cost
             self.daily_tokens = self.session_tokens
             self.weekly_cost = self.session_cost
             self.weekly_tokens = self.session_tokens
-
-    def _fetch_search_context(self, query: str) -> Optional[str]:
-        api_key = self._get_provider_key("search")
-        if not query or not api_key:
-            return None
-        payload = {
-            "api_key": api_key,
-            "query": query,
-            "search_depth": "basic",
-            "max_results": 5,
-        }
-        data = json.dumps(payload).encode("utf-8")
-        req = request.Request(
-            "https://api.tavily.com/search",
-            data=data,
-            headers={"Content-Type": "application/json"},
-        )
-        try:
-            with request.urlopen(req, timeout=10) as resp:
-                raw_body = resp.read()
-            body = json.loads(raw_body.decode("utf-8"))
-        except error.URLError as exc:
-            print(f"Tavily search failed: {exc}")
-            return None
-        results = body.get("results", [])
-        if not results:
-            return None
-        lines = []
-        for idx, result in enumerate(results, start=1):
-            title = (result.get("title") or "").strip()
-            url = (result.get("url") or "").strip()
-            content = (result.get("content") or "").strip()
-            if not title and not url and not content:
-                continue
-            lines.append(f"{idx}. {title}\n{url}\n{content}".strip())
-        return "\n\n".join(lines) if lines else None
-
-    def _validate_tavily_key(self, api_key: str) -> bool:
-        if not api_key:
-            return False
-        payload = {
-            "api_key": api_key,
-            "query": "healthcheck",
-            "search_depth": "basic",
-            "max_results": 1,
-        }
-        data = json.dumps(payload).encode("utf-8")
-        req = request.Request(
-            "https://api.tavily.com/search",
-            data=data,
-            headers={"Content-Type": "application/json"},
-        )
-        try:
-            with request.urlopen(req, timeout=10) as resp:
-                if resp.status and resp.status >= 400:
-                    return False
-                raw_body = resp.read()
-            body = json.loads(raw_body.decode("utf-8"))
-        except error.HTTPError:
-            return False
-        except error.URLError:
-            return False
-        except ValueError:
-            return False
-        return isinstance(body, dict)
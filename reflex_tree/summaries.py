@@ -0,0 +1,135 @@
+"""Cached, extractive summaries of root-to-node paths.
+
+When a branch outgrows its context budget (see context.py), the turns that
+were dropped are replaced by a compact summary of that path. A summary is
+stored under the id of the last node it covers together with a hash chained
+over the role and content of every turn on the path. Sibling branches share
+their ancestors, so they reuse the same entry, and extending a branch only
+summarizes the newly dropped turns on top of the cached prefix.
+
+Editing any ancestor changes the chained hash, so stale entries are simply
+never matched again. Deleted nodes are purged explicitly. Entries are kept in
+memory per session and persisted in the `summaries` table per conversation.
+"""
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from . import async_database, config
+from .classes import ChatNode
+from .context import estimate_tokens
+
+ROLE_LABELS = {"user": "User", "model": "Assistant"}
+ELISION = "[...]"
+
+
+def path_hashes(turns: List[ChatNode]) -> List[str]:
+    """Chained hash of each prefix of `turns` (entry i covers turns[:i + 1])."""
+    hashes = []
+    digest = ""
+    for node in turns:
+        h = hashlib.sha1(digest.encode())
+        h.update(node.role.encode())
+        h.update(b"\0")
+        h.update(node.content.encode())
+        digest = h.hexdigest()
+        hashes.append(digest)
+    return hashes
+
+
+def snippet(node: ChatNode) -> str:
+    """One line with the start of a message, whitespace collapsed."""
+    text = " ".join(node.content.split())
+    if len(text) > config.SUMMARY_SNIPPET_CHARS:
+        text = text[: config.SUMMARY_SNIPPET_CHARS].rstrip() + "..."
+    return f"{ROLE_LABELS.get(node.role, node.role)}: {text}"
+
+
+def extend(summary: str, turns: List[ChatNode]) -> str:
+    """Appends `turns` to `summary`, eliding the middle to stay in budget.
+
+    The first line (usually the opening question) is always kept, since it
+    names the topic of the whole branch.
+    """
+    lines = summary.split("\n") if summary else []
+    lines.extend(snippet(node) for node in turns)
+    if not lines:
+        return ""
+    head, tail = lines[0], [line for line in lines[1:] if line != ELISION]
+    elided = len(tail) < len(lines) - 1
+    budget = config.SUMMARY_MAX_TOKENS - estimate_tokens(head) - estimate_tokens(ELISION)
+    kept: List[str] = []
+    for line in reversed(tail):
+        budget -= estimate_tokens(line) + 1
+        if budget < 0:
+            elided = True
+            break
+        kept.append(line)
+    kept.reverse()
+    return "\n".join([head] + ([ELISION] if elided else []) + kept)
+
+
+class SummaryCache:
+    """In-memory summaries keyed by node id, checked against the path hash.
+
+    A plain class for the same reason as tree_index.PathIndex: as a backend
+    var it is not proxied, so filling it does not dirty state.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[str, str]] = {}
+
+    def get(self, node_id: str, path_hash: str) -> Optional[str]:
+        entry = self._entries.get(node_id)
+        if entry is not None and entry[0] == path_hash:
+            return entry[1]
+        return None
+
+    def put(self, node_id: str, path_hash: str, summary: str) -> None:
+        if node_id not in self._entries and len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[node_id] = (path_hash, summary)
+
+    def discard(self, node_ids) -> None:
+        for node_id in node_ids:
+            self._entries.pop(node_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+async def summarize(cache: SummaryCache, conversation_id: Optional[str], dropped: List[ChatNode]) -> str:
+    """Summary of `dropped` (the oldest turns of a branch, oldest first).
+
+    Reuses the deepest cached prefix (memory first, then the database when
+    `conversation_id` is given) and persists the result for later turns and
+    sibling branches. Pass no `conversation_id` for guests.
+    """
+    if not dropped:
+        return ""
+    hashes = path_hashes(dropped)
+    base_index = -1
+    base = ""
+    for i in range(len(dropped) - 1, -1, -1):
+        hit = cache.get(dropped[i].id, hashes[i])
+        if hit is not None:
+            base_index, base = i, hit
+            break
+    if base_index < len(dropped) - 1 and conversation_id:
+        candidates = [node.id for node in dropped[base_index + 1:]]
+        stored = await async_database.get_summaries(conversation_id, candidates)
+        for i in range(len(dropped) - 1, base_index, -1):
+            entry = stored.get(dropped[i].id)
+            if entry is not None and entry[0] == hashes[i]:
+                base_index, base = i, entry[1]
+                cache.put(dropped[i].id, hashes[i], base)
+                break
+
+    if base_index == len(dropped) - 1:
+        return base
+    summary = extend(base, dropped[base_index + 1:])
+    last = dropped[-1]
+    cache.put(last.id, hashes[-1], summary)
+    if conversation_id:
+        await async_database.save_summary(conversation_id, last.id, hashes[-1], summary)
+    return summary
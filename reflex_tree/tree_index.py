@@ -0,0 +1,247 @@
+"""Incrementally maintained, flattened view of the conversation tree.
+
+The sidebar renders the tree as a flat list of rows (one per visible user
+node, with indentation and a dotted index label). Labels keep only their last
+LABEL_PARTS components ("…2.1.3") so row size does not grow with depth; the
+indentation already shows the depth. A node's rows always form a
+contiguous run: the node's own row followed by every row with a deeper indent.
+So a structural edit only needs to re-flatten the subtree of the nearest
+visible ancestor and splice it in place of the old run.
+"""
+from typing import Any, Collection, Dict, List, Optional
+
+from .classes import ChatNode
+
+HIDDEN_ROLES = ("model", "system")
+# Rows only carry the start of each message; that's all the sidebar shows.
+PREVIEW_CHARS = 30
+LABEL_PARTS = 3
+ELLIPSIS = "…"
+
+
+def child_label(prefix: str, index: int) -> str:
+    """Label of the index-th user child under a row labelled `prefix`."""
+    if not prefix:
+        return str(index)
+    parts = prefix.lstrip(ELLIPSIS).split(".")
+    if len(parts) < LABEL_PARTS and not prefix.startswith(ELLIPSIS):
+        return f"{prefix}.{index}"
+    return ELLIPSIS + ".".join(parts[1 - LABEL_PARTS:] + [str(index)])
+
+
+def _row(node: ChatNode, level: int, label: str, has_children: bool, is_collapsed: bool) -> Dict[str, Any]:
+    return {
+        "id": node.id,
+        "role": node.role,
+        "preview": node.content[:PREVIEW_CHARS],
+        "indent": level,
+        "index_label": label,
+        "is_grafted": node.is_grafted,
+        "has_children": has_children,
+        "is_collapsed": is_collapsed,
+    }
+
+
+def flatten_subtree(
+    nodes: Dict[str, ChatNode],
+    node_id: str,
+    collapsed: Collection[str],
+    level: int = 0,
+    label_prefix: str = "",
+) -> List[Dict[str, Any]]:
+    """Rows for `node_id` and its visible descendants, in display order."""
+    rows = []
+    stack = [(node_id, level, label_prefix)]
+    while stack:
+        current_id, current_level, prefix = stack.pop()
+        node = nodes.get(current_id)
+        if node is None:
+            continue
+        is_collapsed = current_id in collapsed
+
+        # Hide model nodes and system nodes from the tree view
+        if node.role not in HIDDEN_ROLES:
+            # Fold arrow only when there are VISIBLE children (exclude model/system)
+            has_children = any(
+                cid in nodes and nodes[cid].role not in HIDDEN_ROLES
+                for cid in node.children_ids
+            )
+            rows.append(_row(node, current_level, prefix, has_children, is_collapsed))
+
+        # Skip children if collapsed
+        if is_collapsed:
+            continue
+
+        children = []
+        child_idx = 1
+        for cid in node.children_ids:
+            child = nodes.get(cid)
+            if child is None:
+                continue
+            if child.role == "user":
+                children.append((cid, current_level + 1, child_label(prefix, child_idx)))
+                child_idx += 1
+            else:
+                children.append((cid, current_level, prefix))
+        stack.extend(reversed(children))
+    return rows
+
+
+def visible_anchor(nodes: Dict[str, ChatNode], node_id: Optional[str]) -> Optional[str]:
+    """Nearest ancestor-or-self that owns a row (None means the whole tree)."""
+    curr = node_id
+    while curr and curr in nodes:
+        if nodes[curr].role not in HIDDEN_ROLES:
+            return curr
+        curr = nodes[curr].parent_id
+    return None
+
+
+def subtree_span(rows: List[Dict[str, Any]], start: int) -> int:
+    """Number of rows owned by the row at `start` (itself plus deeper rows)."""
+    indent = rows[start]["indent"]
+    end = start + 1
+    while end < len(rows) and rows[end]["indent"] > indent:
+        end += 1
+    return end - start
+
+
+class FlatTree:
+    """The sidebar rows plus an id -> row position map.
+
+    A plain class (like PathIndex) so splicing does not go through a state
+    proxy; the state re-slices its `flat_tree` window only when a splice
+    actually changed rows.
+    """
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self._pos: Dict[str, int] = {}
+
+    def _reindex(self, start: int) -> None:
+        for idx in range(start, len(self.rows)):
+            self._pos[self.rows[idx]["id"]] = idx
+
+    def reset(self, rows: List[Dict[str, Any]]) -> None:
+        self.rows = rows
+        self._pos = {}
+        self._reindex(0)
+
+    def index(self, node_id: str) -> int:
+        return self._pos.get(node_id, -1)
+
+    def splice(
+        self,
+        nodes: Dict[str, ChatNode],
+        root_id: str,
+        changed_id: Optional[str],
+        collapsed: Collection[str],
+    ) -> bool:
+        """Re-flattens only the subtree affected by a change under `changed_id`.
+
+        Returns whether any row changed. Anchors hidden inside a collapsed
+        ancestor have no rows, so there is nothing to update for them.
+        """
+        anchor_id = visible_anchor(nodes, changed_id)
+        if anchor_id is None:
+            rows = flatten_subtree(nodes, root_id, collapsed)
+            if rows == self.rows:
+                return False
+            self.reset(rows)
+            return True
+        start = self.index(anchor_id)
+        if start < 0:
+            return False
+        anchor = self.rows[start]
+        span = subtree_span(self.rows, start)
+        run = flatten_subtree(nodes, anchor_id, collapsed, anchor["indent"], anchor["index_label"])
+        if run == self.rows[start:start + span]:
+            return False  # e.g. a hidden model answer was added
+        for row in self.rows[start:start + span]:
+            self._pos.pop(row["id"], None)
+        self.rows[start:start + span] = run
+        if len(run) != span:
+            self._reindex(start)
+        else:
+            # Rows after the run keep their positions
+            for offset, row in enumerate(run):
+                self._pos[row["id"]] = start + offset
+        return True
+
+
+class _Segment:
+    """Ids of a path below its nearest cached ancestor; the prefix is shared."""
+
+    __slots__ = ("prefix", "ids")
+
+    def __init__(self, prefix: Optional["_Segment"], ids: List[str]):
+        self.prefix = prefix
+        self.ids = ids
+
+
+class PathIndex:
+    """Memoized root-to-node id paths.
+
+    A path is built by walking parent pointers only until the first ancestor
+    whose path is already cached, so consecutive lookups along a branch cost
+    O(new depth). Each entry stores just those new ids plus a reference to the
+    ancestor's entry, so cached paths share their prefixes and memory grows
+    with the number of distinct nodes, not entries x depth. Structural edits
+    that can change ancestry (delete, load) must call `clear`; appending
+    nodes never invalidates existing paths.
+
+    This is deliberately a plain class: as a backend var it is not wrapped in a
+    state proxy, so filling the cache from computed vars does not dirty state.
+    It is not pickled with the state either; a restored index starts empty.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._segments: Dict[str, _Segment] = {}
+        # The last path handed out, for repeated lookups of the same node
+        self._last_id: Optional[str] = None
+        self._last_path: List[str] = []
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"max_entries": self.max_entries}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["max_entries"])
+
+    def path(self, nodes: Dict[str, ChatNode], node_id: str) -> List[str]:
+        """Ids from the root down to `node_id` (callers must not mutate it)."""
+        if node_id == self._last_id:
+            return self._last_path
+        segment = self._segments.get(node_id)
+        if segment is None:
+            suffix = []
+            prefix = None
+            curr = node_id
+            while curr and curr in nodes:
+                prefix = self._segments.get(curr)
+                if prefix is not None:
+                    break
+                suffix.append(curr)
+                curr = nodes[curr].parent_id
+            if not suffix:
+                return []
+            suffix.reverse()
+            segment = _Segment(prefix, suffix)
+            if len(self._segments) >= self.max_entries:
+                # Evict the oldest entry (dicts keep insertion order); entries
+                # below it keep their reference to its segment.
+                self._segments.pop(next(iter(self._segments)))
+            self._segments[node_id] = segment
+        parts = []
+        while segment is not None:
+            parts.append(segment.ids)
+            segment = segment.prefix
+        path = [nid for ids in reversed(parts) for nid in ids]
+        self._last_id = node_id
+        self._last_path = path
+        return path
+
+    def clear(self) -> None:
+        self._segments.clear()
+        self._last_id = None
+        self._last_path = []
@@ -0,0 +1,137 @@
+"""Benchmark: stored-body codecs (see codec.py) and legacy tree JSON parsing.
+
+Usage: PYTHONPATH=. python scripts/bench_codec.py [conversations] [turns]
+Builds synthetic chats with short questions and long, markdown-like answers,
+then reports
+  - encode/decode throughput and size ratio of each available content codec,
+  - json vs orjson on the legacy nested tree dict,
+  - on-disk size (dbstat) and load times after saving the chats per codec.
+Runs against throwaway databases in a temp dir; chat_users.db is not touched.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from reflex_tree import codec, config, database, db_pool
+from reflex_tree.classes import ChatNode, build_tree_dict
+
+_WORDS = (
+    "the a of to and in is for that with on as this be are by it or from can "
+    "function value request response cache tree node model token context user "
+    "database query index latency memory stream update state render message"
+).split()
+
+
+def _prose(rng, words):
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _answer(rng):
+    parts = []
+    for _ in range(rng.randint(2, 8)):
+        if rng.random() < 0.3:
+            body = "\n".join(f"    {rng.choice(_WORDS)} = {rng.choice(_WORDS)}({i})" for i in range(rng.randint(3, 15)))
+            parts.append(f"```python\n{body}\n```")
+        elif rng.random() < 0.3:
+            parts.append("\n".join(f"- {_prose(rng, rng.randint(5, 15))}" for _ in range(rng.randint(2, 6))))
+        else:
+            parts.append(_prose(rng, rng.randint(30, 120)))
+    return "\n\n".join(parts)
+
+
+def _chat(rng, turns):
+    root = ChatNode.create(role="system", content="System Prompt: You are a helpful assistant.")
+    nodes = {root.id: root}
+    parent_id = root.id
+    for i in range(turns * 2):
+        content = _prose(rng, rng.randint(5, 40)) if i % 2 == 0 else _answer(rng)
+        # Sequential ids: random 8-char ids can collide across many chats
+        node = ChatNode(
+            id=f"{root.id}-{i}",
+            role="user" if i % 2 == 0 else "model",
+            content=content,
+            parent_id=parent_id,
+            timestamp=f"{i:08d}",
+        )
+        nodes[node.id] = node
+        nodes[parent_id].children_ids.append(node.id)
+        parent_id = node.id
+    return nodes, root.id
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _table_bytes(conn, prefix):
+    row = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE ?", (prefix + "%",)).fetchone()
+    return row[0] or 0
+
+
+def _codec_throughput(bodies):
+    raw = sum(len(b.encode("utf-8")) for b in bodies)
+    print(f"{'codec':<8}{'encode MB/s':>13}{'decode MB/s':>13}{'stored/raw':>12}")
+    for name in ["none"] + [c.name for c in codec.CODECS.values()]:
+        codec._write_version = codec._writer(name)
+        stored, enc_s = _timed(lambda: [codec.encode(b) for b in bodies])
+        decoded, dec_s = _timed(lambda: [codec.decode(s) for s in stored])
+        assert decoded == bodies
+        size = sum(len(s) if isinstance(s, bytes) else len(s.encode("utf-8")) for s in stored)
+        print(f"{name:<8}{raw / enc_s / 1e6:>13.0f}{raw / dec_s / 1e6:>13.0f}{size / raw:>12.2f}")
+
+
+def _json_throughput(trees):
+    blobs = [json.dumps(tree) for tree in trees]
+    raw = sum(len(b) for b in blobs)
+    _, json_s = _timed(lambda: [json.loads(b) for b in blobs])
+    _, codec_s = _timed(lambda: [codec.load_json(b) for b in blobs])
+    parser = "orjson" if codec.orjson is not None else "json (orjson not installed)"
+    print(f"legacy tree JSON parse: json {raw / json_s / 1e6:.0f} MB/s, {parser} {raw / codec_s / 1e6:.0f} MB/s")
+
+
+def main() -> int:
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = random.Random(0)
+    chats = [_chat(rng, turns) for _ in range(conversations)]
+    bodies = [n.content for nodes, _ in chats for n in nodes.values() if n.role == "model"]
+    print(
+        f"{conversations} chats x {turns} turns, {len(bodies)} answers, "
+        f"mean answer {sum(map(len, bodies)) / len(bodies):.0f} chars, "
+        f"threshold {config.CONTENT_COMPRESS_MIN_BYTES} B\n"
+    )
+    _codec_throughput(bodies)
+    _json_throughput([build_tree_dict(nodes, root_id) for nodes, root_id in chats])
+    print()
+
+    tmp = tempfile.mkdtemp()
+    print(f"{'codec':<8}{'nodes KB':>10}{'fts KB':>10}{'save s':>9}{'load ms':>10}{'skeleton ms':>13}")
+    for name in ["none"] + [c.name for c in codec.CODECS.values()]:
+        codec._write_version = codec._writer(name)
+        database.DB_NAME = os.path.join(tmp, f"{name}.db")
+        database.init_db()
+        _, save_s = _timed(lambda: [database.save_conversation("bench@example.com", nodes, root_id) for nodes, root_id in chats])
+        ids = [root_id for _, root_id in chats]
+        _, load_s = _timed(lambda: [database.load_conversation(cid) for cid in ids])
+        _, skeleton_s = _timed(
+            lambda: [database.load_conversation(cid, preview_chars=config.LAZY_PREVIEW_CHARS) for cid in ids]
+        )
+        with db_pool.connection(database.DB_NAME) as conn:
+            # The full-text index keeps its own uncompressed copy of the text
+            nodes_kb = _table_bytes(conn, "nodes") - _table_bytes(conn, "nodes_fts")
+            fts_kb = _table_bytes(conn, "nodes_fts")
+        print(
+            f"{name:<8}{nodes_kb / 1024:>10.0f}{fts_kb / 1024:>10.0f}{save_s:>9.2f}"
+            f"{load_s / len(ids) * 1000:>10.2f}{skeleton_s / len(ids) * 1000:>13.2f}"
+        )
+    db_pool.close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Benchmark: per-call sqlite3.connect vs the pooled WAL connection layer.
+
+Usage: PYTHONPATH=. python scripts/bench_db.py [iterations]
+Runs against throwaway databases in a temp dir; chat_users.db is not touched.
+"""
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from reflex_tree import database, db_pool
+from reflex_tree.classes import ChatNode
+
+
+def _legacy_authenticate(path, email, password):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute(
+        "SELECT email, total_cost, total_tokens FROM users WHERE email = ? AND password_hash = ?",
+        (email, database.hash_password(password)),
+    )
+    row = c.fetchone()
+    conn.close()
+    return row
+
+
+def _legacy_log_usage(path, email, cost, tokens, session_id, created_at_iso):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO usage_log (email, session_id, cost, tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+        (email, session_id, cost, tokens, created_at_iso),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _ops_per_sec(fn, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return iterations / (time.perf_counter() - start)
+
+
+def main() -> int:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    tmp = tempfile.mkdtemp()
+    email, password = "bench@example.com", "secret"
+    now = datetime.datetime.now().isoformat()
+
+    # Legacy: default rollback journal, new connection per call.
+    database.DB_NAME = os.path.join(tmp, "legacy.db")
+    database.init_db()
+    db_pool.close_all()
+    with sqlite3.connect(database.DB_NAME) as conn:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    database.create_user(email, password)
+    db_pool.close_all()
+    legacy = database.DB_NAME
+    legacy_read = _ops_per_sec(lambda i: _legacy_authenticate(legacy, email, password), iterations)
+    legacy_write = _ops_per_sec(lambda i: _legacy_log_usage(legacy, email, 0.001, 10, "bench", now), iterations)
+
+    # Pooled: WAL, one connection per thread, cached statements.
+    database.DB_NAME = os.path.join(tmp, "pooled.db")
+    database.init_db()
+    database.create_user(email, password)
+    pooled_read = _ops_per_sec(lambda i: database.authenticate_user(email, password), iterations)
+    pooled_write = _ops_per_sec(lambda i: database.log_usage(email, 0.001, 10, "bench", now), iterations)
+
+    root = ChatNode.create(role="system", content="System Prompt: You are a helpful assistant.")
+    nodes = {root.id: root}
+    database.save_conversation(email, nodes, root.id)
+    parent_id = root.id
+
+    def _append(i):
+        nonlocal parent_id
+        node = ChatNode.create(role="user" if i % 2 == 0 else "model", content="x" * 400, parent_id=parent_id)
+        nodes[node.id] = node
+        nodes[parent_id].children_ids.append(node.id)
+        database.save_node(email, nodes, root.id, node.id)
+        parent_id = node.id
+
+    pooled_append = _ops_per_sec(_append, iterations)
+    db_pool.close_all()
+
+    print(f"{'operation':<22}{'legacy ops/s':>14}{'pooled ops/s':>14}{'speedup':>10}")
+    print(f"{'authenticate_user':<22}{legacy_read:>14.0f}{pooled_read:>14.0f}{pooled_read / legacy_read:>9.1f}x")
+    print(f"{'log_usage':<22}{legacy_write:>14.0f}{pooled_write:>14.0f}{pooled_write / legacy_write:>9.1f}x")
+    print(f"{'save_node (append)':<22}{'-':>14}{pooled_append:>14.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""Measure websocket bytes per chat update (Reflex state delta size).
+
+Usage: PYTHONPATH=. python scripts/bench_state_delta.py [turns ...]
+Builds a linear conversation of N Q/A turns through State.add_node and reports
+the serialized delta the backend would push for one more user message, one
+model message, one streaming flush of that model message and a node selection. Runs in a temp dir; no network or
+chat_users.db access.
+"""
+import os
+import sys
+import tempfile
+
+from reflex.utils.format import json_dumps
+
+from reflex_tree import state
+
+
+def _delta_bytes(s) -> int:
+    size = len(json_dumps(s.get_delta()).encode("utf-8"))
+    s._clean()
+    return size
+
+
+def measure(turns: int) -> dict:
+    s = state.State(_reflex_internal_init=True)
+    s._reset_chat()
+    parent = s.current_node_id
+    for i in range(turns):
+        user_id = s.add_node("user", f"Question {i}: " + "why? " * 20, parent)
+        parent = s.add_node("model", f"Answer {i}: " + "Because of reasons. " * 60, user_id)
+    s.current_node_id = parent
+    s._clean()
+
+    user_id = s.add_node("user", "One more question", parent)
+    s.current_node_id = user_id
+    add_user = _delta_bytes(s)
+    model_id = s.add_node("model", "One more answer " * 50, user_id)
+    s.current_node_id = model_id
+    add_model = _delta_bytes(s)
+    s._set_node_content(model_id, "One more answer " * 60)
+    stream = _delta_bytes(s)
+    s.select_node(parent)
+    select = _delta_bytes(s)
+    return {"add_user": add_user, "add_model": add_model, "stream": stream, "select": select}
+
+
+def main() -> int:
+    os.chdir(tempfile.mkdtemp())
+    turns_list = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500]
+    print(f"{'turns':>6}{'add user msg':>15}{'add model msg':>15}{'stream flush':>14}{'select node':>14}   (bytes per delta)")
+    for turns in turns_list:
+        result = measure(turns)
+        print(f"{turns:>6}{result['add_user']:>15}{result['add_model']:>15}{result['stream']:>14}{result['select']:>14}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
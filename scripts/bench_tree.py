@@ -0,0 +1,130 @@
+"""Benchmark: tree (de)serialization and sidebar flattening on synthetic trees.
+
+Usage: PYTHONPATH=. python scripts/bench_tree.py [node counts ...]
+For each size, builds a deep linear chat (one long Q/A chain) and a bushy
+tree (each message answers one of the 50 most recent ones), then times
+flatten_tree / build_tree_dict / tree_index.flatten_subtree and measures the
+memory held per node. The legacy columns reproduce the former recursive,
+pydantic-based implementation. No database or network access.
+"""
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from reflex_tree import tree_index
+from reflex_tree.classes import ChatNode, build_tree_dict, flatten_tree
+
+
+class _LegacyNode(BaseModel):
+    id: str
+    role: str = "user"
+    content: str = ""
+    parent_id: Optional[str] = None
+    children_ids: List[str] = []
+    timestamp: str = ""
+    tokens: int = 0
+    cost: float = 0.0
+    model: Optional[str] = None
+    is_grafted: bool = False
+
+
+def _legacy_flatten_tree(node_data: dict, parent_id: Optional[str] = None) -> dict:
+    nodes = {}
+    current_id = node_data["id"]
+    children_ids = []
+    for child_data in node_data.get("children", []):
+        nodes.update(_legacy_flatten_tree(child_data, parent_id=current_id))
+        children_ids.append(child_data["id"])
+    nodes[current_id] = _LegacyNode(
+        id=current_id,
+        role=node_data.get("role", "user"),
+        content=node_data.get("content", ""),
+        parent_id=parent_id,
+        children_ids=children_ids,
+        timestamp=node_data.get("timestamp", str(uuid.uuid1())),
+        tokens=node_data.get("tokens", 0),
+        cost=node_data.get("cost", 0.0),
+        is_grafted=node_data.get("is_grafted", False),
+        model=node_data.get("model", None),
+    )
+    return nodes
+
+
+def _synthetic_tree(count: int, shape: str) -> tuple:
+    rng = random.Random(count)
+    root = ChatNode.create(role="system", content="System Prompt: You are a helpful assistant.")
+    nodes = {root.id: root}
+    ids = [root.id]
+    for i in range(count - 1):
+        parent_id = ids[-1] if shape == "linear" else rng.choice(ids[-50:])
+        role = "model" if nodes[parent_id].role == "user" else "user"
+        # Sequential ids: random 8-char ids start colliding around 100k nodes
+        node = ChatNode(
+            id=f"n{i}",
+            role=role,
+            content=f"Message {i}: " + "lorem ipsum " * 10,
+            parent_id=parent_id,
+            timestamp=str(uuid.uuid1()),
+        )
+        nodes[node.id] = node
+        nodes[parent_id].children_ids.append(node.id)
+        ids.append(node.id)
+    return nodes, root.id
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _bytes_per_node(fn, count: int) -> float:
+    tracemalloc.start()
+    result = fn()
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / count
+
+
+def _legacy_ms(tree: dict) -> str:
+    try:
+        _, ms = _timed(lambda: _legacy_flatten_tree(tree))
+    except RecursionError:
+        return "RecursionError"
+    return f"{ms:.0f}"
+
+
+def main() -> int:
+    counts = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+    print(
+        f"{'nodes':>8} {'shape':<7}{'flatten ms':>12}{'legacy ms':>16}{'build_dict ms':>15}"
+        f"{'sidebar ms':>12}{'B/node':>9}{'legacy B/node':>15}"
+    )
+    for count in counts:
+        for shape in ("linear", "bushy"):
+            nodes, root_id = _synthetic_tree(count, shape)
+            tree, build_ms = _timed(lambda: build_tree_dict(nodes, root_id))
+            flat, flatten_ms = _timed(lambda: flatten_tree(tree))
+            assert len(flat) == count
+            legacy = _legacy_ms(tree) if count <= 10_000 else "-"
+            _, sidebar_ms = _timed(lambda: tree_index.flatten_subtree(flat, root_id, set()))
+            size = _bytes_per_node(lambda: flatten_tree(tree), count)
+            legacy_size = (
+                f"{_bytes_per_node(lambda: _legacy_flatten_tree(tree), count):.0f}"
+                if shape == "bushy" and count <= 10_000 else "-"
+            )
+            print(
+                f"{count:>8} {shape:<7}{flatten_ms:>12.0f}{legacy:>16}{build_ms:>15.0f}"
+                f"{sidebar_ms:>12.0f}{size:>9.0f}{legacy_size:>15}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
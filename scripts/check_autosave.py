@@ -0,0 +1,207 @@
+"""Checks the durability guarantees documented in reflex_tree/autosave.py.
+
+Usage: PYTHONPATH=. python scripts/check_autosave.py
+Runs against a throwaway database in a temp dir; chat_users.db is not
+touched. Failed writes are simulated by making the database layer raise
+"database is locked" (what SQLite reports once the busy timeout expires).
+Exits non-zero on the first violated guarantee.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from reflex_tree import autosave, database, db_pool
+from reflex_tree.classes import ChatNode
+
+EMAIL = "autosave@example.com"
+
+
+def _chat():
+    root = ChatNode.create(role="system", content="System Prompt: You are a helpful assistant.")
+    nodes = {root.id: root}
+    database.save_conversation(EMAIL, nodes, root.id)
+    return nodes, root.id
+
+
+def _add(nodes, parent_id, content):
+    node = ChatNode.create(role="user", content=content, parent_id=parent_id)
+    nodes[node.id] = node
+    nodes[parent_id].children_ids.append(node.id)
+    return node.id
+
+
+def _stored(root_id, node_id):
+    return database.load_node_contents(root_id, [node_id]).get(node_id)
+
+
+class _Locked:
+    """Makes the next `times` node writes fail like a busy database."""
+
+    def __init__(self, times):
+        self.times = times
+        self._save_nodes = database.save_nodes
+
+    def __enter__(self):
+        def save_nodes(*args, **kwargs):
+            if self.times > 0:
+                self.times -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return self._save_nodes(*args, **kwargs)
+
+        database.save_nodes = save_nodes
+        return self
+
+    def __exit__(self, *exc):
+        database.save_nodes = self._save_nodes
+
+
+def check_coalescing():
+    queue = autosave.AutosaveQueue(window_s=60)
+    nodes, root_id = _chat()
+    ids = [_add(nodes, root_id, f"m{i}") for i in range(5)]
+    for node_id in ids:
+        queue.mark_dirty(EMAIL, root_id, dict(nodes), node_id)
+    queue.flush(root_id)
+    assert queue.writes == 1, queue.writes
+    assert all(_stored(root_id, node_id) for node_id in ids)
+    print("ok  marks within one window are written in one transaction")
+
+
+def check_flush_is_synchronous():
+    queue = autosave.AutosaveQueue(window_s=60)
+    nodes, root_id = _chat()
+    node_id = _add(nodes, root_id, "before flush")
+    queue.mark_dirty(EMAIL, root_id, dict(nodes), node_id)
+    assert _stored(root_id, node_id) is None
+    queue.flush()
+    assert _stored(root_id, node_id) == "before flush"
+    print("ok  flush() has written everything when it returns")
+
+
+def check_failed_write_is_requeued():
+    queue = autosave.AutosaveQueue(window_s=60)
+    nodes, root_id = _chat()
+    first = _add(nodes, root_id, "first")
+    queue.mark_dirty(EMAIL, root_id, dict(nodes), first)
+    with _Locked(times=1):
+        try:
+            queue.flush(root_id)
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError("flush() swallowed the write error")
+    assert _stored(root_id, first) is None
+    # Newer marks merge with the re-queued batch
+    second = _add(nodes, root_id, "second")
+    queue.mark_dirty(EMAIL, root_id, dict(nodes), second)
+    queue.flush(root_id)
+    assert _stored(root_id, first) == "first" and _stored(root_id, second) == "second"
+    assert queue.failures == 1
+    print("ok  a failed write is re-queued, merged with newer marks, and lands later")
+
+
+def check_background_retry():
+    queue = autosave.AutosaveQueue(window_s=0.05)
+    nodes, root_id = _chat()
+    node_id = _add(nodes, root_id, "retried")
+    open_before = len(db_pool._all_connections)
+    with _Locked(times=2):
+        queue.mark_dirty(EMAIL, root_id, dict(nodes), node_id)
+        deadline = time.monotonic() + 5
+        while _stored(root_id, node_id) is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+    assert _stored(root_id, node_id) == "retried", "write was lost after failures"
+    assert queue.failures == 2
+    time.sleep(0.05)  # let the last timer thread finish
+    assert len(db_pool._all_connections) == open_before, "timer threads left connections open"
+    print("ok  scheduled writes retry until they succeed (no event loop)")
+
+
+def check_scheduled_flush_on_loop():
+    queue = autosave.AutosaveQueue(window_s=0.05)
+    nodes, root_id = _chat()
+    node_id = _add(nodes, root_id, "on the loop")
+
+    async def main():
+        queue.mark_dirty(EMAIL, root_id, dict(nodes), node_id)
+        deadline = time.monotonic() + 5
+        seen_task = False
+        while _stored(root_id, node_id) is None and time.monotonic() < deadline:
+            seen_task = seen_task or bool(queue._tasks)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        return seen_task
+
+    seen_task = asyncio.run(main())
+    assert _stored(root_id, node_id) == "on the loop"
+    assert seen_task and not queue._tasks, "scheduled flush task was not tracked until done"
+    print("ok  windowed writes on the event loop keep their task referenced until done")
+
+
+def check_async_flush_keeps_loop_free():
+    queue = autosave.AutosaveQueue(window_s=60)
+    nodes, root_id = _chat()
+    node_id = _add(nodes, root_id, "slow write")
+    queue.mark_dirty(EMAIL, root_id, dict(nodes), node_id)
+    save_nodes = database.save_nodes
+
+    def slow_save_nodes(*args, **kwargs):
+        time.sleep(0.3)
+        return save_nodes(*args, **kwargs)
+
+    async def main():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        beat = asyncio.create_task(heartbeat())
+        await queue.flush_async(root_id)
+        beat.cancel()
+        return ticks
+
+    database.save_nodes = slow_save_nodes
+    try:
+        ticks = asyncio.run(main())
+    finally:
+        database.save_nodes = save_nodes
+    assert ticks >= 10, f"event loop stalled during flush ({ticks} ticks)"
+    assert _stored(root_id, node_id) == "slow write"
+    print("ok  flush_async() writes on the thread pool; the event loop keeps running")
+
+
+def check_ordering():
+    queue = autosave.AutosaveQueue(window_s=60)
+    nodes, root_id = _chat()
+    node_id = _add(nodes, root_id, "v1")
+    queue.mark_dirty(EMAIL, root_id, dict(nodes), node_id)
+    queue.flush(root_id)
+    nodes[node_id].content = "v2"
+    queue.mark_dirty(EMAIL, root_id, dict(nodes), node_id)
+    queue.flush(root_id)
+    queue.flush(root_id)  # nothing pending: must not rewrite an older version
+    assert _stored(root_id, node_id) == "v2"
+    print("ok  later batches are never overwritten by earlier ones")
+
+
+def main() -> int:
+    database.DB_NAME = os.path.join(tempfile.mkdtemp(), "autosave.db")
+    database.init_db()
+    check_coalescing()
+    check_flush_is_synchronous()
+    check_failed_write_is_requeued()
+    check_background_retry()
+    check_scheduled_flush_on_loop()
+    check_async_flush_keeps_loop_free()
+    check_ordering()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
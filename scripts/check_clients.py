@@ -0,0 +1,89 @@
+"""Checks that evicting a provider client never closes it under a running request.
+
+Usage: PYTHONPATH=. python scripts/check_clients.py
+Uses dummy API keys; no request leaves the machine. A "stream" here is a
+generator holding `clients.lease` across its yields, like State._stream_*.
+Exits non-zero on the first violated guarantee.
+"""
+import asyncio
+import sys
+
+from reflex_tree import clients, config
+
+
+async def _stream(provider, api_key, chunks):
+    with clients.lease(provider, api_key) as client:
+        for i in range(chunks):
+            await asyncio.sleep(0)
+            yield client, i
+
+
+async def _settle():
+    # Close tasks run on the loop; give them a few turns
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def check_cap_eviction():
+    clients.clear_clients()
+    config.CLIENT_POOL_SIZE = 1
+    stream = _stream("openai", "sk-cap-1", 3)
+    client, _ = await stream.__anext__()
+    other = clients.get_client("openai", "sk-cap-2")  # pushes the leased client out
+    await _settle()
+    assert not client.is_closed(), "leased client closed by the LRU cap"
+    async for _ in stream:
+        pass
+    await _settle()
+    assert client.is_closed(), "evicted client not closed after its last lease"
+    assert not other.is_closed()
+    print("ok  a client evicted by the cap stays open until its stream ends")
+
+
+async def check_idle_eviction():
+    clients.clear_clients()
+    config.CLIENT_POOL_SIZE = 64
+    config.CLIENT_IDLE_TIMEOUT_S = 0
+    stream = _stream("anthropic", "sk-idle-1", 3)
+    client, _ = await stream.__anext__()
+    clients.get_client("anthropic", "sk-idle-2")  # sweeps the idle leased client
+    await _settle()
+    assert not client.is_closed(), "leased client closed by the idle sweep"
+    await stream.aclose()  # stopped early: the lease is released in finally
+    await _settle()
+    assert client.is_closed(), "evicted client not closed after the stream stopped"
+    print("ok  a client evicted while idle stays open until its stream is stopped")
+
+
+async def check_shared_leases():
+    clients.clear_clients()
+    config.CLIENT_POOL_SIZE = 64
+    config.CLIENT_IDLE_TIMEOUT_S = 900
+    first = _stream("openai", "sk-shared", 2)
+    second = _stream("openai", "sk-shared", 2)
+    client, _ = await first.__anext__()
+    same, _ = await second.__anext__()
+    assert client is same
+    clients.clear_clients()
+    await first.aclose()
+    await _settle()
+    assert not client.is_closed(), "client closed while another stream still holds it"
+    await second.aclose()
+    await _settle()
+    assert client.is_closed()
+    unleased = clients.get_client("openai", "sk-plain")
+    clients.clear_clients()
+    await _settle()
+    assert unleased.is_closed(), "unleased evicted client left open"
+    print("ok  a shared client is closed only after every lease is released")
+
+
+async def main() -> int:
+    await check_cap_eviction()
+    await check_idle_eviction()
+    await check_shared_leases()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,62 @@
+"""Local stand-in for the Tavily search API, for development and smoke tests.
+
+Usage: python scripts/search_stub.py [port] [delay_ms]
+Then start the app with SEARCH_API_URL=http://127.0.0.1:<port>/search.
+Every query returns three canned results that echo the query back; requests
+with api_key "invalid" get a 401. delay_ms simulates network latency.
+"""
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SearchStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    delay_s = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send(400, {"error": "invalid JSON"})
+            return
+        if body.get("api_key") == "invalid":
+            self._send(401, {"error": "invalid api key"})
+            return
+        time.sleep(self.delay_s)
+        query = body.get("query", "")
+        results = [
+            {
+                "title": f"Result {i} for {query}",
+                "url": f"https://example.com/{i}",
+                "content": f"Stub content {i} about {query}.",
+            }
+            for i in range(1, min(int(body.get("max_results", 3)), 3) + 1)
+        ]
+        self._send(200, {"query": query, "results": results})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main() -> int:
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    SearchStubHandler.delay_s = (float(sys.argv[2]) if len(sys.argv) > 2 else 0.0) / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), SearchStubHandler)
+    print(f"Search stub listening on http://127.0.0.1:{port}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())